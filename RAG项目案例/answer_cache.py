@@ -0,0 +1,145 @@
+"""
+语义回答缓存: 放在整条问答链前面, 与已回答过的问题足够相似(余弦相似度 >= config.answer_cache_threshold)时
+直接返回上次的回答, 跳过检索和模型生成
+
+问题向量和回答保存在进程内的矩阵中(超过 config.answer_cache_size 条时覆盖最早的),
+知识库版本号变化(入库/删除)时整个缓存清空, 不会返回基于旧资料的回答
+默认只在会话没有历史消息时使用(config.answer_cache_with_history), 追问的含义依赖上下文, 不能只看问题本身
+"""
+import threading
+import time
+
+import numpy as np
+
+import config_data as config
+from kb_version import get_kb_version
+from retrieval_cache import normalize_question
+
+
+class SemanticAnswerCache(object):
+    def __init__(self, embedding, threshold=None, max_size=None, get_version=None):
+        """
+        embedding: 问题的嵌入模型(与检索共用带缓存的嵌入模型, 检索时不会重复向量化)
+        threshold: 命中所需的最小余弦相似度
+        max_size: 最多缓存的回答数量
+        get_version: 返回知识库版本号的函数
+        """
+        self.embedding = embedding
+        self.threshold = threshold or config.answer_cache_threshold
+        self.max_size = max_size or config.answer_cache_size
+        self.get_version = get_version or get_kb_version
+        self._lock = threading.Lock()
+        self._vectors = None #(max_size, dim) 单位向量
+        self._answers = [None] * self.max_size
+        self._questions = {} #规范化的问题 -> 行号, 完全相同的问题不必计算相似度
+        self._row_questions = [None] * self.max_size #行号 -> 规范化的问题
+        self._count = 0 #已写入的总条数, 行号为 count % max_size
+        self._version = None
+        self._hits = 0
+        self._misses = 0
+        self._hit_seconds = 0.0
+        self._miss_seconds = 0.0 #未命中的问答(检索 + 生成)的总耗时
+        self._miss_answers = 0
+
+    def _check_version(self, version):
+        #已持有 self._lock
+        if version != self._version:
+            self._vectors = None
+            self._answers = [None] * self.max_size
+            self._questions = {}
+            self._row_questions = [None] * self.max_size
+            self._count = 0
+            self._version = version
+
+    def _search(self, question, vector, version):
+        with self._lock:
+            self._check_version(version)
+            row = self._questions.get(normalize_question(question))
+            if row is not None:
+                return self._answers[row], 1.0
+            if self._vectors is None:
+                return None, 0.0
+            rows = min(self._count, self.max_size)
+            scores = self._vectors[:rows] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                return self._answers[best], float(scores[best])
+            return None, float(scores[best])
+
+    def _record(self, hit, start):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if hit:
+                self._hits += 1
+                self._hit_seconds += elapsed
+            else:
+                self._misses += 1
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, question):
+        """
+        返回 (缓存的回答或 None, 问题向量, 知识库版本号); 未命中时把后两者传给 store
+        """
+        start = time.perf_counter()
+        version = self.get_version()
+        vector = self._normalize(self.embedding.embed_query(question))
+        answer, _ = self._search(question, vector, version)
+        self._record(answer is not None, start)
+        return answer, vector, version
+
+    async def alookup(self, question):
+        start = time.perf_counter()
+        version = self.get_version()
+        vector = self._normalize(await self.embedding.aembed_query(question))
+        answer, _ = self._search(question, vector, version)
+        self._record(answer is not None, start)
+        return answer, vector, version
+
+    def store(self, question, answer, vector, version, elapsed=None):
+        """
+        保存一次完整问答的结果
+        version: 查询缓存时的知识库版本号, 期间知识库发生了变化时不写入
+        elapsed: 这次检索 + 生成的耗时, 用于估算命中时节省的时间
+        """
+        if not answer:
+            return
+        with self._lock:
+            if elapsed is not None:
+                self._miss_seconds += elapsed
+                self._miss_answers += 1
+            if version != self._version:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+            row = self._count % self.max_size
+            if self._questions.get(self._row_questions[row]) == row: #覆盖最早的一条
+                del self._questions[self._row_questions[row]]
+            key = normalize_question(question)
+            self._vectors[row] = vector
+            self._answers[row] = answer
+            self._row_questions[row] = key
+            self._questions[key] = row
+            self._count += 1
+
+    def stats(self):
+        """
+        命中率和节省的时间: 每次命中节省 (未命中时的平均耗时 - 命中时的平均耗时)
+        """
+        with self._lock:
+            total = self._hits + self._misses
+            miss_latency = self._miss_seconds / self._miss_answers if self._miss_answers else 0.0
+            hit_latency = self._hit_seconds / self._hits if self._hits else 0.0
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0,
+                "size": min(self._count, self.max_size),
+                "hit_latency": hit_latency,
+                "miss_latency": miss_latency,
+                "saved_seconds": max(0.0, miss_latency - hit_latency) * self._hits,
+            }
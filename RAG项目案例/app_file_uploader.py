@@ -1,55 +1,61 @@
-import time
 import streamlit as st
-import pdfplumber
-from docx import Document
-from io import BytesIO
-from knowledge_base import KnowledgeBaseService
+from services import get_knowledge_base_service, start_warm_up
+from ingest_jobs import get_ingest_queue, QUEUED, RUNNING
+
+start_warm_up(get_knowledge_base_service) #整个进程只创建一次知识库服务
 
 st.title("知识库更新服务")
 
 #streamlit 当代码发生变化，会重新运行
 
 # st.session_state 用于在不同的交互中保存状态, 是一个字典
+# 这里只记录已经提交过的上传文件 id, 避免页面重新运行时重复提交;
+# 任务本身在进程内共享的队列中, 进度表直接从队列读取, 刷新页面、换一个浏览器会话也能看到正在进行的任务
+if "submitted_files" not in st.session_state:
+    st.session_state["submitted_files"] = set()
 
 
 #file_uploader
-uploader_file = st.file_uploader(
+uploader_files = st.file_uploader(
     "上传文件", type=["txt", "pdf", "docx"],
-    accept_multiple_files= False,
+    accept_multiple_files= True,
 )
 
-if "service" not in st.session_state:
-    st.session_state["service"] = KnowledgeBaseService() #创建知识库服务实例对象
-
-
-if uploader_file is not None:
-    file_name = uploader_file.name
-    file_type = uploader_file.type
-    file_size = uploader_file.size /1024 # 转换为KB
-
-    st.subheader(f"文件名:{file_name}")
-    st.write(f"文件类型:{file_type}")
-    st.write(f"文件大小:{file_size:.2f} KB")
-
-    text = ""
-    if file_name.endswith(".pdf"):
-        with pdfplumber.open(BytesIO(uploader_file.getvalue())) as pdf:
-            text = "\n".join(page.extract_text() or "" for page in pdf.pages)
-    elif file_name.endswith(".docx"):
-        doc = Document(BytesIO(uploader_file.getvalue()))
-        text = "\n".join(p.text for p in doc.paragraphs)
-    else:
-        # txt 文件:尝试多种编码
-        raw = uploader_file.getvalue()
-        for encoding in ("utf-8", "gbk", "gb2312"):
-            try:
-                text = raw.decode(encoding)
-                break
-            except (UnicodeDecodeError, LookupError):
-                continue
-
-    with st.spinner("正在上传并处理文件..."):
-        time.sleep(1) # 模拟处理时间
-        result = st.session_state["service"].upload_by_str(text, file_name)
-        st.write(result)
-
+queue = get_ingest_queue()
+
+#新上传的文件立即加入后台队列, 已经提交过的文件(同一个 file_id)在重新运行时不会重复提交
+for uploader_file in uploader_files or []:
+    if uploader_file.file_id not in st.session_state["submitted_files"]:
+        queue.submit(uploader_file, uploader_file.name, uploader_file.size)
+        st.session_state["submitted_files"].add(uploader_file.file_id)
+
+
+active = any(job["status"] in (QUEUED, RUNNING) for job in queue.list())
+
+
+@st.fragment(run_every=1 if active else None) #有未完成的任务时每秒只刷新进度表, 不重新运行整个页面
+def show_jobs():
+    jobs = queue.list() #最新提交的在前
+    if not jobs:
+        return
+    st.subheader("入库任务")
+    st.dataframe(
+        [
+            {
+                "文件名": job["filename"],
+                "大小(KB)": round(job["size"] / 1024, 2),
+                "状态": job["status"],
+                "已解析页/块": job["blocks"],
+                "已向量化片段": job["chunks"],
+                "用时(秒)": round(job["seconds"], 1),
+                "结果": job["result"] or job["error"] or "",
+            }
+            for job in jobs
+        ],
+        hide_index=True,
+    )
+    if active and not any(job["status"] in (QUEUED, RUNNING) for job in jobs):
+        st.rerun() #全部结束, 重新运行整个页面以停止轮询
+
+
+show_jobs()
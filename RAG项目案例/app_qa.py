@@ -1,22 +1,53 @@
 import streamlit as st 
-import time 
-from rag import RagService
-import config_data as config 
+import uuid
+from async_runner import iterate_async
+from metrics import get_metrics
+from services import get_rag_service, start_warm_up
+from file_history_store import get_history
+
+start_warm_up(get_rag_service) #整个进程只预热一次, 之后的访问者直接使用共享的服务
 
 #title 
 st.title("智能客服")
 st.divider() 
 
+#可选的调试面板: 各阶段耗时的 p50/p95/p99
+with st.sidebar:
+    show_stats = st.checkbox("显示性能统计")
+    if show_stats:
+        snapshot = get_metrics().snapshot()
+        rows = []
+        for stage, stats in snapshot.items():
+            scale = 1 if stage == "model_tokens_per_sec" else 1000 #耗时显示为毫秒, 速度显示为 token/秒
+            rows.append({
+                "阶段": stage,
+                "次数": stats["count"],
+                "p50": round(stats["p50"] * scale, 1),
+                "p95": round(stats["p95"] * scale, 1),
+                "p99": round(stats["p99"] * scale, 1),
+            })
+        st.table(rows)
+
 
-if "msg" not in st.session_state:
-    st.session_state["msg"] = [{"role": "assistant", "content": "你好,有什么可以帮你"}]
+#每个浏览器使用自己的会话 id, 保存在地址栏参数中, 刷新页面后继续同一个会话
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = st.query_params.get("sid") or uuid.uuid4().hex
+    st.query_params["sid"] = st.session_state["session_id"]
+session_config = {"configurable": {"session_id": st.session_state["session_id"]}}
 
 
-if "rag" not in st.session_state:
-    st.session_state["rag"] = RagService()
+#语义回答缓存的命中率和节省的时间
+if show_stats and get_rag_service().answer_cache is not None:
+    cache_stats = get_rag_service().answer_cache.stats()
+    st.sidebar.write(
+        f"回答缓存: 命中 {cache_stats['hits']} 次 / 未命中 {cache_stats['misses']} 次, "
+        f"命中率 {cache_stats['hit_rate']:.1%}, 共节省 {cache_stats['saved_seconds']:.1f} 秒"
+    )
 
-for msg in st.session_state["msg"]:
-    st.chat_message(msg["role"]).write(msg["content"])
+#对话记录直接从会话历史读取(热点会话在进程内缓存中), 不在 session_state 中另存一份
+st.chat_message("assistant").write("你好,有什么可以帮你")
+for msg in get_history(st.session_state["session_id"]).messages:
+    st.chat_message("user" if msg.type == "human" else "assistant").write(msg.content)
 
 
 #在页面提供用户输入
@@ -25,12 +56,12 @@ prompt = st.chat_input()
 if prompt:
 
     st.chat_message("user").write(prompt)
-    st.session_state["msg"].append({"role": "user", "content": prompt})
 
+    #问答服务在进程内共享, 会话中只保存会话 id; 服务还在预热时在这里等待
     with st.spinner("助手思考中"):
-        time.sleep(1)
+        rag = get_rag_service()
 
-    res_stream = st.session_state["rag"].chain.stream({"question": prompt}, config.session_config)
-    res = st.chat_message("assistant").write_stream(res_stream)
-    st.session_state["msg"].append({"role": "assistant", "content": res})
+    #异步链路: 会话历史和检索并发执行, 所有会话共用一个后台事件循环
+    res_stream = iterate_async(rag.astream({"question": prompt}, session_config)) #回答结束后写入会话历史
+    st.chat_message("assistant").write_stream(res_stream)
 
@@ -0,0 +1,56 @@
+"""
+进程内共享的后台事件循环: Streamlit 的脚本是同步执行的, 通过这里把异步生成器转成同步迭代器,
+所有会话的异步请求都在同一个事件循环中并发执行
+"""
+import asyncio
+import queue
+import threading
+
+_loop = None #后台事件循环, 第一次使用时启动
+_loop_lock = threading.Lock()
+_DONE = object()
+
+
+def get_event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-runner", daemon=True).start()
+    return _loop
+
+
+def run_async(coroutine):
+    """
+    在后台事件循环中执行协程, 阻塞等待结果
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+def iterate_async(async_iterable):
+    """
+    在后台事件循环中消费异步可迭代对象, 以同步生成器的方式逐个产出元素
+    调用方提前停止迭代时(例如 Streamlit 页面重新运行), 取消后台任务
+    """
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in async_iterable:
+                items.put((item, None))
+        except BaseException as error:
+            items.put((_DONE, error))
+            raise
+        items.put((_DONE, None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_event_loop())
+    try:
+        while True:
+            item, error = items.get()
+            if item is _DONE:
+                if error is not None and not isinstance(error, asyncio.CancelledError):
+                    raise error
+                return
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,69 @@
+"""
+IVF 近似检索基准测试: 报告训练时间、索引内存、每秒查询数和相对精确检索的 recall@k
+
+语料与 bench_quantization.py 相同(簇中心加噪声的合成向量)
+
+用法: python bench_ann.py [--n 1000000] [--dim 256] [--k 10] [--queries 200] [--nprobe 1 4 16 64] [--quantization none]
+"""
+import argparse
+import tempfile
+import time
+
+from bench_quantization import make_corpus
+from mmap_vector_store import MmapVectorStore
+
+
+def run(store, queries, k, **kwargs):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        docs = store.similarity_search_by_vectors([query], k=k, **kwargs)[0]
+        results.append({doc.id for doc, _ in docs})
+    return results, len(queries) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF 近似检索与精确检索的对比")
+    parser.add_argument("--n", type=int, default=1000000, help="片段数量")
+    parser.add_argument("--dim", type=int, default=256, help="向量维度")
+    parser.add_argument("--k", type=int, default=10, help="recall@k 的 k")
+    parser.add_argument("--queries", type=int, default=200, help="检索次数")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64], help="要测试的 nprobe")
+    parser.add_argument("--nlist", type=int, default=0, help="聚类数量, 0 表示 4 * sqrt(n)")
+    parser.add_argument("--quantization", default="none", help="none / float16 / int8")
+    args = parser.parse_args()
+
+    vectors, queries = make_corpus(args.n, args.dim)
+    queries = queries[:args.queries]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        #先写入全部数据再训练, 避免写入途中按阈值自动训练
+        store = MmapVectorStore(None, persist_directory=tmp, quantization=args.quantization, ann_index="none")
+        start = time.perf_counter()
+        for offset in range(0, args.n, 10000):
+            end = min(offset + 10000, args.n)
+            store.add_embeddings([str(i) for i in range(offset, end)], [""] * (end - offset), vectors[offset:end])
+        print(f"写入 {args.n} 行: {time.perf_counter() - start:.1f} s")
+        del vectors
+
+        store = MmapVectorStore(None, persist_directory=tmp, quantization=args.quantization, ann_index="ivf")
+        start = time.perf_counter()
+        store.build_ann_index(args.nlist or None)
+        print(
+            f"IVF 训练 + 分配: {time.perf_counter() - start:.1f} s  聚类 {len(store.ann.lists)}  "
+            f"索引内存 {store.ann.nbytes() / 2 ** 20:.1f} MB"
+        )
+
+        #增量写入: 训练后新写入的行直接分配到聚类
+        extra, _ = make_corpus(1000, args.dim, seed=1)
+        start = time.perf_counter()
+        for offset in range(0, 1000, 10):
+            store.add_embeddings([f"extra-{i}" for i in range(offset, offset + 10)], [""] * 10, extra[offset:offset + 10])
+        print(f"增量写入 1000 行(每批 10 行): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        exact, exact_qps = run(store, queries, args.k, exact=True)
+        print(f"精确检索          {exact_qps:8.1f} 次/秒")
+        for nprobe in args.nprobe:
+            results, qps = run(store, queries, args.k, nprobe=nprobe)
+            recall = sum(len(a & b) for a, b in zip(results, exact)) / (args.k * len(queries))
+            print(f"IVF nprobe={nprobe:<4}   {qps:8.1f} 次/秒  recall@{args.k} {recall:.4f}")
@@ -0,0 +1,67 @@
+"""
+会话历史并发基准测试: 多个线程同时为不同会话追加问答并读取最近几轮, 对比 JSONL 文件与 SQLite 两种存储
+
+用法: python bench_chat_history.py [--threads 1 8 32] [--sessions 2000] [--turns 20]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from file_history_store import FileChatMessageHistory
+from sqlite_history_store import ConnectionPool, SqliteChatMessageHistory, migrate
+
+
+def run(make_history, n_threads, n_sessions, n_turns):
+    """
+    每个线程负责一部分会话, 每轮: 读取最近 12 条消息, 追加一问一答; 返回每秒完成的轮数
+    """
+    def worker(index):
+        for turn in range(n_turns):
+            for session in range(index, n_sessions, n_threads):
+                history = make_history(f"session-{session}")
+                history.tail(12)
+                history.add_messages([HumanMessage(f"问题 {turn}: " + "问" * 50), AIMessage(f"回答 {turn}: " + "答" * 200)])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return n_sessions * n_turns / (time.perf_counter() - start)
+
+
+def bench(n_threads, n_sessions, n_turns):
+    with tempfile.TemporaryDirectory() as tmp:
+        file_dir = os.path.join(tmp, "chat_history")
+        file_qps = run(lambda sid: FileChatMessageHistory(file_dir, sid), n_threads, n_sessions, n_turns)
+
+        pool = ConnectionPool(os.path.join(tmp, "chat_history.db"), size=n_threads)
+        sqlite_qps = run(lambda sid: SqliteChatMessageHistory(sid, pool), n_threads, n_sessions, n_turns)
+        pool.close()
+
+        #从文件导入到新数据库的耗时
+        migrate_pool = ConnectionPool(os.path.join(tmp, "migrated.db"))
+        start = time.perf_counter()
+        sessions_count, messages_count = migrate(file_dir, migrate_pool)
+        migrate_seconds = time.perf_counter() - start
+        migrate_pool.close()
+
+    print(
+        f"threads={n_threads:<4} 文件 {file_qps:8.0f} 轮/秒  SQLite {sqlite_qps:8.0f} 轮/秒  "
+        f"导入 {sessions_count} 个会话 {messages_count} 条消息 {migrate_seconds:.2f} 秒"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会话历史存储的并发读写吞吐")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32], help="并发线程数")
+    parser.add_argument("--sessions", type=int, default=2000, help="会话数量")
+    parser.add_argument("--turns", type=int, default=20, help="每个会话的轮数")
+    args = parser.parse_args()
+    for n_threads in args.threads:
+        bench(n_threads, args.sessions, args.turns)
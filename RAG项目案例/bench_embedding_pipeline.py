@@ -0,0 +1,32 @@
+"""
+向量化流水线基准测试: 使用本地假嵌入模型(模拟网络延迟和逐条处理时间), 比较不同批大小和并发数下的吞吐
+
+用法: python bench_embedding_pipeline.py [片段数量]   默认 2000
+"""
+import sys
+
+from fake_embeddings import HashEmbeddings
+from knowledge_base import EmbeddingPipeline
+
+
+def bench(n, batch_size, max_workers, latency=0.05, text_latency=0.005):
+    embedding = HashEmbeddings(size=256, latency=latency, text_latency=text_latency)
+    written = []
+
+    def writer(ids, texts, embeddings, metadatas):
+        written.extend(ids)
+
+    pipeline = EmbeddingPipeline(embedding, writer, batch_size=batch_size, max_workers=max_workers)
+    items = ((str(i), f"片段{i}", {"source": "bench"}) for i in range(n))
+    stats = pipeline.run(items)
+    assert len(written) == n
+    print(
+        f"batch_size={batch_size:<3} workers={max_workers:<3} "
+        f"{stats['seconds']:.2f} s  {stats['chunks_per_sec']:.1f} 片段/秒  调用次数={embedding.calls}"
+    )
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for batch_size, max_workers in [(n, 1), (10, 1), (10, 4), (10, 8), (25, 8)]:
+        bench(n, batch_size, max_workers)
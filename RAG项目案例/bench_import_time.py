@@ -0,0 +1,78 @@
+"""
+冷启动导入耗时基准测试: 每次在新的 Python 进程中导入, 统计导入耗时和最慢的模块
+
+app_qa / app_file_uploader 是 Streamlit 页面脚本, 直接导入会执行页面逻辑,
+这里只执行脚本顶层的 import 语句, 即每次页面冷启动时必须付出的部分
+
+用法: python bench_import_time.py [--targets app_qa app_file_uploader knowledge_base] [--repeat 5] [--top 8]
+"""
+import argparse
+import ast
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_source(target):
+    """
+    导入 target 需要执行的代码: 页面脚本取顶层的 import 语句, 其他模块直接 import
+    """
+    path = os.path.join(HERE, f"{target}.py")
+    if target.startswith("app_"):
+        with open(path, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+        return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+    return f"import {target}"
+
+
+def measure(target):
+    """
+    在新进程中导入一次, 返回 (耗时秒数, [(累计微秒, 模块名)])
+    """
+    code = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        + import_source(target) + "\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        #import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2][1:] #嵌套导入的模块名前有缩进, 每层两个空格
+            if name == "time":
+                modules = [] #之前是解释器启动时的导入, 不计入
+                continue
+            modules.append((int(parts[1]), name))
+    return float(result.stdout.strip().splitlines()[-1]), modules
+
+
+def bench(target, repeat, top):
+    times = []
+    modules = []
+    for _ in range(repeat):
+        seconds, modules = measure(target)
+        times.append(seconds)
+    print(f"{target:<20} 中位数 {statistics.median(times) * 1000:8.1f} ms  最快 {min(times) * 1000:8.1f} ms")
+    #只列出前两层的导入, 看是哪个依赖拖慢了启动
+    shallow = sorted((item for item in modules if not item[1].startswith("    ")), reverse=True)[:top]
+    for cumulative, name in shallow:
+        print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="冷启动导入耗时")
+    parser.add_argument("--targets", nargs="+", default=["app_qa", "app_file_uploader", "knowledge_base", "rag"], help="页面脚本或模块名")
+    parser.add_argument("--repeat", type=int, default=5, help="每个目标导入的次数")
+    parser.add_argument("--top", type=int, default=8, help="列出最慢的顶层导入数量")
+    args = parser.parse_args()
+    for target in args.targets:
+        bench(target, args.repeat, args.top)
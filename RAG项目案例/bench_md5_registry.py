@@ -0,0 +1,95 @@
+"""
+去重登记表基准测试: 对比旧版 md5.txt 线性扫描与 Md5Registry 的查询/写入耗时
+
+用法: python bench_md5_registry.py [数量 ...]   默认 100000 1000000
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+from md5_registry import Md5Registry
+
+
+def make_hashes(n, salt="h"):
+    return [hashlib.md5(f"{salt}{i}".encode("utf-8")).hexdigest() for i in range(n)]
+
+
+def legacy_check(path, md5_str):
+    #与旧版 check_md5 相同的线性扫描
+    for line in open(path, "r", encoding="utf-8").readlines():
+        if line.strip() == md5_str:
+            return True
+    return False
+
+
+def bench(n, probes=10000, legacy_probes=20):
+    hashes = make_hashes(n)
+    misses = make_hashes(probes, salt="miss")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "md5.txt")
+        with open(legacy_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(hashes) + "\n")
+
+        db_path = os.path.join(tmp, "md5.db")
+
+        #1. 从旧文件导入并加载到内存
+        start = time.perf_counter()
+        registry = Md5Registry(db_path, legacy_path=legacy_path)
+        import_cost = time.perf_counter() - start
+        registry.close()
+
+        #2. 已有数据库时的冷启动加载
+        start = time.perf_counter()
+        registry = Md5Registry(db_path)
+        load_cost = time.perf_counter() - start
+
+        #3. 查询: 命中与未命中
+        step = max(1, n // probes)
+        hit_keys = hashes[::step][:probes]
+        start = time.perf_counter()
+        for h in hit_keys:
+            assert registry.contains(h)
+        hit_cost = (time.perf_counter() - start) / len(hit_keys)
+
+        start = time.perf_counter()
+        for h in misses:
+            assert not registry.contains(h)
+        miss_cost = (time.perf_counter() - start) / len(misses)
+
+        #4. 单条写入(每条一个事务)
+        new_keys = make_hashes(probes, salt="new")
+        start = time.perf_counter()
+        for h in new_keys:
+            registry.add(h)
+        insert_cost = (time.perf_counter() - start) / len(new_keys)
+
+        #5. 批量写入
+        bulk_keys = make_hashes(n, salt="bulk")
+        start = time.perf_counter()
+        registry.add_many(bulk_keys)
+        bulk_cost = (time.perf_counter() - start) / len(bulk_keys)
+        registry.close()
+
+        #6. 旧版线性扫描, 只取少量样本
+        start = time.perf_counter()
+        for h in misses[:legacy_probes]:
+            legacy_check(legacy_path, h)
+        legacy_cost = (time.perf_counter() - start) / legacy_probes
+
+    print(f"n = {n}")
+    print(f"  导入 md5.txt:        {import_cost:.3f} s")
+    print(f"  冷启动加载:          {load_cost:.3f} s")
+    print(f"  查询(命中):          {hit_cost * 1e6:.2f} us/次")
+    print(f"  查询(未命中):        {miss_cost * 1e6:.2f} us/次")
+    print(f"  单条写入:            {insert_cost * 1e6:.2f} us/次")
+    print(f"  批量写入:            {bulk_cost * 1e6:.2f} us/条")
+    print(f"  旧版线性扫描(未命中): {legacy_cost * 1e6:.2f} us/次")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    for size in sizes:
+        bench(size)
@@ -0,0 +1,81 @@
+"""
+元数据过滤检索基准测试: 对比元数据索引与逐行比较元数据(不使用索引)的单文件过滤检索延迟
+
+每个文件 100 个片段, 语料越大文件越多, 单个文件的过滤条件越精确
+--ingest: 只测元数据索引的写入, 每批 10 行, 输出每个区间的平均每批耗时, 应当不随总行数增长
+
+用法: python bench_metadata_filter.py [--sizes 100000 400000] [--dim 256] [--queries 50] [--ingest 1000000]
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from metadata_index import MetadataIndex
+from mmap_vector_store import MmapVectorStore, normalize
+
+
+def bench(n, dim, n_queries):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MmapVectorStore(None, persist_directory=tmp, ann_index="none")
+        for start in range(0, n, 10000):
+            end = min(start + 10000, n)
+            metadatas = [
+                {"source": f"file-{i // 100}.txt", "create_time": f"2024-{1 + i * 12 // n:02d}-01 00:00:00"}
+                for i in range(start, end)
+            ]
+            store.add_embeddings([str(i) for i in range(start, end)], [""] * (end - start),
+                                 normalize(rng.standard_normal((end - start, dim), dtype=np.float32)), metadatas)
+
+        queries = normalize(rng.standard_normal((n_queries, dim), dtype=np.float32))
+        sources = [f"file-{i}.txt" for i in rng.integers(0, n // 100, n_queries)]
+        cases = {
+            "单个文件": lambda i: {"source": sources[i]},
+            "一个月": lambda i: {"create_time": {"$gte": "2024-03-01", "$lt": "2024-04-01"}},
+        }
+        for name, make_filter in cases.items():
+            start = time.perf_counter()
+            for i, query in enumerate(queries):
+                store.similarity_search_by_vectors([query], k=4, filter=make_filter(i))
+            indexed = (time.perf_counter() - start) / n_queries * 1000
+
+            #不使用索引: 逐行读取元数据比较, 再在匹配的行上检索
+            start = time.perf_counter()
+            for i, query in enumerate(queries[:5]):
+                rows = store._match_rows(np.flatnonzero(store.alive[:store.count]), make_filter(i))
+                store._search(query[None, :], 4, rows)
+            scanned = (time.perf_counter() - start) / 5 * 1000
+            print(f"n={n:<8} {name:<6} 索引 {indexed:8.2f} ms  逐行比较 {scanned:9.1f} ms")
+        print(f"n={n:<8} 元数据索引内存 {store.meta_index.nbytes() / 2 ** 20:.1f} MB")
+
+
+def bench_ingest(n, batch=10, report_every=100000):
+    with tempfile.TemporaryDirectory() as tmp:
+        index = MetadataIndex(tmp)
+        last = time.perf_counter()
+        for start in range(0, n, batch):
+            #operator 每行相同, 它的行号列表随总行数一直增长
+            index.add(start, [
+                {"source": f"file-{i // 100}.txt", "operator": "admin", "create_time": "2024-01-01 00:00:00"}
+                for i in range(start, start + batch)
+            ])
+            if (start + batch) % report_every == 0:
+                now = time.perf_counter()
+                print(f"n={start + batch:<8} 每批 {batch} 行 {(now - last) / (report_every / batch) * 1000:.3f} ms")
+                last = now
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="元数据过滤检索的延迟")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 400000], help="片段数量")
+    parser.add_argument("--dim", type=int, default=256, help="向量维度")
+    parser.add_argument("--queries", type=int, default=50, help="检索次数")
+    parser.add_argument("--ingest", type=int, help="只测元数据索引写入, 写入的总行数")
+    args = parser.parse_args()
+    if args.ingest:
+        bench_ingest(args.ingest)
+        raise SystemExit
+    for n in args.sizes:
+        bench(n, args.dim, args.queries)
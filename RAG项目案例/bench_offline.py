@@ -0,0 +1,247 @@
+"""
+离线基准测试: 不调用 DashScope, 用按文本哈希生成向量的假嵌入模型和可设定延迟/速度的假聊天模型,
+在合成语料上测量 KnowledgeBaseService 和 RagService, 输出可以跨提交比较的 JSON 报告
+
+测量项:
+    ingest     入库吞吐(片段/秒), 走 upload_batch 的完整路径(切分、去重、向量化、写向量库和词法索引)
+    retrieval  检索延迟 p50 / p99(问题各不相同, 不命中检索缓存)
+    ttft       端到端首 token 延迟 p50 / p99(RagService.astream, 含会话历史、检索、提示词和模型首 token)
+    memory     进程峰值 RSS 和测试结束时的 RSS
+
+每个语料规模在单独的子进程中运行, 互不影响内存统计; 所有数据写在临时目录中
+
+用法: python bench_offline.py [--sizes 1000 10000 100000] [--backend mmap] [--output bench_report.json] [--baseline 旧报告.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+_SYLLABLES = "安保备产车单到订发费服付工管号货价检交客款理流率门品期签认商设时售数送态条通退网维物项信型修验用优员运账证质主转"
+
+
+def make_words(rng, n=400):
+    return ["".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 3))) for _ in range(n)]
+
+
+def make_paragraph(words, rng, doc_index, chunk_index, chars):
+    text = f"文档{doc_index}第{chunk_index}段："
+    while len(text) < chars:
+        text += "".join(rng.choice(words) for _ in range(rng.randint(4, 8))) + rng.choice("，。；")
+    return text[:chars]
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, max(0, int(q * len(values) + 0.5) - 1))]
+    return {"count": len(values), "mean": sum(values) / len(values), "p50": pick(0.5), "p99": pick(0.99)}
+
+
+def rss_bytes():
+    """
+    当前 RSS(Linux 读取 /proc, 其他系统返回 None)
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def peak_rss_bytes():
+    """
+    进程的峰值 RSS(resource 只在 Unix 上可用, 其他系统返回 None)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 #macOS 上单位为字节, Linux 上为 KB
+
+
+def setup_config(tmp, args):
+    """
+    所有持久化文件放到临时目录, 关闭会影响测量的缓存和统计文件
+    """
+    import config_data as config
+
+    config.md5_path = os.path.join(tmp, "md5.txt")
+    config.md5_db_path = os.path.join(tmp, "md5.db")
+    config.persist_directory = os.path.join(tmp, "chroma_db")
+    config.mmap_store_directory = os.path.join(tmp, "mmap_store")
+    config.embedding_cache_path = os.path.join(tmp, "embedding_cache.db")
+    config.lexical_index_path = os.path.join(tmp, "lexical_index.db")
+    config.kb_version_path = os.path.join(tmp, "kb_version.db")
+    config.chat_history_path = os.path.join(tmp, "chat_history")
+    config.chat_history_db_path = os.path.join(tmp, "chat_history.db")
+    config.metrics_json_path = ""
+    config.metrics_prometheus_path = ""
+    config.vector_backend = args.backend
+    config.chunk_size = args.chunk_chars + 50
+    config.chunk_overlap = 20
+    config.answer_cache_enabled = False #每个问题都走完整链路
+    return config
+
+
+def run_size(n_chunks, args):
+    """
+    在子进程中运行一个语料规模, 返回该规模的结果
+    """
+    sys.path.insert(0, HERE)
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_config(tmp, args)
+        from embedding_cache import CachedEmbeddings
+        from fake_chat_model import FakeStreamingChatModel
+        from fake_embeddings import HashEmbeddings
+        from knowledge_base import KnowledgeBaseService
+        from rag import RagService
+
+        rng = random.Random(args.seed)
+        words = make_words(rng)
+        embedding = CachedEmbeddings(HashEmbeddings(size=args.dim, latency=args.embed_latency), model_name="bench-hash")
+        kb = KnowledgeBaseService(embedding)
+
+        #1. 入库: 每批 docs_per_batch 个文档, 每个文档 chunks_per_doc 个片段
+        samples = [] #抽样的片段, 用于生成问题
+        planned = 0 #已生成的片段数
+        embedded = 0 #流水线实际向量化并写入的片段数
+        start = time.perf_counter()
+        while planned < n_chunks:
+            documents = []
+            while len(documents) < args.docs_per_batch and planned < n_chunks:
+                doc_index = planned // args.chunks_per_doc
+                count = min(args.chunks_per_doc, n_chunks - planned)
+                paragraphs = [make_paragraph(words, rng, doc_index, i, args.chunk_chars) for i in range(count)]
+                if len(samples) < args.queries * 4:
+                    samples.append(rng.choice(paragraphs))
+                documents.append(("\n\n".join(paragraphs), f"doc-{doc_index}.txt"))
+                planned += count
+            progress = [0]
+            kb.upload_batch(documents, on_progress=lambda chunks, seconds: progress.__setitem__(0, chunks))
+            embedded += progress[0]
+        ingest_seconds = time.perf_counter() - start
+        rss_after_ingest = rss_bytes()
+
+        #2. 检索延迟: 问题取自随机片段中的几个词, 每个问题都不相同
+        rag = RagService(embedding, FakeStreamingChatModel(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, answer_tokens=args.answer_tokens))
+        questions = []
+        for i in range(args.queries + args.ttft_queries):
+            paragraph = rng.choice(samples)
+            position = rng.randrange(0, max(1, len(paragraph) - 12))
+            questions.append(f"{paragraph[position:position + 12]}是什么意思{i}")
+        rag.retriever.invoke("预热") #第一次检索会加载索引, 不计入
+        retrieval = []
+        for question in questions[:args.queries]:
+            start = time.perf_counter()
+            rag.retriever.invoke(question)
+            retrieval.append(time.perf_counter() - start)
+
+        #3. 端到端首 token 延迟: 每个问题使用新的会话
+        async def measure_ttft():
+            ttft, total = [], []
+            for i, question in enumerate(questions[args.queries:]):
+                start = time.perf_counter()
+                stream = rag.astream({"question": question}, {"configurable": {"session_id": f"bench-{i}"}})
+                await stream.__anext__()
+                ttft.append(time.perf_counter() - start)
+                async for _ in stream:
+                    pass
+                total.append(time.perf_counter() - start)
+            return ttft, total
+
+        ttft, total = asyncio.run(measure_ttft())
+        return {
+            "chunks": n_chunks,
+            "ingest": {"seconds": ingest_seconds, "embedded": embedded, "chunks_per_sec": embedded / ingest_seconds},
+            "retrieval": percentiles(retrieval),
+            "ttft": percentiles(ttft),
+            "total": percentiles(total),
+            "memory": {
+                "peak_rss": peak_rss_bytes(),
+                "rss_after_ingest": rss_after_ingest,
+                "rss_end": rss_bytes(),
+            },
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result, baseline=None):
+    line = (
+        f"n={result['chunks']:<8} 入库 {result['ingest']['chunks_per_sec']:9.1f} 片段/秒  "
+        f"检索 p50 {result['retrieval']['p50'] * 1000:7.2f} ms p99 {result['retrieval']['p99'] * 1000:7.2f} ms  "
+        f"首 token p50 {result['ttft']['p50'] * 1000:7.1f} ms p99 {result['ttft']['p99'] * 1000:7.1f} ms"
+    )
+    peak_rss = result["memory"]["peak_rss"] #不支持的系统上为 None
+    if peak_rss:
+        line += f"  峰值内存 {peak_rss / 2 ** 20:7.1f} MB"
+    if baseline:
+        #与基线报告比较: 大于 1 表示变慢/变大(入库吞吐相反)
+        line += (
+            f"\n{'':11}相对基线: 入库 x{result['ingest']['chunks_per_sec'] / baseline['ingest']['chunks_per_sec']:.2f}  "
+            f"检索 p99 x{result['retrieval']['p99'] / baseline['retrieval']['p99']:.2f}  "
+            f"首 token p99 x{result['ttft']['p99'] / baseline['ttft']['p99']:.2f}"
+        )
+        if peak_rss and baseline["memory"]["peak_rss"]:
+            line += f"  峰值内存 x{peak_rss / baseline['memory']['peak_rss']:.2f}"
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线的入库、检索、首 token 延迟和内存基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="语料片段数量, 最大可到 1000000")
+    parser.add_argument("--backend", choices=["chroma", "mmap"], default="mmap", help="向量库后端")
+    parser.add_argument("--dim", type=int, default=256, help="假嵌入模型的向量维度")
+    parser.add_argument("--chunk-chars", type=int, default=200, help="每个片段的字符数")
+    parser.add_argument("--chunks-per-doc", type=int, default=100, help="每个合成文档的片段数")
+    parser.add_argument("--docs-per-batch", type=int, default=10, help="每次 upload_batch 的文档数")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="假嵌入模型每次调用的延迟(秒)")
+    parser.add_argument("--ttft", type=float, default=0.3, help="假聊天模型的首 token 延迟(秒)")
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0, help="假聊天模型的输出速度")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="假聊天模型每次回答的 token 数")
+    parser.add_argument("--queries", type=int, default=200, help="测量检索延迟的问题数")
+    parser.add_argument("--ttft-queries", type=int, default=20, help="测量首 token 延迟的问题数")
+    parser.add_argument("--seed", type=int, default=0, help="合成语料的随机种子")
+    parser.add_argument("--output", default="bench_report.json", help="JSON 报告路径")
+    parser.add_argument("--baseline", help="用于比较的旧 JSON 报告")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = {result["chunks"]: result for result in json.load(f)["results"]}
+
+    results = []
+    for n in args.sizes:
+        #每个规模一个新的子进程: 模块级的单例(登记表、索引、缓存)和内存统计都从零开始
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(run_size, n, args).result()
+        print_result(result, baseline.get(n))
+        results.append(result)
+
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"报告已写入 {args.output}")
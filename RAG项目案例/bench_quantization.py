@@ -0,0 +1,81 @@
+"""
+量化检索基准测试: 在合成语料上比较 float32 / float16 / int8 的扫描内存、检索延迟和 recall@k
+
+语料为若干簇中心加噪声的归一化向量(比完全随机的向量更接近真实的文本嵌入),
+recall@k 以 float32 精确检索的结果为标准, 低于 1 - config.quantization_recall_tolerance 时标记为未达标
+
+用法: python bench_quantization.py [--n 200000] [--dim 1024] [--k 10] [--queries 200] [--factors 1 4]
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import config_data as config
+from mmap_vector_store import MmapVectorStore, normalize
+
+
+def make_corpus(n, dim, clusters=1000, noise=0.8, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((clusters, dim), dtype=np.float32))
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 50000):
+        end = min(start + 50000, n)
+        labels = rng.integers(0, clusters, end - start)
+        vectors[start:end] = normalize(centers[labels] + noise * rng.standard_normal((end - start, dim), dtype=np.float32) / np.sqrt(dim))
+    queries = normalize(vectors[rng.integers(0, n, 1000)] + noise * rng.standard_normal((1000, dim), dtype=np.float32) / np.sqrt(dim))
+    return vectors, queries
+
+
+def search(store, queries, k):
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = store._search(query[None, :], k)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(set(rows.tolist()))
+    return results, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="量化检索的 recall 与延迟")
+    parser.add_argument("--n", type=int, default=200000, help="片段数量")
+    parser.add_argument("--dim", type=int, default=1024, help="向量维度")
+    parser.add_argument("--k", type=int, default=10, help="recall@k 的 k")
+    parser.add_argument("--queries", type=int, default=200, help="检索次数")
+    parser.add_argument("--factors", type=int, nargs="+", default=[1, config.rescore_factor], help="重新打分的候选倍数")
+    args = parser.parse_args()
+
+    vectors, queries = make_corpus(args.n, args.dim)
+    queries = queries[:args.queries]
+    threshold = 1 - config.quantization_recall_tolerance
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MmapVectorStore(None, persist_directory=tmp, quantization="none")
+        for start in range(0, args.n, 10000):
+            end = min(start + 10000, args.n)
+            store.add_embeddings([str(i) for i in range(start, end)], [""] * (end - start), vectors[start:end])
+        del vectors
+
+        exact, latencies = search(store, queries, args.k)
+        print(
+            f"float32              扫描 {store.vectors[:store.count].nbytes / 2 ** 20:8.1f} MB  "
+            f"p50 {np.percentile(latencies, 50):6.2f} ms  p95 {np.percentile(latencies, 95):6.2f} ms"
+        )
+
+        for quantization in ("float16", "int8"):
+            start = time.perf_counter()
+            store = MmapVectorStore(None, persist_directory=tmp, quantization=quantization) #从 float32 矩阵生成量化矩阵
+            convert_seconds = time.perf_counter() - start
+            for factor in args.factors:
+                store.rescore_factor = factor
+                results, latencies = search(store, queries, args.k)
+                recall = np.mean([len(a & b) / args.k for a, b in zip(results, exact)])
+                print(
+                    f"{quantization:<7} rescore x{factor:<3}  扫描 {store.compact[:store.count].nbytes / 2 ** 20:8.1f} MB  "
+                    f"p50 {np.percentile(latencies, 50):6.2f} ms  p95 {np.percentile(latencies, 95):6.2f} ms  "
+                    f"recall@{args.k} {recall:.4f} {'达标' if recall >= threshold else '未达标'}  "
+                    f"(转换 {convert_seconds:.1f} s)"
+                )
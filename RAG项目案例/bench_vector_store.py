@@ -0,0 +1,131 @@
+"""
+向量库基准测试: 对比 Chroma 与 MmapVectorStore 的加载时间、常驻内存和检索延迟
+
+每个后端在独立的子进程中加载和检索, 常驻内存(VmRSS)互不影响
+Chroma 写入大量向量很慢, 超过 --chroma-max 的规模只测试 MmapVectorStore
+
+用法: python bench_vector_store.py [--sizes 100000 1000000] [--dim 1024] [--queries 200] [--chroma-max 100000]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from mmap_vector_store import MmapVectorStore, normalize
+
+WRITE_BATCH = 5000 #Chroma 单次写入的数量上限约为 5461
+
+
+def rss_mb():
+    with open("/proc/self/status", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def random_vectors(n, dim, seed):
+    return normalize(np.random.default_rng(seed).standard_normal((n, dim), dtype=np.float32))
+
+
+def build(backend, path, n, dim):
+    """
+    写入 n 个随机向量, 返回耗时(秒)
+    """
+    start = time.perf_counter()
+    if backend == "mmap":
+        store = MmapVectorStore(None, persist_directory=path)
+    else:
+        from langchain_chroma import Chroma
+
+        store = Chroma(collection_name="bench", persist_directory=path)
+    for offset in range(0, n, WRITE_BATCH):
+        size = min(WRITE_BATCH, n - offset)
+        vectors = random_vectors(size, dim, seed=offset)
+        ids = [f"chunk-{i}" for i in range(offset, offset + size)]
+        texts = [f"片段{i}" for i in range(offset, offset + size)]
+        metadatas = [{"source": f"file-{i // 100}.txt"} for i in range(offset, offset + size)]
+        if backend == "mmap":
+            store.add_embeddings(ids, texts, vectors, metadatas)
+        else:
+            store._collection.upsert(ids=ids, embeddings=vectors.tolist(), documents=texts, metadatas=metadatas)
+    return time.perf_counter() - start
+
+
+def measure(backend, path, dim, n_queries, k=4):
+    """
+    在子进程中执行: 加载向量库并检索, 以 JSON 输出结果
+    """
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    if backend == "mmap":
+        store = MmapVectorStore(None, persist_directory=path, mode="r")
+    else:
+        from langchain_chroma import Chroma
+
+        store = Chroma(collection_name="bench", persist_directory=path)
+    queries = random_vectors(n_queries, dim, seed=10 ** 9).tolist()
+    store.similarity_search_by_vector(queries[0], k=k) #第一次检索包含把索引读入内存的开销
+    load_seconds = time.perf_counter() - start
+    load_rss = rss_mb()
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.similarity_search_by_vector(query, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(json.dumps({
+        "load_seconds": load_seconds,
+        "rss_mb": load_rss - base_rss,
+        "peak_rss_mb": rss_mb() - base_rss,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }))
+
+
+def run_measure(backend, path, dim, n_queries):
+    output = subprocess.run(
+        [sys.executable, __file__, "--measure", backend, path, "--dim", str(dim), "--queries", str(n_queries)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def chroma_available():
+    return importlib.util.find_spec("langchain_chroma") is not None #只检查是否安装, 不导入
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比 Chroma 与 MmapVectorStore")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000], help="片段数量")
+    parser.add_argument("--dim", type=int, default=1024, help="向量维度")
+    parser.add_argument("--queries", type=int, default=200, help="检索次数")
+    parser.add_argument("--chroma-max", type=int, default=100000, help="Chroma 测试的最大规模")
+    parser.add_argument("--measure", nargs=2, metavar=("BACKEND", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure[0], args.measure[1], args.dim, args.queries)
+        sys.exit(0)
+
+    backends = ["mmap"] + (["chroma"] if chroma_available() else [])
+    for n in args.sizes:
+        for backend in backends:
+            if backend == "chroma" and n > args.chroma_max:
+                print(f"n={n:<8} {backend:<6} 跳过(超过 --chroma-max)")
+                continue
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, backend)
+                build_seconds = build(backend, path, n, args.dim)
+                result = run_measure(backend, path, args.dim, args.queries)
+            print(
+                f"n={n:<8} {backend:<6} 写入 {build_seconds:7.1f} s  加载 {result['load_seconds'] * 1000:8.1f} ms  "
+                f"常驻内存 +{result['rss_mb']:7.1f} MB (检索后 +{result['peak_rss_mb']:7.1f} MB)  "
+                f"检索 p50 {result['p50_ms']:6.2f} ms  p95 {result['p95_ms']:6.2f} ms"
+            )
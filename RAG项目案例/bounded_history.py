@@ -0,0 +1,187 @@
+"""
+有界会话历史: 提示词中只放最近几轮原文(不超过 token 预算), 更早的对话折叠进一段滚动摘要
+
+摘要按会话保存(与会话历史在同一目录), 记录已经折叠到第几条消息;
+每轮问答结束写入历史后, 在后台线程中只把新滑出窗口的消息合并进已有摘要, 不会从头重新生成,
+也不读取整个会话历史; 摘要模型的调用不占用回答的时间
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+
+import config_data as config
+from context_packer import count_tokens
+
+
+def select_window(messages: Sequence[BaseMessage], max_turns=None, token_budget=None):
+    """
+    返回保留原文的起始下标: 从最后一条往前, 最多 max_turns 轮、不超过 token_budget,
+    并且从用户消息开始, 不把一轮问答拆开
+    """
+    max_turns = max_turns or config.history_max_turns
+    token_budget = token_budget or config.history_token_budget
+    start = len(messages)
+    tokens = 0
+    turns = 0
+    for i in range(len(messages) - 1, -1, -1):
+        tokens += count_tokens(messages[i].content if isinstance(messages[i].content, str) else str(messages[i].content))
+        if tokens > token_budget:
+            break
+        if isinstance(messages[i], HumanMessage):
+            turns += 1
+            start = i
+            if turns >= max_turns:
+                break
+    return start
+
+
+class SessionSummaryStore(object):
+    def __init__(self, storage_path=None):
+        """
+        storage_path: 摘要文件目录, 默认与会话历史相同
+        """
+        self.storage_path = storage_path or config.chat_history_path
+        os.makedirs(self.storage_path, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.storage_path, f"{session_id}.summary.json")
+
+    def load(self, session_id):
+        """
+        返回 (摘要, 已折叠的消息条数)
+        """
+        try:
+            with open(self._path(session_id), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["summary"], data["count"]
+        except FileNotFoundError:
+            return "", 0
+
+    def save(self, session_id, summary, count):
+        tmp_path = self._path(session_id) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "count": count}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(session_id)) #原子替换, 中途崩溃不会留下半个文件
+
+    def clear(self, session_id):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+def _message_count(history):
+    if hasattr(history, "message_count"): #可以直接得到条数的存储不必读出全部消息
+        return history.message_count()
+    return len(history.messages)
+
+
+def _tail(history, n):
+    if hasattr(history, "tail"): #追加写的历史可以只读最后几条
+        return history.tail(n)
+    return history.messages[-n:] if n > 0 else []
+
+
+
+_fold_executor = None #进程内共享的摘要线程
+_fold_executor_lock = threading.Lock()
+_folding = {} #(摘要目录, 会话 id) -> 正在折叠时是否又有新消息, 同一会话同时只有一个折叠任务
+_folding_lock = threading.Lock()
+
+def get_fold_executor():
+    global _fold_executor
+    with _fold_executor_lock:
+        if _fold_executor is None:
+            _fold_executor = ThreadPoolExecutor(max_workers=config.history_summary_workers, thread_name_prefix="history-fold")
+    return _fold_executor
+
+
+class BoundedChatHistory(BaseChatMessageHistory):
+    """
+    包装任意会话历史: messages 返回 [摘要] + 最近几轮原文, 写入后在后台把滑出窗口的消息合并进摘要
+    underlying: 完整的会话历史
+    session_id: 会话 id
+    summarize: summarize(已有摘要, 新滑出窗口的消息) -> 新摘要, 为 None 时直接丢弃旧消息
+    summary_store: 摘要存储
+    """
+
+    def __init__(self, underlying: BaseChatMessageHistory, session_id: str, summarize: Callable = None, summary_store=None):
+        self.underlying = underlying
+        self.session_id = session_id
+        self.summarize = summarize
+        self.summary_store = summary_store or SessionSummaryStore()
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        summary, count = self.summary_store.load(self.session_id)
+        #原文只从已折叠的消息之后开始取, 已经在摘要中的消息不再重复出现
+        unfolded = max(0, _message_count(self.underlying) - count)
+        messages = _tail(self.underlying, min(2 * config.history_max_turns, unfolded))
+        start = select_window(messages)
+        if summary:
+            return [SystemMessage(content=f"更早的对话摘要：{summary}"), *messages[start:]]
+        return list(messages[start:])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.underlying.add_messages(messages)
+        self.fold_in_background()
+
+    def fold_in_background(self):
+        """
+        在后台线程中执行 fold; 同一会话已经在折叠时只做标记, 它结束后再折叠一次
+        """
+        key = (self.summary_store.storage_path, self.session_id)
+        with _folding_lock:
+            if key in _folding:
+                _folding[key] = True
+                return
+            _folding[key] = False
+        get_fold_executor().submit(self._fold_loop, key)
+
+    def _fold_loop(self, key):
+        while True:
+            try:
+                self.fold()
+            except Exception as error:
+                print(f"会话 {self.session_id} 的摘要更新失败, 下一轮重试: {error}")
+            with _folding_lock:
+                if not _folding[key]:
+                    del _folding[key]
+                    return
+                _folding[key] = False
+
+    def fold(self):
+        """
+        把已经滑出窗口、还没有折叠的消息合并进摘要
+        只读取最后几轮确定窗口的起点, 再读取 [已折叠条数, 起点) 之间的消息
+        摘要生成失败时保留原来的摘要和进度, 下一轮再合并
+        """
+        total = _message_count(self.underlying)
+        recent = _tail(self.underlying, 2 * config.history_max_turns)
+        start = total - len(recent) + select_window(recent) #窗口起点在完整历史中的下标
+        summary, count = self.summary_store.load(self.session_id)
+        if count >= start:
+            return
+        if self.summarize is not None:
+            pending = _tail(self.underlying, total - count)[:start - count]
+            summary = self.summarize(summary, pending)
+        self.summary_store.save(self.session_id, summary, start)
+
+    def clear(self) -> None:
+        self.underlying.clear()
+        self.summary_store.clear(self.session_id)
+
+
+def make_summarizer(chain):
+    """
+    用 chain(输入 {"summary", "conversation"}, 输出字符串)生成摘要函数
+    """
+    def summarize(summary, messages):
+        return chain.invoke({"summary": summary or "(无)", "conversation": get_buffer_string(messages, human_prefix="用户", ai_prefix="助手")})
+
+    return summarize
@@ -1,10 +1,26 @@
-md5_path = "./md5.txt" #保存md5的文件路径
+md5_path = "./md5.txt" #旧版保存md5的文件路径, 首次启动时导入登记表
+md5_db_path = "./md5.db" #上传去重登记表(SQLite)的路径
 
 
+#vector store
+vector_backend = "chroma" #向量库后端: "chroma" 或 "mmap"(NumPy 内存映射, 加载快、内存占用小)
+
 #Chroma
 collection_name = "rag"
 persist_directory= "./chroma_db" #向量数据库保存路径
 
+#mmap
+mmap_store_directory = "./mmap_store" #内存映射向量库的数据目录
+vector_quantization = "none" #检索时扫描的向量精度: "none"(float32), "float16" 或 "int8"(按维度缩放)
+rescore_factor = 4 #量化检索先取 top_k * rescore_factor 个候选, 再用 float32 重新打分
+quantization_recall_tolerance = 0.01 #基准测试中量化后 recall@k 允许比 float32 低的幅度
+ann_index = "ivf" #近似最近邻索引: "none" 精确检索, "ivf" 倒排文件索引(只扫描最近的几个聚类)
+ivf_min_rows = 50000 #行数达到该值时在后台自动训练 IVF 索引, 训练完成前使用精确检索
+ivf_nlist = 0 #IVF 聚类数量, 0 表示训练时取 4 * sqrt(行数)
+ivf_nprobe = 16 #每次检索扫描的聚类数量, 越大召回率越高、检索越慢
+metadata_index_fields = ["source", "operator"] #建立倒排索引的元数据字段, 过滤检索时只扫描匹配的行
+metadata_time_fields = ["create_time"] #支持范围过滤($gt/$gte/$lt/$lte)的时间字段
+
 #spilter 
 
 chunk_size = 1000 #文本切分的块大小
@@ -12,9 +28,82 @@ chunk_overlap = 100 #文本切分的重叠部分大小
 separators=["\n\n", "\n", "。", "！", "？", ",", "，", " ", "!"] #文本切分的分隔符列表
 
 max_spilter_char_number = 1000
+stream_split_window = 20000 #流式上传时, 缓冲区累积到多少字符切分一次
+stream_block_chars = 8000 #流式解析 docx 时, 每个文本块的字符数
+
+#ingest_dir 目录批量入库
+ingest_batch_files = 32 #每批写入知识库的文件数
+ingest_checkpoint_path = "./ingest_checkpoint.db" #断点续传检查点(SQLite)的路径
+
+#ingest_jobs 上传页面的后台入库任务
+ingest_workers = 1 #同时执行的入库任务数, 每个任务内部已经并发向量化
+ingest_spool_dir = "./upload_spool" #上传文件在入库完成前的暂存目录
+ingest_max_jobs = 200 #进程内最多保留的任务记录数, 超过时丢弃最早结束的
+
+#embedding pipeline
+embedding_batch_size = 10 #每次调用嵌入模型的片段数量, text-embedding-v4 单次最多 10 条
+embedding_max_workers = 4 #并发向量化的线程数
+embedding_max_retries = 3 #每批向量化失败后的最大重试次数
+embedding_retry_backoff = 1.0 #第一次重试前等待的秒数, 之后每次翻倍
+
+#embedding cache
+embedding_cache_path = "./embedding_cache.db" #嵌入向量缓存(SQLite)的路径
+embedding_cache_memory_size = 10000 #进程内 LRU 最多缓存的向量条数
+embedding_cache_max_entries = 1000000 #磁盘缓存最多保留的向量条数, 超过后淘汰最久未使用的
 
 #similarity search
 similarity_top_k = 1 #相似度检索时返回的最相似
+retrieval_cache_size = 1024 #检索结果缓存最多保存的问题数量
+retrieval_cache_ttl = 300 #检索结果缓存的有效期(秒)
+
+#semantic answer cache 语义回答缓存
+answer_cache_enabled = True #是否启用语义回答缓存
+answer_cache_threshold = 0.95 #新问题与已回答问题的余弦相似度达到该值时直接返回缓存的回答
+answer_cache_size = 2048 #最多缓存的回答数量, 超过后覆盖最早的
+answer_cache_with_history = False #会话已有历史消息时是否也使用缓存(追问的含义依赖上下文, 默认不使用)
+
+#services 进程内共享的服务
+warm_up_question = "" #服务启动预热时检索一次的问题, 为空时只创建服务、加载索引, 不调用嵌入模型
+
+#context packer 参考资料整理
+context_token_budget = 2000 #参考资料最多占用的 token 数(本地估算)
+context_metadata_fields = ["source"] #提示词中保留的元数据字段
+context_dedup_threshold = 0.9 #两个段落字符三元组的 Jaccard 相似度超过该值时视为重复
+context_min_overlap = 20 #相邻片段首尾至少重叠多少个字符才合并
+token_count_cache_size = 10000 #token 计数缓存的文本条数
+
+#hybrid search
+hybrid_search = True #是否启用 BM25 + 向量的混合检索
+lexical_index_path = "./lexical_index.db" #BM25 倒排索引(SQLite)的路径
+hybrid_candidates = 10 #每一路检索取回的候选数量
+hybrid_rrf_k = 60 #倒数排名融合的平滑常数
+bm25_fast_path_min_score = 6.0 #BM25 最高分超过该值, 且
+bm25_fast_path_ratio = 2.0 #是第二名的该倍数以上时, 只用词法检索结果, 跳过向量检索
+
+#metrics 问答链路分阶段耗时
+metrics_window = 1000 #每个阶段保留最近多少个样本计算 p50/p95/p99
+metrics_dump_interval = 10 #后台线程每隔多少秒写出一次统计文件
+metrics_json_path = "./metrics.json" #统计的 JSON 文件, 为空字符串时不写
+metrics_prometheus_path = "./metrics.prom" #Prometheus 文本格式的统计文件(可供 node_exporter textfile 采集), 为空字符串时不写
+prompt_trace_sample_rate = 0.0 #按该比例抽样打印完整提示词, 0 表示关闭
+
+kb_version_path = "./kb_version.db" #知识库版本号(SQLite)的路径, 入库时加一, 用于让缓存失效
+
+#chat history 会话历史
+chat_history_path = "./chat_history" #会话历史和摘要的保存目录
+history_max_turns = 6 #提示词中最多保留最近几轮对话原文
+history_token_budget = 1500 #保留原文的会话历史最多占用的 token 数, 更早的对话折叠进摘要
+history_summary_workers = 2 #后台合并会话摘要的线程数, 摘要不在回答的请求路径上生成
+chat_history_fsync = False #每次追加会话历史后是否 fsync 落盘(更安全, 但每轮多一次磁盘同步)
+chat_history_compact_bytes = 1024 * 1024 #会话历史文件每增长这么多字节在后台检查一次是否需要压缩, 0 表示不自动压缩
+chat_history_compact_ratio = 0.3 #清空前的消息、崩溃留下的半行等无效内容占文件的比例达到多少时压缩
+chat_history_backend = "file" #会话历史存储: "file" 每个会话一个 JSONL 文件; "sqlite" 所有会话保存在一个 SQLite 数据库中
+chat_history_db_path = "./chat_history.db" #SQLite 会话历史的路径, 可用 python sqlite_history_store.py migrate 从会话文件导入
+chat_history_pool_size = 8 #SQLite 会话历史的连接池大小
+chat_history_ttl_days = 30 #超过多少天没有新消息的会话会被 python sqlite_history_store.py purge 清理
+history_cache_max_bytes = 64 * 1024 * 1024 #进程内会话历史缓存的消息总字节数上限, 0 表示不缓存
+history_write_behind = False #是否延迟批量写入会话历史(进程异常退出时可能丢失最近几秒的消息)
+history_flush_interval = 1.0 #延迟写入会话历史的间隔(秒)
 
 embedding_name = "text-embedding-v4"
 chat_model_name = "qwen3-max"
@@ -0,0 +1,149 @@
+"""
+按 token 预算整理参考资料, 替代逐个拼接片段的 format_document
+
+1. 合并重叠的相邻片段: 同一文件中, 后一个片段的开头与前一个片段的结尾重叠(chunk_overlap)时拼成一段
+2. 去掉几乎相同的段落: 被更靠前的段落包含, 或字符三元组的 Jaccard 相似度超过阈值
+3. 只输出需要的元数据字段(config.context_metadata_fields)
+4. 按检索排名依次放入, 直到达到 token 预算(config.context_token_budget)
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+from langchain_core.documents import Document
+
+import config_data as config
+
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3000-\u303f\uff00-\uffef]")
+_NOT_WORD = re.compile(r"[\W_]+")
+
+
+@lru_cache(maxsize=config.token_count_cache_size)
+def count_tokens(text: str):
+    """
+    本地估算 token 数: 中文字符(含全角标点)每个约 1 个 token, 其他字符约 4 个 1 个 token
+    偏保守(略多于通义千问分词器的结果), 结果按文本缓存
+    """
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _shingles(text):
+    text = _NOT_WORD.sub("", unicodedata.normalize("NFKC", text).lower())
+    if len(text) < 3:
+        return {text}
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def overlap_length(left: str, right: str, min_overlap=None, max_overlap=None):
+    """
+    left 的结尾与 right 的开头重叠的最大长度, 不足 min_overlap 时返回 0
+    """
+    min_overlap = min_overlap or config.context_min_overlap
+    max_overlap = min(max_overlap or config.chunk_overlap * 2, len(left), len(right))
+    if max_overlap < min_overlap:
+        return 0
+    head = right[:min_overlap]
+    tail_start = len(left) - max_overlap
+    position = left.find(head, tail_start)
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(head, position + 1)
+    return 0
+
+
+class ContextPacker(object):
+    def __init__(self, token_budget=None, metadata_fields=None, dedup_threshold=None, count=None):
+        """
+        token_budget: 参考资料最多占用的 token 数
+        metadata_fields: 输出的元数据字段
+        dedup_threshold: 判定为几乎相同的 Jaccard 相似度
+        count: token 计数函数, 默认使用本地估算
+        """
+        self.token_budget = token_budget or config.context_token_budget
+        self.metadata_fields = config.context_metadata_fields if metadata_fields is None else metadata_fields
+        self.dedup_threshold = dedup_threshold or config.context_dedup_threshold
+        self.count = count or count_tokens
+
+    def merge_overlapping(self, docs: list[Document]):
+        """
+        合并同一文件中首尾重叠的片段, 合并后的段落排在两者中靠前的位置
+        返回 [(文本, 元数据)]
+        """
+        passages = [[doc.page_content, doc.metadata] for doc in docs]
+        merged = True
+        while merged:
+            merged = False
+            for i, (text_i, meta_i) in enumerate(passages):
+                for j, (text_j, meta_j) in enumerate(passages):
+                    if i == j or meta_i.get("source") != meta_j.get("source"):
+                        continue
+                    length = overlap_length(text_i, text_j)
+                    if length:
+                        first, second = min(i, j), max(i, j)
+                        passages[first] = [text_i + text_j[length:], meta_i]
+                        del passages[second]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [(text, metadata) for text, metadata in passages]
+
+    def deduplicate(self, passages):
+        """
+        去掉被前面段落包含、或与前面段落几乎相同的段落
+        """
+        kept = []
+        kept_shingles = []
+        for text, metadata in passages:
+            shingles = _shingles(text)
+            duplicate = False
+            for (kept_text, _), other in zip(kept, kept_shingles):
+                if text in kept_text or len(shingles & other) >= self.dedup_threshold * len(shingles | other):
+                    duplicate = True
+                    break
+            if not duplicate:
+                kept.append((text, metadata))
+                kept_shingles.append(shingles)
+        return kept
+
+    def _format(self, text, metadata):
+        fields = [f"{field}: {metadata[field]}" for field in self.metadata_fields if field in metadata]
+        if fields:
+            return f"文档片段: {text}\n文档元数据: {', '.join(fields)}\n\n"
+        return f"文档片段: {text}\n\n"
+
+    def _truncate(self, text, metadata, budget):
+        """
+        截断段落使其不超过预算, 用于排名第一但本身超过预算的段落
+        """
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(self._format(text[:middle], metadata)) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return self._format(text[:low], metadata) if low else ""
+
+    def pack(self, docs: list[Document]):
+        """
+        docs: 按相关度排好序的检索结果
+        """
+        if not docs:
+            return "没有相关资料。"
+        parts = []
+        remaining = self.token_budget
+        for text, metadata in self.deduplicate(self.merge_overlapping(docs)):
+            part = self._format(text, metadata)
+            tokens = self.count(part)
+            if tokens > remaining:
+                if not parts:
+                    part = self._truncate(text, metadata, remaining)
+                    parts.append(part)
+                    remaining -= self.count(part)
+                continue #放不下时跳过, 后面较短的段落可能还放得下
+            parts.append(part)
+            remaining -= tokens
+        return "".join(parts)
@@ -0,0 +1,108 @@
+"""
+流式文档解析: 逐页/逐段产出文本块, 不把整个文件拼成一个大字符串
+
+每个生成器产出的文本块按顺序拼接后, 等于原来 "\\n".join(...) 得到的完整文本
+"""
+import codecs
+import os
+
+import config_data as config
+
+TXT_ENCODINGS = ("utf-8", "gbk", "gb2312") #txt 文件依次尝试的编码
+READ_SIZE = 1024 * 1024 #每次从文件中读取的字节数
+
+
+def iter_pdf_pages(stream):
+    """
+    逐页提取 pdf 文本, 每页处理完后释放该页的解析缓存
+    stream: 文件路径或二进制文件对象
+    """
+    import pdfplumber #解析器只在读取对应格式时加载
+    with pdfplumber.open(stream) as pdf:
+        for i, page in enumerate(pdf.pages):
+            text = page.extract_text() or ""
+            page.close() #释放该页解析出的字符/图形对象
+            yield text if i == 0 else "\n" + text
+
+
+def iter_docx_blocks(stream, block_chars=None):
+    """
+    按段落提取 docx 文本, 累积到 block_chars 个字符后产出一块
+    python-docx 会一次性解析整个 xml, 这里只避免再拼出一份完整的字符串
+    """
+    block_chars = block_chars or config.stream_block_chars
+    from docx import Document
+    doc = Document(stream)
+    parts = []
+    size = 0
+    first = True
+    for paragraph in doc.paragraphs:
+        text = paragraph.text if first else "\n" + paragraph.text
+        first = False
+        parts.append(text)
+        size += len(text)
+        if size >= block_chars:
+            yield "".join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield "".join(parts)
+
+
+def detect_encoding(stream):
+    """
+    依次尝试 TXT_ENCODINGS, 用增量解码器分块校验整个文件, 返回第一个能完整解码的编码
+    校验结束后把文件指针移回开头
+    """
+    for encoding in TXT_ENCODINGS:
+        stream.seek(0)
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            while True:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    decoder.decode(b"", final=True)
+                    break
+                decoder.decode(data)
+        except (UnicodeDecodeError, LookupError):
+            continue
+        stream.seek(0)
+        return encoding
+    stream.seek(0)
+    return None
+
+
+def iter_txt_blocks(stream):
+    """
+    分块解码 txt 文件
+    """
+    encoding = detect_encoding(stream)
+    if encoding is None:
+        return
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        data = stream.read(READ_SIZE)
+        text = decoder.decode(data, final=not data)
+        if text:
+            yield text
+        if not data:
+            break
+
+
+READERS = {".pdf": iter_pdf_pages, ".docx": iter_docx_blocks, ".txt": iter_txt_blocks} #后缀(小写) -> 解析函数
+SUPPORTED_SUFFIXES = tuple(READERS)
+
+
+def get_reader(filename):
+    """
+    根据文件后缀(不区分大小写)选择解析函数, 其他后缀按 txt 解析
+    """
+    return READERS.get(os.path.splitext(filename)[1].lower(), iter_txt_blocks)
+
+
+def iter_document(stream, filename):
+    """
+    根据文件后缀选择解析方式
+    stream: 可 seek 的二进制文件对象, 例如 streamlit 的 UploadedFile
+    """
+    return get_reader(filename)(stream)
@@ -0,0 +1,250 @@
+"""
+嵌入向量缓存: 包装任意 LangChain Embeddings, 相同文本只调用一次远程模型
+
+两级缓存:
+    1. 进程内 LRU (OrderedDict)
+    2. 磁盘 SQLite, 按 (模型名, 文本哈希) 存储 float32 向量, 超过上限时淘汰最久未使用的记录
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+import config_data as config
+from metrics import get_metrics
+
+
+def get_text_hash(text: str):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, underlying, db_path=None, model_name=None, memory_size=None, max_entries=None):
+        """
+        underlying: 被包装的嵌入模型
+        db_path: SQLite 缓存文件路径
+        model_name: 模型名称, 作为缓存键的一部分, 默认读取 underlying.model
+        memory_size: 进程内 LRU 最多保存的向量条数
+        max_entries: 磁盘缓存最多保留的向量条数, 超过后淘汰最久未使用的记录
+        """
+        self.underlying = underlying
+        self.db_path = db_path or config.embedding_cache_path
+        self.model_name = model_name or getattr(underlying, "model", None) or type(underlying).__name__
+        self.memory_size = memory_size or config.embedding_cache_memory_size
+        self.max_entries = max_entries or config.embedding_cache_max_entries
+
+        self._lock = threading.Lock() #磁盘缓存的读写
+        self._memory_lock = threading.Lock() #只保护内存 LRU, 持有期间不做 I/O, 事件循环中可以直接使用
+        self._memory = OrderedDict() #(命名空间, 文本哈希) -> 向量
+        self._inserts_since_check = 0 #自上次检查容量以来写入的条数
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, "
+            "hash TEXT NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (model, hash)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+
+        self.hits = 0 #命中次数(内存 + 磁盘)
+        self.misses = 0 #未命中, 调用远程模型的文本条数
+
+    #------------------------------ 内存 LRU ------------------------------
+
+    def _memory_get(self, key):
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+        return vector
+
+    def _memory_put(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    #------------------------------ 磁盘 SQLite ------------------------------
+
+    def _disk_get_many(self, namespace, hashes):
+        found = {}
+        hashes = list(hashes)
+        for i in range(0, len(hashes), 500): #SQLite 单条语句的参数数量有限制
+            part = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            rows = self._conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [namespace, *part],
+            ).fetchall()
+            for text_hash, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[text_hash] = vector.tolist()
+        if found:
+            #刷新最近使用时间, 供淘汰使用
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                [(now, namespace, text_hash) for text_hash in found],
+            )
+        return found
+
+    def _disk_put_many(self, namespace, items):
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(namespace, text_hash, array("f", vector).tobytes(), now) for text_hash, vector in items],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._inserts_since_check += len(items)
+        if self._inserts_since_check >= 1000:
+            self._evict()
+
+    def _evict(self):
+        """
+        超过 max_entries 时, 删除最久未使用的记录, 降到上限的 90%
+        """
+        self._inserts_since_check = 0
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        overflow = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE (model, hash) IN "
+            "(SELECT model, hash FROM embeddings ORDER BY last_used LIMIT ?)",
+            (overflow,),
+        )
+
+    #------------------------------ 查询入口 ------------------------------
+
+    def _memory_lookup(self, texts, namespace):
+        """
+        只查内存, 返回 (文本哈希列表, 已找到的 {哈希: 向量}, 缺失的 {哈希: 文本})
+        """
+        hashes = [get_text_hash(text) for text in texts]
+        found = {} #文本哈希 -> 向量
+        missing = {} #文本哈希 -> 文本
+        with self._memory_lock:
+            for text_hash, text in zip(hashes, texts):
+                vector = self._memory_get((namespace, text_hash))
+                if vector is not None:
+                    found[text_hash] = vector
+                else:
+                    missing[text_hash] = text
+        return hashes, found, missing
+
+    def _disk_lookup(self, namespace, found, missing):
+        """
+        在磁盘中查找 missing 中的文本, 找到的移到 found 并放入内存
+        """
+        if not missing:
+            return
+        with self._lock:
+            vectors = self._disk_get_many(namespace, missing)
+        with self._memory_lock:
+            for text_hash, vector in vectors.items():
+                self._memory_put((namespace, text_hash), vector)
+                found[text_hash] = vector
+                del missing[text_hash]
+
+    def _lookup(self, texts, namespace):
+        """
+        先查内存, 再查磁盘, 返回 (文本哈希列表, 已找到的 {哈希: 向量}, 缺失的 {哈希: 文本})
+        """
+        hashes, found, missing = self._memory_lookup(texts, namespace)
+        self._disk_lookup(namespace, found, missing)
+        return hashes, found, missing
+
+    def _save(self, namespace, hashes, found, missing, vectors):
+        """
+        保存远程模型返回的向量, 返回与 hashes 顺序一致的全部向量
+        """
+        new_items = list(zip(missing, vectors))
+        if new_items:
+            with self._lock:
+                self._disk_put_many(namespace, new_items)
+        with self._memory_lock:
+            for text_hash, vector in new_items:
+                self._memory_put((namespace, text_hash), vector)
+                found[text_hash] = vector
+            self.misses += len(missing)
+            self.hits += len(hashes) - len(missing)
+        return [found[text_hash] for text_hash in hashes]
+
+    def _embed(self, texts, namespace, embed_func):
+        """
+        只把缓存中没有的文本交给远程模型
+        """
+        hashes, found, missing = self._lookup(texts, namespace)
+        #远程调用不持有锁, 允许多个线程同时请求
+        vectors = embed_func(list(missing.values())) if missing else []
+        return self._save(namespace, hashes, found, missing, vectors)
+
+    async def _aembed(self, texts, namespace, aembed_func):
+        """
+        事件循环中只查内存; 磁盘读写可能要等入库线程释放锁、等待 SQLite 写锁, 放到线程中执行
+        """
+        hashes, found, missing = self._memory_lookup(texts, namespace)
+        if missing:
+            await asyncio.to_thread(self._disk_lookup, namespace, found, missing)
+        vectors = await aembed_func(list(missing.values())) if missing else []
+        if missing:
+            return await asyncio.to_thread(self._save, namespace, hashes, found, missing, vectors)
+        return self._save(namespace, hashes, found, missing, vectors)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts, f"{self.model_name}:document", self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> list[float]:
+        #文档和查询在部分模型中使用不同的向量化方式, 分开缓存
+        with get_metrics().timer("question_embedding"):
+            return self._embed(
+                [text], f"{self.model_name}:query", lambda texts: [self.underlying.embed_query(texts[0])]
+            )[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self._aembed(texts, f"{self.model_name}:document", self.underlying.aembed_documents)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        async def aembed(texts):
+            return [await self.underlying.aembed_query(texts[0])]
+
+        with get_metrics().timer("question_embedding"):
+            return (await self._aembed([text], f"{self.model_name}:query", aembed))[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+
+_shared = {} #模型名 -> 进程内共享的缓存嵌入模型
+_shared_lock = threading.Lock()
+
+def get_cached_embeddings(model=None):
+    """
+    获取进程内共享的、带缓存的 DashScope 嵌入模型
+    model: 模型名称, 默认使用 config.embedding_name
+    """
+    model = model or config.embedding_name
+    with _shared_lock:
+        if model not in _shared:
+            from langchain_community.embeddings import DashScopeEmbeddings #第一次使用时才加载 langchain_community
+            _shared[model] = CachedEmbeddings(DashScopeEmbeddings(model=model), model_name=model)
+        return _shared[model]
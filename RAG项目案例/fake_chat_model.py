@@ -0,0 +1,56 @@
+"""
+本地假聊天模型: 不调用通义千问, 按设定的首 token 延迟和输出速度流式返回确定的回答, 用于离线基准测试
+"""
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncIterator, Iterator
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_VOCABULARY = "根据参考资料可以确认该问题的答案如下所述请您放心我们会尽快处理相关事项感谢耐心等待"
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    ttft: 首个 token 的延迟(秒)
+    tokens_per_sec: 之后每秒输出的 token 数
+    answer_tokens: 回答的 token 数(每个 token 一个汉字)
+    """
+
+    ttft: float = 0.3
+    tokens_per_sec: float = 40.0
+    answer_tokens: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _tokens(self, messages: list[BaseMessage]):
+        #以最后一条消息的 md5 决定回答内容, 相同的提示词得到相同的回答
+        digest = hashlib.md5(str(messages[-1].content).encode("utf-8")).digest()
+        return [_VOCABULARY[(digest[i % len(digest)] + i) % len(_VOCABULARY)] for i in range(self.answer_tokens)]
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager: CallbackManagerForLLMRun = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self.ttft + max(0, len(tokens) - 1) / self.tokens_per_sec)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages: list[BaseMessage], stop=None, run_manager: CallbackManagerForLLMRun = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens(messages)):
+            time.sleep(self.ttft if i == 0 else 1 / self.tokens_per_sec)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: list[BaseMessage], stop=None, run_manager: AsyncCallbackManagerForLLMRun = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens(messages)):
+            await asyncio.sleep(self.ttft if i == 0 else 1 / self.tokens_per_sec)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
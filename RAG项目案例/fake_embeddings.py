@@ -0,0 +1,52 @@
+"""
+本地假嵌入模型: 不调用 DashScope, 按文本哈希生成确定的向量, 用于测试和基准测试
+"""
+import hashlib
+import random
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class HashEmbeddings(Embeddings):
+    def __init__(self, size=1024, latency=0.0, text_latency=0.0, fail_rate=0.0, model="hash-embedding"):
+        """
+        size: 向量维度
+        latency: 每次调用模拟的网络延迟(秒)
+        text_latency: 每条文本额外增加的延迟(秒)
+        fail_rate: 每次调用随机失败的概率, 用于测试重试
+        model: 模型名称
+        """
+        self.size = size
+        self.latency = latency
+        self.text_latency = text_latency
+        self.fail_rate = fail_rate
+        self.model = model
+        self.calls = 0 #调用次数
+        self.texts = 0 #向量化的文本条数
+        self._lock = threading.Lock()
+
+    def _embed(self, text):
+        #以文本的 md5 作为随机种子, 相同文本得到相同的向量; 用 numpy 生成, 大语料的基准测试不会被假模型本身拖慢
+        seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest(), "big")
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        vector /= np.linalg.norm(vector) or 1.0
+        return vector.tolist()
+
+    def _call(self, texts):
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        if self.latency or self.text_latency:
+            time.sleep(self.latency + self.text_latency * len(texts))
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise RuntimeError("模拟的嵌入服务错误")
+        return [self._embed(text) for text in texts]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._call(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._call([text])[0]
@@ -0,0 +1,200 @@
+"""
+高吞吐的递归文本切分器, 可以直接替换 RecursiveCharacterTextSplitter
+
+与 RecursiveCharacterTextSplitter 的区别:
+    1. 子片段始终用原文中的 (起点, 终点) 下标表示, 不生成中间字符串, 合并时直接在原文上切片
+    2. 分隔符都是普通字符串, 用 str.find / str.split 代替逐层 re.search / re.split,
+       每个字符在每一级分隔符上最多被扫描一次, 只有超长的子片段才会进入下一级
+    3. 合并小片段时按 chunk_size / chunk_overlap 在边界数组上二分跳跃, 每个输出片段 O(log n),
+       而不是逐个小片段累加长度、拼接字符串
+
+输出与 RecursiveCharacterTextSplitter(keep_separator=True, length_function=len) 完全一致
+"""
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, compress, count, repeat
+from operator import ge, sub
+
+from langchain_text_splitters import TextSplitter
+
+
+class FastRecursiveTextSplitter(TextSplitter):
+    def __init__(self, separators=None, keep_separator=True, **kwargs):
+        """
+        separators: 分隔符列表, 优先级从高到低
+        其余参数与 TextSplitter 相同, 只支持 length_function=len 和 keep_separator=True/"start"
+        """
+        if keep_separator not in (True, "start"):
+            raise ValueError("FastRecursiveTextSplitter 只支持 keep_separator=True 或 'start'")
+        if kwargs.get("length_function", len) is not len:
+            raise ValueError("FastRecursiveTextSplitter 只支持 length_function=len")
+        super().__init__(keep_separator=keep_separator, **kwargs)
+        self._separators = list(separators or ["\n\n", "\n", " ", ""])
+
+    def split_text(self, text: str) -> list[str]:
+        chunks = []
+        self._split_range(text, 0, len(text), 0, chunks)
+        return chunks
+
+    def _bounds(self, text, separator, start, end):
+        """
+        text[start:end] 按 separator 切开后各子片段的边界(分隔符保留在子片段开头)
+        str.split 与 accumulate 都在 C 中完成, 不需要逐个匹配对象
+        """
+        parts = text[start:end].split(separator)
+        step = len(separator)
+        bounds = list(accumulate(map(step.__add__, map(len, parts[1:-1])), initial=start + len(parts[0])))
+        if bounds[0] != start:
+            bounds.insert(0, start) #以分隔符开头时, 空的第一个子片段被丢弃
+        bounds.append(end)
+        return bounds
+
+    def _select(self, text, start, end, first_level):
+        """
+        text[start:end] 使用的分隔符: 第 first_level 个及以后的分隔符中第一个出现的
+        返回 (分隔符下标, 子片段边界, 递归切分超长子片段时的起始下标), 没有可用的分隔符时下标为 len(separators)
+        """
+        levels = len(self._separators)
+        for i in range(first_level, levels):
+            separator = self._separators[i]
+            if not separator:
+                return i, list(range(start, end + 1)), levels
+            if text.find(separator, start, end) >= 0:
+                return i, self._bounds(text, separator, start, end), i + 1
+        return levels, [start, end], levels
+
+    def _split_range(self, text, start, end, first_level, chunks):
+        """
+        对应 RecursiveCharacterTextSplitter._split_text, 在 text[start:end] 上用第 first_level 个及以后的分隔符切分
+        """
+        levels = len(self._separators)
+        _, bounds, next_level = self._select(text, start, end, first_level)
+
+        #长度 >= chunk_size 的子片段需要递归切分, 其余连续的子片段合并
+        long_pieces = list(compress(count(), map(ge, map(sub, bounds[1:], bounds), repeat(self._chunk_size))))
+        run_start = 0
+        for i in long_pieces:
+            if i > run_start:
+                self._merge_range(text, bounds, run_start, i, chunks)
+            if next_level >= levels:
+                chunks.append(text[bounds[i]:bounds[i + 1]])
+            else:
+                self._split_range(text, bounds[i], bounds[i + 1], next_level, chunks)
+            run_start = i + 1
+        if run_start < len(bounds) - 1:
+            self._merge_range(text, bounds, run_start, len(bounds) - 1, chunks)
+
+    def split_stream(self, blocks, window=20000):
+        """
+        逐块读入文本, 输出与 split_text("".join(blocks)) 完全相同的片段, 缓冲区只保留切分方式还不能确定的末尾部分
+        blocks: 文本块的可迭代对象
+        window: 缓冲区每增加多少字符尝试输出一次
+
+        一次性切分时, 整篇文本使用出现的优先级最高的分隔符; 更早的部分只含低优先级分隔符时,
+        它是一个超长子片段, 单独递归切分, 之后重新开始合并。因此流式切分时维护当前区域的分隔符:
+        缓冲区出现更高优先级的分隔符时, 之前的部分单独切分输出, 从该分隔符开始新的区域;
+        区域内只输出不依赖后续文本的片段, 剩余部分从下一个片段的起点开始保留到下一轮
+        """
+        buffer = ""
+        level = None #当前区域使用的分隔符下标, 第一次尝试输出时确定
+        threshold = max(window, self._chunk_size) #第一个区域不短于 chunk_size, 保证它在一次性切分时也是超长子片段
+        for block in blocks:
+            buffer += block
+            if len(buffer) < threshold:
+                continue
+            if level is None:
+                level = self._select(buffer, 0, len(buffer), 0)[0]
+            for chunk, buffer, level in self._close_regions(buffer, level):
+                yield from chunk
+            chunks, consumed = self._split_prefix(buffer, level)
+            yield from chunks
+            buffer = buffer[consumed:]
+            threshold = len(buffer) + window
+
+        if level is not None:
+            for chunk, buffer, level in self._close_regions(buffer, level):
+                yield from chunk
+        if buffer:
+            yield from self.split_text(buffer)
+
+    def _close_regions(self, buffer, level):
+        """
+        缓冲区中出现比 level 优先级更高的分隔符时, 把它之前的部分作为一个区域单独切分
+        逐个产出 (输出的片段, 剩余的缓冲区, 新区域的分隔符下标)
+        """
+        while True:
+            position, higher = -1, None
+            for i in range(level):
+                found = buffer.find(self._separators[i]) if self._separators[i] else -1
+                if found >= 0 and (position < 0 or found < position):
+                    position, higher = found, i
+            if higher is None:
+                return
+            yield self.split_text(buffer[:position]) if position else [], buffer[position:], higher
+            buffer, level = buffer[position:], higher
+
+    def _split_prefix(self, text, level):
+        """
+        在当前区域的分隔符上切分 text, 只输出后续文本不会改变的片段
+        最后一个子片段可能还没读完; 与它同属一段合并的片段, 只输出合并时用不到它的那些
+        返回 (片段列表, 已经消费的字符数), 剩余部分以一个完整片段的起点开头, 单独切分与接着切分结果相同
+        """
+        chunks = []
+        if level >= len(self._separators):
+            return chunks, 0
+        separator = self._separators[level]
+        levels = len(self._separators)
+        bounds = list(range(len(text) + 1)) if not separator else self._bounds(text, separator, 0, len(text))
+        next_level = level + 1 if separator else levels
+        last = len(bounds) - 2 #可能不完整的最后一个子片段
+
+        #完整的超长子片段单独递归切分, 它前面的一段连续子片段可以直接合并
+        run_start = 0
+        for i in range(last):
+            if bounds[i + 1] - bounds[i] < self._chunk_size:
+                continue
+            if i > run_start:
+                self._merge_range(text, bounds, run_start, i, chunks)
+            if next_level >= levels:
+                chunks.append(text[bounds[i]:bounds[i + 1]])
+            else:
+                self._split_range(text, bounds[i], bounds[i + 1], next_level, chunks)
+            run_start = i + 1
+
+        #最后一段合并: 与 _merge_range 相同, 片段的终点确定在最后一个子片段之前时才输出
+        size = self._chunk_size
+        overlap = self._chunk_overlap
+        i = run_start
+        while i < last and bounds[i] + size < bounds[last]:
+            j = bisect_right(bounds, bounds[i] + size, i + 1, last + 1) - 1
+            self._emit(text, bounds[i], bounds[j], chunks)
+            keep_overlap = bisect_left(bounds, bounds[j] - overlap, i, j)
+            fit_next = bisect_left(bounds, bounds[j + 1] - size, i, j)
+            i = max(keep_overlap, fit_next)
+        return chunks, bounds[i]
+
+    def _merge_range(self, text, bounds, first, last, chunks):
+        """
+        对应 TextSplitter._merge_splits, 合并第 first 到 last-1 个子片段
+        分隔符已经保留在子片段中, 合并后的片段就是原文中 [bounds[i], bounds[j]) 这一段
+        """
+        size = self._chunk_size
+        overlap = self._chunk_overlap
+        i = first
+        while True:
+            #从第 i 个子片段开始, 尽量多地放入子片段而不超过 chunk_size
+            j = bisect_right(bounds, bounds[i] + size, i + 1, last + 1) - 1
+            self._emit(text, bounds[i], bounds[j], chunks)
+            if j >= last:
+                return
+            #第 j 个子片段放不下: 从前面丢弃子片段, 直到剩余部分不超过 chunk_overlap,
+            #并且加上第 j 个子片段后不超过 chunk_size
+            keep_overlap = bisect_left(bounds, bounds[j] - overlap, i, j)
+            fit_next = bisect_left(bounds, bounds[j + 1] - size, i, j)
+            i = max(keep_overlap, fit_next)
+
+    def _emit(self, text, start, end, chunks):
+        chunk = text[start:end]
+        if self._strip_whitespace:
+            chunk = chunk.strip()
+        if chunk:
+            chunks.append(chunk)
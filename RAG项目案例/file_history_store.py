@@ -1,109 +1,367 @@
-from typing import Sequence, Union
+from typing import Sequence
 from langchain_core.chat_history import BaseChatMessageHistory
-import os, json
+import os, sys, json, threading, time, traceback
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.messages import message_to_dict, messages_from_dict, BaseMessage
-from dotenv import load_dotenv
-from langchain_community.chat_models.tongyi import ChatTongyi
-from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables.history import RunnableWithMessageHistory
+import config_data as config
+
+try:
+    import fcntl
+except ImportError: #Windows
+    fcntl = None
+    import msvcrt
+
+_CLEAR_LINE = b'{"type": "__clear__"}' #清空标记行
+_TAIL_BLOCK = 64 * 1024 #tail 每次向前读取的字节数
+_write_lock = threading.RLock() #进程内追加写与压缩互斥(每轮问答都会新建历史对象, 锁放在模块级)
+_counts = {} #文件路径 -> (文件版本, 有效消息条数), 本进程追加写时增量更新
+_compact_checked = {} #文件路径 -> 上次检查是否需要压缩时的文件大小
+_compacting = set() #已经提交到后台、还没有执行完的压缩
+_compacting_lock = threading.Lock()
+
+
+@contextmanager
+def _file_lock(path):
+    """
+    跨进程的互斥锁: 锁住 {path}.lock 文件, 追加写和压缩都在锁内进行
+    """
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1) #最多等待约 10 秒, 超时后继续等待
+                    break
+                except OSError:
+                    time.sleep(0.01)
+        yield
+    finally:
+        os.close(fd) #关闭文件即释放锁
+
+
+_compact_executor = None #后台压缩会话历史文件的线程
+_compact_executor_lock = threading.Lock()
+
+def get_compact_executor():
+    global _compact_executor
+    with _compact_executor_lock:
+        if _compact_executor is None:
+            _compact_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-compact")
+    return _compact_executor
 
-load_dotenv()
 
 class FileChatMessageHistory(BaseChatMessageHistory):
-    def __init__(self, storage_path: str, session_id: str):
+    """
+    追加写的 JSONL 会话历史: 每行一条消息, 写入新消息时只在文件末尾追加, 不重写已有内容
+    clear 追加一行清空标记, 读取时跳过标记之前的消息和崩溃留下的半行
+    文件每增长 config.chat_history_compact_bytes 或执行 clear 后, 在后台检查无效内容的占比,
+    达到 config.chat_history_compact_ratio 时压缩: 在跨进程的文件锁内写临时文件后原子替换,
+    其他进程的追加写也在这把锁内进行, 不会丢失; 读取每次重新打开文件, 缓存按文件版本校验
+    旧版整体保存的 {session_id}.json 在第一次使用时转换成 JSONL
+    """
+
+    def __init__(self, storage_path: str, session_id: str, fsync=None, compact_bytes=None, compact_ratio=None):
+        """
+        fsync: 每次追加后是否 fsync 落盘, 默认 config.chat_history_fsync
+        compact_bytes: 文件每增长多少字节检查一次是否需要压缩, 0 表示不自动压缩
+        compact_ratio: 无效内容占文件大小的比例达到多少时压缩
+        """
         self.storage_path = storage_path
         self.session_id = session_id
+        self.fsync = config.chat_history_fsync if fsync is None else fsync
+        self.compact_bytes = config.chat_history_compact_bytes if compact_bytes is None else compact_bytes
+        self.compact_ratio = config.chat_history_compact_ratio if compact_ratio is None else compact_ratio
 
         #whole file path
-        self.file_path = os.path.join(self.storage_path, f"{self.session_id}.json")
+        self.file_path = os.path.join(self.storage_path, f"{self.session_id}.jsonl")
 
         os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        self._import_legacy()
 
-    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
-        all_messages = list(self.messages)  # Existing messages
-        all_messages.extend(messages)  # Add new messages + existing msg
+    def _import_legacy(self):
+        legacy_path = os.path.join(self.storage_path, f"{self.session_id}.json")
+        if os.path.exists(self.file_path) or not os.path.exists(legacy_path):
+            return
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            messages_data = json.load(f)
+        with _write_lock, _file_lock(self.file_path):
+            if not os.path.exists(self.file_path):
+                self._rewrite(messages_data)
 
-        #store to local file
+    @staticmethod
+    def _encode(message_data):
+        return json.dumps(message_data, ensure_ascii=False) + "\n"
+
+    def _rewrite(self, messages_data):
+        #写临时文件后原子替换, 中途崩溃不会留下半个文件
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(self._encode(data) for data in messages_data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+
+    def _append(self, text):
+        data = text.encode("utf-8")
+        fd = os.open(self.file_path, os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size:
+                os.lseek(fd, size - 1, os.SEEK_SET) #O_APPEND 下读取位置不影响写入位置, 写入总在末尾
+            if size and os.read(fd, 1) != b"\n":
+                data = b"\n" + data #上次写入崩溃留下了半行, 另起一行, 半行在读取时跳过
+            os.write(fd, data) #一次 write 追加整批消息
+            if self.fsync:
+                os.fsync(fd)
+            return size + len(data)
+        finally:
+            os.close(fd)
+
+    def _iter_records(self):
+        """
+        从最后一个清空标记之后逐行读取, 返回 (是否有效, 记录, 字节数); 无法解析的行(崩溃留下的半行)视为无效
+        """
+        try:
+            f = open(self.file_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            start = 0
+            for line in f:
+                if line.strip() == _CLEAR_LINE: #只比较字节, 不解析 JSON
+                    start = f.tell()
+            f.seek(start)
+            if start:
+                yield False, None, start #清空标记之前的内容也算无效内容
+            for line in f:
+                try:
+                    yield True, json.loads(line), len(line)
+                except ValueError:
+                    yield False, None, len(line)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
         #类对象写入文件会得到一堆二进制
         #为了方便，将baseMessage转成dict，再写入文件
         #官方提供了message_to_dict方法，可以直接将BaseMessage转成dict
-        # new_messages = []
-        # for message in all_messages:
-        #     new_messages.append(message_to_dict(message))
+        text = "".join(self._encode(message_to_dict(message)) for message in messages)
+        if not text:
+            return
+        with _write_lock, _file_lock(self.file_path):
+            before = self.version()
+            size = self._append(text)
+            counted = _counts.get(self.file_path)
+            if counted is not None and counted[0] == before:
+                _counts[self.file_path] = (self.version(), counted[1] + len(messages))
+        if self.compact_bytes and size - _compact_checked.get(self.file_path, 0) >= self.compact_bytes:
+            self.compact_in_background()
 
-        new_messages = [message_to_dict(message) for message in all_messages]
-        #将数据写入文件
-        with open(self.file_path, "w", encoding="utf-8") as f:
-            json.dump(new_messages, f)
-        
+    def iter_messages(self):
+        """
+        流式读取消息, 不把整个文件一次性读入内存
+        """
+        for valid, record, _ in self._iter_records():
+            if valid:
+                yield messages_from_dict([record])[0]
 
     @property #将msg当作成员属性来访问
     def messages(self) -> list[BaseMessage]:
+        #将dict转成BaseMessage对象
+        return messages_from_dict([record for valid, record, _ in self._iter_records() if valid])
+
+    def tail(self, n: int) -> list[BaseMessage]:
+        """
+        最后 n 条消息: 从文件末尾按块向前读, 只解析需要的行
+        """
+        if n <= 0:
+            return []
         try:
-            with open(self.file_path, "r", encoding="utf-8") as f:
-                messages_data = json.load(f)
-            #将dict转成BaseMessage对象
-            # new_messages = []
-            # for message_data in messages_data:
-            #     new_messages.append(messages_from_dict(message_data))
-            new_messages = messages_from_dict(messages_data)
-            return new_messages
+            f = open(self.file_path, "rb")
         except FileNotFoundError:
             return []
-        
+        records = []
+        with f:
+            position = f.seek(0, os.SEEK_END)
+            rest = b""
+            while position > 0 and len(records) < n:
+                step = min(_TAIL_BLOCK, position)
+                position -= step
+                f.seek(position)
+                lines = (f.read(step) + rest).split(b"\n")
+                rest = lines.pop(0) if position > 0 else b"" #块开头可能是半行, 留到下一块拼接
+                for line in reversed(lines):
+                    if not line.strip():
+                        continue
+                    if line.strip() == _CLEAR_LINE:
+                        position = 0
+                        break
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+                    if len(records) >= n:
+                        break
+        return messages_from_dict(records[::-1])
+
+    def message_count(self) -> int:
+        """
+        有效消息的条数; 文件没有被其他进程修改时直接使用本进程记录的条数, 不重新读取
+        """
+        version = self.version()
+        counted = _counts.get(self.file_path)
+        if counted is not None and counted[0] == version:
+            return counted[1]
+        count = sum(1 for valid, _, _ in self._iter_records() if valid)
+        _counts[self.file_path] = (version, count)
+        return count
+
+    def version(self):
+        """
+        文件的 (inode, 修改时间, 大小), 用于判断进程内缓存是否过期; 压缩替换文件后 inode 改变; 文件不存在时为 None
+        """
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def compact(self, force=False, min_ratio=0.0) -> bool:
+        """
+        去掉清空标记之前的消息和无法解析的行, 原子替换原文件
+        无效内容占比低于 min_ratio 或没有无效内容时不重写(force=True 时总是重写), 返回是否重写了文件
+        整个过程持有跨进程的文件锁, 其他进程的追加写在替换之后进行
+        """
+        with _write_lock, _file_lock(self.file_path):
+            records = []
+            garbage = 0
+            total = 0
+            for valid, record, size in self._iter_records():
+                total += size
+                if valid:
+                    records.append(record)
+                else:
+                    garbage += size
+            _compact_checked[self.file_path] = total
+            rewrite = force or (garbage > 0 and garbage >= total * min_ratio)
+            if rewrite:
+                self._rewrite(records)
+                _counts[self.file_path] = (self.version(), len(records))
+                _compact_checked[self.file_path] = os.path.getsize(self.file_path)
+            return rewrite
+
+    def compact_in_background(self):
+        """
+        在后台线程中按 compact_ratio 压缩, 不阻塞写入会话历史的请求; 同一个文件同时只提交一次
+        """
+        with _compacting_lock:
+            if self.file_path in _compacting:
+                return
+            _compacting.add(self.file_path)
+
+        def run():
+            try:
+                self.compact(min_ratio=self.compact_ratio)
+            except OSError:
+                traceback.print_exc() #例如 Windows 上文件正被其他进程打开, 下次增长后再试
+            finally:
+                with _compacting_lock:
+                    _compacting.discard(self.file_path)
+
+        get_compact_executor().submit(run)
+
     def clear(self) -> None:
-        with open(self.file_path, "w", encoding="utf-8") as f:
-            json.dump([], f)
+        with _write_lock, _file_lock(self.file_path):
+            self._append(_CLEAR_LINE.decode() + "\n")
+        if self.compact_bytes:
+            self.compact_in_background() #清空标记之前的内容都是无效内容
 
-    
 
-load_dotenv()
+def compact_directory(storage_path=None, force=False):
+    """
+    压缩目录下所有会话历史文件, 返回重写的文件数; 与服务的写入通过文件锁互斥, 可以随时执行
+    """
+    storage_path = storage_path or config.chat_history_path
+    compacted = 0
+    for name in os.listdir(storage_path):
+        if name.endswith(".jsonl"):
+            if FileChatMessageHistory(storage_path, name[:-len(".jsonl")]).compact(force):
+                compacted += 1
+    return compacted
+
+    
 
-model = ChatTongyi(model="qwen3-max")
-# prompt = PromptTemplate.from_template("你需要根据会话历史回应用户的问题。会话历史如下：\n{history}\n用户的问题是：{question}\n请根据会话历史回答用户的问题。")
+#get memory based on session id
+def get_history(session_id: str) -> BaseChatMessageHistory:
+    if config.chat_history_backend == "sqlite":
+        from sqlite_history_store import SqliteChatMessageHistory
+        history = SqliteChatMessageHistory(session_id)
+    else:
+        history = FileChatMessageHistory(storage_path=config.chat_history_path, session_id=session_id)
+    if config.history_cache_max_bytes:
+        #热点会话从进程内缓存读取, 不必每次重新解析
+        from history_cache import CachedChatMessageHistory
+        return CachedChatMessageHistory(history, session_id)
+    return history
 
-prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", "你需要根据会话历史回应用户的问题。"),
-        MessagesPlaceholder("history"),
-        ("human", "用户的问题是：{question}"),
-    ]
-)
 
 
-str_parser = StrOutputParser()
+def get_conversation_chain():
+    """
+    带会话历史的示例对话链(python file_history_store.py)
+    模型和提示词在调用时才创建, 只需要 get_history 的模块导入时不会加载聊天模型
+    """
+    from dotenv import load_dotenv
+    from langchain_community.chat_models.tongyi import ChatTongyi
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables.history import RunnableWithMessageHistory
 
-def print_prompt(input: dict):
-    print("="*20, input, "="*20)
-    return input
+    load_dotenv()
 
+    model = ChatTongyi(model="qwen3-max")
+    # prompt = PromptTemplate.from_template("你需要根据会话历史回应用户的问题。会话历史如下：\n{history}\n用户的问题是：{question}\n请根据会话历史回答用户的问题。")
 
-#creare a new chain with memory
-base_chain = prompt | print_prompt | model | str_parser
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", "你需要根据会话历史回应用户的问题。"),
+            MessagesPlaceholder("history"),
+            ("human", "用户的问题是：{question}"),
+        ]
+    )
 
 
+    str_parser = StrOutputParser()
 
-#get memory based on session id
-def get_history(session_id: str) -> FileChatMessageHistory:
-    return FileChatMessageHistory(storage_path="./chat_history", session_id=session_id)
+    def print_prompt(input: dict):
+        print("="*20, input, "="*20)
+        return input
 
 
+    #creare a new chain with memory
+    base_chain = prompt | print_prompt | model | str_parser
 
-conversation_chain = RunnableWithMessageHistory(
-    base_chain,
-    get_history, # get InmemoryChatMessageHistory class by session id 
-    input_messages_key= "question", #用户输入在模版中的占位符
-    history_messages_key= "history" #会话历史在模版中的占位符
-)
+    return RunnableWithMessageHistory(
+        base_chain,
+        get_history, # get InmemoryChatMessageHistory class by session id 
+        input_messages_key= "question", #用户输入在模版中的占位符
+        history_messages_key= "history" #会话历史在模版中的占位符
+    )
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["compact"]:
+        #手动压缩全部会话: python file_history_store.py compact [--force]
+        print(f"重写了 {compact_directory(force='--force' in sys.argv)} 个会话历史文件")
+        sys.exit(0)
+
     #固定格式，创建session id
     session_config = {
         "configurable" : {
             "session_id": "user_12345"
         }
     }
+    conversation_chain = get_conversation_chain()
     # res = conversation_chain.invoke({"question": "小明有两个猫"}, session_config)
     # print("first response: ", res)
 
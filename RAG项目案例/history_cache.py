@@ -0,0 +1,266 @@
+"""
+进程内会话历史缓存: 按 session_id 缓存已经解析好的消息, 热点会话直接从内存读取
+
+1. 每次读取前用底层存储的 version()(文件的修改时间和大小 / SQLite 的最后写入时间)校验, 其他进程写入后重新加载
+2. 按消息的总字节数做 LRU 淘汰, 上限 config.history_cache_max_bytes
+3. 可选的延迟写(config.history_write_behind): 追加的消息先放在内存中, 后台线程每隔
+   config.history_flush_interval 秒批量写入底层存储, 进程退出时写完剩余的消息
+"""
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+
+import config_data as config
+
+
+def message_bytes(message: BaseMessage):
+    #近似的内存占用: 内容的 UTF-8 字节数 + 固定开销
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return len(content.encode("utf-8")) + 200
+
+
+class _Entry(object):
+    def __init__(self, session_id, underlying, messages, version):
+        self.session_id = session_id
+        self.underlying = underlying #最近一次使用的底层存储, 延迟写时写入这里
+        self.messages = messages #包含还没有写入底层存储的消息
+        self.version = version #缓存对应的底层存储版本, None 表示需要重新加载
+        self.pending = [] #还没有写入底层存储的消息
+        self.nbytes = sum(message_bytes(message) for message in messages)
+        self.lock = threading.Lock() #同一会话的读写、写入底层存储互斥
+
+
+class HistoryCache(object):
+    def __init__(self, max_bytes=None, write_behind=None, flush_interval=None):
+        """
+        max_bytes: 缓存的消息总字节数上限, 超过时淘汰最久没有使用的会话
+        write_behind: 是否延迟批量写入底层存储
+        flush_interval: 延迟写的间隔(秒)
+        """
+        self.max_bytes = config.history_cache_max_bytes if max_bytes is None else max_bytes
+        self.write_behind = config.history_write_behind if write_behind is None else write_behind
+        self.flush_interval = flush_interval or config.history_flush_interval
+        self._entries = OrderedDict() #session_id -> _Entry
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._flusher = None
+        self._stopped = threading.Event()
+
+    def _entry(self, session_id, underlying):
+        """
+        取出会话的缓存项(不存在时创建一个待加载的), 标记为最近使用
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                entry = self._entries[session_id] = _Entry(session_id, underlying, [], None)
+            else:
+                self._entries.move_to_end(session_id)
+            entry.underlying = underlying
+            return entry
+
+    def _resize(self, entry, nbytes):
+        with self._lock:
+            if self._entries.get(entry.session_id) is entry: #已经被淘汰的缓存项不再计入
+                self._nbytes += nbytes - entry.nbytes
+            entry.nbytes = nbytes
+            self._evict()
+
+    def _evict(self):
+        #已持有 self._lock; 有未写入消息的会话不淘汰
+        for session_id in list(self._entries):
+            if self._nbytes <= self.max_bytes:
+                break
+            entry = self._entries[session_id]
+            if entry.pending:
+                continue
+            del self._entries[session_id]
+            self._nbytes -= entry.nbytes
+
+    def _load(self, entry):
+        """
+        在 entry.lock 中调用: 校验版本, 过期时从底层存储重新加载(保留还没有写入的消息)
+        """
+        version = entry.underlying.version()
+        hit = entry.version is not None and version == entry.version
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        if hit:
+            return
+        messages = entry.underlying.messages + entry.pending
+        entry.messages = messages
+        entry.version = version
+        self._resize(entry, sum(message_bytes(message) for message in messages))
+
+    def get(self, session_id, underlying) -> list[BaseMessage]:
+        entry = self._entry(session_id, underlying)
+        with entry.lock:
+            self._load(entry)
+            return list(entry.messages)
+
+    def _cached(self, entry):
+        """
+        在 entry.lock 中调用: 缓存已经加载并且是最新的时返回 True, 否则只记一次未命中, 不加载
+        """
+        hit = entry.version is not None and entry.underlying.version() == entry.version
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        return hit
+
+    def tail(self, session_id, underlying, n) -> list[BaseMessage]:
+        """
+        最后 n 条消息; 缓存未加载或已过期时直接读底层存储的末尾, 不为此加载整个会话
+        """
+        if n <= 0:
+            return []
+        entry = self._entry(session_id, underlying)
+        with entry.lock:
+            if self._cached(entry):
+                return entry.messages[-n:]
+            pending = entry.pending[-n:] #还没有写入底层存储的消息在最后
+            return underlying.tail(n - len(pending)) + pending
+
+    def count(self, session_id, underlying) -> int:
+        entry = self._entry(session_id, underlying)
+        with entry.lock:
+            if self._cached(entry):
+                return len(entry.messages)
+            return underlying.message_count() + len(entry.pending)
+
+    def add(self, session_id, underlying, messages: Sequence[BaseMessage]):
+        messages = list(messages)
+        if not messages:
+            return
+        while True:
+            entry = self._entry(session_id, underlying)
+            with entry.lock:
+                if self.write_behind:
+                    self._load(entry) #先确认缓存是最新的, 再把新消息追加在后面
+                    with self._lock:
+                        #取出缓存项之后它可能已经被淘汰, 不在 _entries 中的消息 flush 时写不到
+                        current = self._entries.get(session_id)
+                        if current is None:
+                            self._entries[session_id] = entry
+                            self._nbytes += entry.nbytes
+                        elif current is not entry:
+                            continue #其他线程已经创建了新的缓存项, 追加到新的缓存项中
+                        entry.pending.extend(messages) #与 _evict 在同一把锁内, 有未写入消息的缓存项不会被淘汰
+                    self._start_flusher()
+                else:
+                    before = underlying.version()
+                    underlying.add_messages(messages)
+                    if entry.version is None or entry.version != before:
+                        entry.version = None #写入前已经被其他进程修改过, 下次读取时重新加载
+                        return
+                    entry.version = underlying.version()
+                entry.messages = entry.messages + messages
+                self._resize(entry, entry.nbytes + sum(message_bytes(message) for message in messages))
+                return
+
+    def _flush_entry(self, entry):
+        with entry.lock:
+            if not entry.pending:
+                return
+            before = entry.underlying.version()
+            entry.underlying.add_messages(entry.pending) #一个会话积累的消息一次写入
+            entry.pending = []
+            entry.version = entry.underlying.version() if before == entry.version else None
+
+    def flush(self):
+        """
+        把所有未写入的消息写入底层存储
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            try:
+                self._flush_entry(entry)
+            except Exception as error:
+                print(f"会话历史写入失败, 下次重试: {error}")
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="history-flusher", daemon=True)
+            self._flusher.start()
+        atexit.register(self.close)
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """
+        停止后台线程并写完剩余的消息
+        """
+        self._stopped.set()
+        self.flush()
+
+    def invalidate(self, session_id):
+        """
+        丢弃会话的缓存(包括还没有写入的消息)
+        """
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._nbytes -= entry.nbytes
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._entries), "bytes": self._nbytes, "hits": self._hits, "misses": self._misses}
+
+
+class CachedChatMessageHistory(BaseChatMessageHistory):
+    """
+    通过进程内缓存读写的会话历史
+    underlying: 底层存储, 需要提供 version()
+    session_id: 会话 id
+    cache: 会话历史缓存, 默认使用进程内共享的缓存
+    """
+
+    def __init__(self, underlying: BaseChatMessageHistory, session_id: str, cache: HistoryCache = None):
+        self.underlying = underlying
+        self.session_id = session_id
+        self.cache = cache or get_history_cache()
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self.cache.get(self.session_id, self.underlying)
+
+    def tail(self, n: int) -> list[BaseMessage]:
+        return self.cache.tail(self.session_id, self.underlying, n)
+
+    def message_count(self) -> int:
+        return self.cache.count(self.session_id, self.underlying)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.cache.add(self.session_id, self.underlying, messages)
+
+    def clear(self) -> None:
+        self.cache.invalidate(self.session_id)
+        self.underlying.clear()
+
+
+
+_history_cache = None #进程内共享的会话历史缓存
+_history_cache_lock = threading.Lock()
+
+def get_history_cache():
+    global _history_cache
+    with _history_cache_lock:
+        if _history_cache is None:
+            _history_cache = HistoryCache()
+    return _history_cache
@@ -0,0 +1,81 @@
+"""
+混合检索: BM25 词法检索 + 向量检索, 用倒数排名融合(RRF)合并结果
+
+词法检索的最高分足够高且明显领先第二名时(例如问题里带有型号、人名), 直接返回词法结果,
+不再调用远程嵌入模型和向量检索
+"""
+import asyncio
+from typing import Any
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import config_data as config
+
+
+def doc_key(doc: Document):
+    #向量库返回的 Document 带有 id, 没有时退回到内容本身
+    return doc.id or doc.page_content
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    倒数排名融合: score(d) = sum(1 / (k + rank))
+    rankings: 多个按相关度排好序的 Document 列表
+    """
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    vector_retriever: 向量检索器, 返回数量应不少于 candidates
+    lexical_index: LexicalIndex 实例
+    top_k: 最终返回的数量
+    candidates: 每一路检索取回的候选数量
+    rrf_k: RRF 的平滑常数
+    fast_path_min_score: 词法快速路径要求的最低 BM25 分数
+    fast_path_ratio: 词法快速路径要求第一名与第二名的分数比
+    """
+
+    vector_retriever: BaseRetriever
+    lexical_index: Any
+    top_k: int = config.similarity_top_k
+    candidates: int = config.hybrid_candidates
+    rrf_k: int = config.hybrid_rrf_k
+    fast_path_min_score: float = config.bm25_fast_path_min_score
+    fast_path_ratio: float = config.bm25_fast_path_ratio
+
+    def _is_confident(self, hits):
+        if not hits or hits[0][1] < self.fast_path_min_score:
+            return False
+        return len(hits) == 1 or hits[0][1] >= hits[1][1] * self.fast_path_ratio
+
+    def _lexical_search(self, query):
+        hits = self.lexical_index.search(query, k=self.candidates)
+        return hits, self.lexical_index.get_documents([doc_id for doc_id, _ in hits])
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        hits, lexical_docs = self._lexical_search(query)
+
+        if self._is_confident(hits):
+            return lexical_docs[:self.top_k] #快速路径: 跳过远程嵌入和向量检索
+
+        dense_docs = self.vector_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return reciprocal_rank_fusion([dense_docs, lexical_docs], k=self.rrf_k)[:self.top_k]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> list[Document]:
+        hits, lexical_docs = await asyncio.to_thread(self._lexical_search, query) #SQLite 查询放到线程池, 不阻塞事件循环
+
+        if self._is_confident(hits):
+            return lexical_docs[:self.top_k]
+
+        dense_docs = await self.vector_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return reciprocal_rank_fusion([dense_docs, lexical_docs], k=self.rrf_k)[:self.top_k]
@@ -0,0 +1,187 @@
+"""
+目录批量入库: 遍历目录下的 txt/pdf/docx 文件, 多进程解析, 分批写入知识库
+
+用法: python ingest_dir.py 目录 [--workers 8] [--batch-files 32] [--checkpoint ./ingest_checkpoint.db]
+
+进度记录在 SQLite 检查点中, 中断后重新执行同一命令会跳过已经完成(且大小/修改时间未变)的文件
+"""
+import argparse
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import config_data as config
+from document_reader import SUPPORTED_SUFFIXES #与解析时按后缀选择解析函数的规则一致
+
+
+def parse_file(path):
+    """
+    在子进程中解析单个文件, 返回 (路径, 文本, 错误信息)
+    """
+    from document_reader import iter_document
+
+    try:
+        with open(path, "rb") as f:
+            text = "".join(iter_document(f, path))
+        return path, text, None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def walk_files(root):
+    """
+    遍历目录, 按路径排序返回所有支持的文件
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(SUPPORTED_SUFFIXES):
+                paths.append(os.path.join(dirpath, filename))
+    return paths
+
+
+class IngestCheckpoint(object):
+    def __init__(self, db_path):
+        """
+        db_path: 检查点数据库路径
+        """
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "mtime REAL NOT NULL, "
+            "status TEXT NOT NULL, " #done / error
+            "message TEXT, "
+            "finished_at REAL NOT NULL)"
+        )
+
+    def done_files(self):
+        """
+        返回已经成功入库的文件: 路径 -> (大小, 修改时间)
+        """
+        rows = self._conn.execute("SELECT path, size, mtime FROM files WHERE status = 'done'")
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def mark(self, records):
+        """
+        records: (路径, 大小, 修改时间, 状态, 信息) 的列表, 在一个事务中写入
+        """
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime, status, message, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(*record, now) for record in records],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self._conn.close()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入目录中的 txt/pdf/docx 文件到知识库")
+    parser.add_argument("directory", help="需要导入的目录")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="解析文件的进程数")
+    parser.add_argument("--batch-files", type=int, default=config.ingest_batch_files, help="每批写入知识库的文件数")
+    parser.add_argument("--checkpoint", default=config.ingest_checkpoint_path, help="检查点数据库路径")
+    args = parser.parse_args()
+
+    #只在主进程中创建知识库服务, 解析子进程不需要加载向量库和嵌入模型
+    from knowledge_base import KnowledgeBaseService
+
+    root = os.path.abspath(args.directory)
+    checkpoint = IngestCheckpoint(args.checkpoint)
+    done = checkpoint.done_files()
+
+    all_paths = walk_files(root)
+    todo = []
+    for path in all_paths:
+        signature = file_signature(path)
+        if done.get(os.path.relpath(path, root)) != signature:
+            todo.append((path, signature))
+    print(f"共 {len(all_paths)} 个文件, 已完成 {len(all_paths) - len(todo)} 个, 本次处理 {len(todo)} 个")
+    if not todo:
+        return
+
+    service = KnowledgeBaseService()
+    start = time.perf_counter()
+    files_done = 0
+    chunks_done = 0
+    errors = 0
+
+    def flush(batch):
+        """
+        将一批解析好的文件写入知识库, 并记录检查点
+        batch: (相对路径, 文本, 签名) 列表
+        """
+        nonlocal files_done, chunks_done
+        written = [0] #本批写入的片段数, 由进度回调更新
+
+        def on_progress(done, seconds):
+            written[0] = done
+
+        service.upload_batch([(text, relpath) for relpath, text, _ in batch], on_progress=on_progress)
+        chunks_done += written[0]
+        checkpoint.mark([(relpath, *signature, "done", None) for relpath, _, signature in batch])
+        files_done += len(batch)
+        elapsed = time.perf_counter() - start
+        print(
+            f"[{files_done + errors}/{len(todo)}] "
+            f"{files_done / elapsed:.1f} 文件/秒, {chunks_done / elapsed:.1f} 片段/秒, "
+            f"失败 {errors} 个, 用时 {elapsed:.0f} 秒",
+            flush=True,
+        )
+
+    signatures = dict(todo)
+    batch = []
+    max_pending = args.workers * 4 #限制在途解析任务数量, 避免解析结果在内存中堆积
+    paths = iter(path for path, _ in todo)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        pending = set()
+        while True:
+            for path in paths:
+                pending.add(executor.submit(parse_file, path))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path, text, error = future.result()
+                relpath = os.path.relpath(path, root)
+                if error is not None:
+                    errors += 1
+                    checkpoint.mark([(relpath, *signatures[path], "error", error)])
+                    print(f"解析失败: {relpath}: {error}", flush=True)
+                    continue
+                batch.append((relpath, text, signatures[path]))
+                if len(batch) >= args.batch_files:
+                    flush(batch)
+                    batch = []
+        if batch:
+            flush(batch)
+
+    checkpoint.close()
+    elapsed = time.perf_counter() - start
+    print(f"完成: 成功 {files_done} 个, 失败 {errors} 个, 新增 {chunks_done} 个片段, 用时 {elapsed:.1f} 秒")
+    if hasattr(service.vector_store, "wait_ann_index"):
+        #入库期间行数达到阈值时 IVF 索引在后台训练, 等它完成再退出
+        service.vector_store.wait_ann_index()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+后台入库任务队列: 上传的文件先写入暂存目录并立即返回任务 id, 由后台线程解析、切分、向量化
+
+任务保存在进程内共享的队列中, Streamlit 页面重新运行、刷新或换一个浏览器会话都不会丢失正在进行的任务;
+页面按任务 id 轮询进度(已解析的页数/文本块数、已向量化的片段数)
+默认只有一个工作线程, 每个任务内部的向量化已经是分批并发的, 多个任务同时写向量库反而互相争抢
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import config_data as config
+
+QUEUED = "排队中"
+RUNNING = "处理中"
+DONE = "完成"
+FAILED = "失败"
+
+
+class IngestJob(object):
+    def __init__(self, filename, path, size, file_md5=None):
+        """
+        filename: 原始文件名
+        path: 暂存文件路径, 任务结束后删除
+        size: 文件字节数
+        file_md5: 原始文件字节的 md5
+        """
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.file_md5 = file_md5
+        self.status = QUEUED
+        self.blocks = 0 #已解析的页数(pdf)或文本块数(txt/docx)
+        self.chunks = 0 #已向量化并写入的片段数
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def snapshot(self):
+        """
+        页面展示用的只读副本
+        """
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "status": self.status,
+            "blocks": self.blocks,
+            "chunks": self.chunks,
+            "seconds": end - self.started_at if self.started_at else 0.0,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class IngestJobQueue(object):
+    def __init__(self, get_service, max_workers=None, spool_dir=None, max_jobs=None):
+        """
+        get_service: 返回知识库服务的函数, 第一个任务开始时才调用
+        max_workers: 同时执行的任务数
+        spool_dir: 上传文件的暂存目录
+        max_jobs: 最多保留的任务记录数, 超过时丢弃最早完成的
+        """
+        self.get_service = get_service
+        self.spool_dir = spool_dir or config.ingest_spool_dir
+        self.max_jobs = max_jobs or config.ingest_max_jobs
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or config.ingest_workers, thread_name_prefix="ingest")
+        self._jobs = {} #任务 id -> 任务, 按提交顺序
+        self._lock = threading.Lock()
+
+    def submit(self, stream, filename, size=None):
+        """
+        把上传的文件写入暂存目录并加入队列, 立即返回任务 id
+        stream: 二进制文件对象, 例如 streamlit 的 UploadedFile
+        """
+        suffix = os.path.splitext(filename)[1]
+        md5_obj = hashlib.md5() #原始文件的 md5, 重复上传的文件不需要解析
+        with tempfile.NamedTemporaryFile("wb", suffix=suffix, dir=self.spool_dir, delete=False) as f:
+            stream.seek(0)
+            for data in iter(lambda: stream.read(1024 * 1024), b""):
+                md5_obj.update(data)
+                f.write(data)
+            path = f.name
+        job = IngestJob(filename, path, size if size is not None else os.path.getsize(path), md5_obj.hexdigest())
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        self._executor.submit(self._run, job)
+        return job.id
+
+    def _trim(self):
+        #已持有 self._lock; 只丢弃已经结束的任务记录
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        from document_reader import iter_document
+
+        job.status = RUNNING
+        job.started_at = time.time()
+
+        def counted(blocks):
+            for block in blocks:
+                job.blocks += 1
+                yield block
+
+        def on_progress(chunks, seconds):
+            job.chunks = chunks
+
+        try:
+            with open(job.path, "rb") as f:
+                job.result = self.get_service().upload_by_stream(
+                    counted(iter_document(f, job.filename)), job.filename, on_progress=on_progress, file_md5=job.file_md5,
+                )
+            job.status = DONE
+        except Exception as error:
+            job.error = f"{type(error).__name__}: {error}"
+            job.status = FAILED
+            traceback.print_exc()
+        finally:
+            job.finished_at = time.time()
+            try:
+                os.remove(job.path)
+            except OSError:
+                pass
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.snapshot() if job else None
+
+    def list(self):
+        """
+        所有任务的进度, 最新提交的在前
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.snapshot() for job in reversed(jobs)]
+
+
+
+_ingest_queue = None #进程内共享的入库任务队列
+_ingest_queue_lock = threading.Lock()
+
+def get_ingest_queue():
+    global _ingest_queue
+    with _ingest_queue_lock:
+        if _ingest_queue is None:
+            from services import get_knowledge_base_service
+            _ingest_queue = IngestJobQueue(get_knowledge_base_service)
+    return _ingest_queue
@@ -0,0 +1,204 @@
+"""
+IVF(倒排文件)近似最近邻索引, 供 MmapVectorStore 使用
+
+训练: 在抽样的向量上做球面 k-means, 得到 nlist 个聚类中心
+入库: 每个新行分配到最近的聚类中心, 追加到该聚类的行号列表中(增量维护, 不需要重建)
+检索: 找出与查询最近的 nprobe 个聚类中心, 只在这些聚类的行中做精确(或量化 + 重新打分)检索
+
+文件(与向量库在同一目录):
+    ivf.json            聚类数量和训练版本号
+    ivf_centroids.f32   聚类中心 (nlist x 维度)
+    ivf_assign.i4       每行所属的聚类, 未训练前写入的行为 -1
+"""
+import json
+import os
+
+import numpy as np
+
+import config_data as config
+
+ASSIGN_BLOCK_ROWS = 65536 #分配聚类时每次参与矩阵乘法的行数
+
+
+def assign_lists(vectors, centroids):
+    """
+    返回每个向量最近(内积最大)的聚类中心下标
+    """
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        end = min(start + ASSIGN_BLOCK_ROWS, len(vectors))
+        labels[start:end] = np.argmax(np.asarray(vectors[start:end], dtype=np.float32) @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors, nlist, iterations=10, seed=0):
+    """
+    归一化向量上的 k-means, 聚类中心每轮重新归一化; 空的聚类用随机样本重新初始化
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign_lists(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        sorted_labels = labels[order]
+        present, starts = np.unique(sorted_labels, return_index=True)
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+        centroids[present] = sums
+        empty = np.setdiff1d(np.arange(nlist), present)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    return centroids.astype(np.float32)
+
+
+class IvfIndex(object):
+    def __init__(self, directory, nprobe=None):
+        """
+        directory: 向量库的数据目录
+        nprobe: 每次检索扫描的聚类数量, 默认 config.ivf_nprobe
+        """
+        self.directory = directory
+        self.nprobe = nprobe or config.ivf_nprobe
+        self.version = 0 #训练版本号, 重新训练后读进程据此重新加载
+        self.centroids = None
+        self.lists = [] #每个聚类的行号数组
+        self.synced = 0 #已经加入 lists 的行数
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_header(self):
+        try:
+            with open(self._path("ivf.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": 0, "nlist": 0}
+
+    def _assign_map(self, mode, rows):
+        return np.memmap(self._path("ivf_assign.i4"), dtype=np.int32, mode=mode, shape=(rows,))
+
+    def sync(self, count):
+        """
+        与磁盘上的索引同步到前 count 行: 重新训练过则整体重新加载, 否则只加入新增行
+        """
+        header = self._read_header()
+        if header["version"] != self.version:
+            self.version = header["version"]
+            self.centroids = None
+            self.lists = []
+            self.synced = 0
+            if header["nlist"]:
+                dim = os.path.getsize(self._path("ivf_centroids.f32")) // (4 * header["nlist"])
+                self.centroids = np.fromfile(self._path("ivf_centroids.f32"), dtype=np.float32).reshape(header["nlist"], dim)
+                self.lists = [np.empty(0, dtype=np.int64) for _ in range(header["nlist"])]
+        if not self.trained or count <= self.synced:
+            return
+        labels = np.array(self._assign_map("r", count)[self.synced:count])
+        self._extend(np.arange(self.synced, count), labels)
+        self.synced = count
+
+    def _extend(self, rows, labels):
+        """
+        把行追加到各自的聚类列表中
+        """
+        order = np.argsort(labels, kind="stable")
+        rows, labels = rows[order], labels[order]
+        present, starts = np.unique(labels, return_index=True)
+        for label, chunk in zip(present, np.split(rows, starts[1:])):
+            if label >= 0:
+                self.lists[label] = np.concatenate([self.lists[label], chunk])
+
+    def _write_assignments(self, start, labels):
+        path = self._path("ivf_assign.i4")
+        needed = (start + len(labels)) * 4
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < needed:
+            with open(path, "ab") as f:
+                f.truncate(max(needed, size * 2))
+        assign = self._assign_map("r+", start + len(labels))
+        assign[start:] = labels
+        assign.flush()
+
+    def add(self, start, vectors):
+        """
+        新写入的行(从 start 开始)分配到聚类; 未训练时记为 -1, 训练时再统一分配
+        """
+        if self.trained:
+            labels = assign_lists(vectors, self.centroids)
+            self._extend(np.arange(start, start + len(vectors)), labels)
+        else:
+            labels = np.full(len(vectors), -1, dtype=np.int32)
+        self._write_assignments(start, labels)
+        self.synced = start + len(vectors)
+
+    def fit(self, vectors, count, nlist=None, sample_per_list=64):
+        """
+        在前 count 行上训练聚类中心并分配这些行, 返回 (聚类中心, 每行的聚类); 只做计算, 不修改索引
+        vectors: float32 向量矩阵(可以是内存映射)
+        nlist: 聚类数量, 默认 config.ivf_nlist, 为 0 时取 4 * sqrt(count)
+        """
+        nlist = nlist or config.ivf_nlist or int(4 * np.sqrt(count))
+        nlist = max(1, min(nlist, count))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(count, min(count, nlist * sample_per_list), replace=False))
+        centroids = spherical_kmeans(np.asarray(vectors[sample_rows], dtype=np.float32), nlist)
+        return centroids, assign_lists(vectors[:count], centroids)
+
+    def install(self, centroids, labels):
+        """
+        写入 fit 的结果并替换内存中的索引, labels 覆盖从第 0 行开始的全部行; 读进程按版本号重新加载
+        """
+        centroids.tofile(self._path("ivf_centroids.f32"))
+        self._write_assignments(0, labels)
+        version = self._read_header()["version"] + 1
+        tmp_path = self._path("ivf.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "nlist": len(centroids)}, f)
+        os.replace(tmp_path, self._path("ivf.json"))
+
+        self.version = version
+        self.centroids = centroids
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(len(centroids))]
+        self._extend(np.arange(len(labels)), labels)
+        self.synced = len(labels)
+
+    def train(self, vectors, count, nlist=None, sample_per_list=64):
+        """
+        在前 count 行上训练聚类中心, 并重新分配全部行
+        """
+        self.install(*self.fit(vectors, count, nlist, sample_per_list))
+
+    def candidates(self, query, nprobe=None):
+        """
+        与查询最近的 nprobe 个聚类中的全部行号(升序)
+        """
+        nprobe = min(nprobe or self.nprobe, len(self.lists))
+        scores = self.centroids @ query
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([self.lists[label] for label in probe]))
+
+    def nbytes(self):
+        """
+        索引占用的内存(聚类中心 + 行号列表)
+        """
+        if not self.trained:
+            return 0
+        return self.centroids.nbytes + sum(rows.nbytes for rows in self.lists)
+
+
+if __name__ == "__main__":
+    #为 config.mmap_store_directory 中的向量库(重新)训练 IVF 索引
+    import time
+
+    from mmap_vector_store import MmapVectorStore
+
+    store = MmapVectorStore(None)
+    start = time.perf_counter()
+    store.build_ann_index()
+    print(f"IVF 索引训练完成: {store.count}行, {len(store.ann.lists)}个聚类, {time.perf_counter() - start:.1f}秒")
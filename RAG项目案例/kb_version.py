@@ -0,0 +1,71 @@
+"""
+知识库版本号: 每次知识库内容变化(新增/删除片段)时加一, 检索缓存等据此判断是否失效
+
+版本号保存在 SQLite 中, 上传服务和问答服务是不同的进程, 也能看到彼此的修改
+"""
+import os
+import sqlite3
+import threading
+
+import config_data as config
+
+
+class KnowledgeBaseVersion(object):
+    def __init__(self, db_path):
+        """
+        db_path: 版本号数据库路径
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kb_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO kb_version (id, version) VALUES (0, 0)")
+        self._data_version = None #SQLite 的 data_version, 其他连接提交后会变化
+        self._version = 0
+
+    def get(self):
+        """
+        当前版本号; 数据库没有被其他连接修改时直接返回缓存值
+        """
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._version = self._conn.execute("SELECT version FROM kb_version WHERE id = 0").fetchone()[0]
+                self._data_version = data_version
+            return self._version
+
+    def bump(self):
+        """
+        版本号加一, 返回新的版本号
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("UPDATE kb_version SET version = version + 1 WHERE id = 0")
+                self._version = self._conn.execute("SELECT version FROM kb_version WHERE id = 0").fetchone()[0]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._version
+
+
+
+_kb_version = None #进程内共享的版本号对象
+_kb_version_lock = threading.Lock()
+
+def _get_instance():
+    global _kb_version
+    with _kb_version_lock:
+        if _kb_version is None:
+            _kb_version = KnowledgeBaseVersion(config.kb_version_path)
+    return _kb_version
+
+
+def get_kb_version():
+    return _get_instance().get()
+
+
+def bump_kb_version():
+    return _get_instance().bump()
@@ -1,38 +1,47 @@
 """
 知识库服务基础代码
 """
-import os
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from dotenv import load_dotenv 
 import config_data as config
 import hashlib 
-from langchain_chroma import Chroma
-from langchain_community.embeddings import DashScopeEmbeddings 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from datetime import datetime
 
+from md5_registry import Md5Registry
+from embedding_cache import get_cached_embeddings
+from fast_splitter import FastRecursiveTextSplitter
+from kb_version import bump_kb_version
+from lexical_index import get_lexical_index
+from vector_stores import create_vector_store, upsert_embeddings
+
 load_dotenv()
+
+_md5_registry = None #进程内共享的去重登记表, 第一次使用时创建
+_md5_registry_lock = threading.Lock()
+
+def get_md5_registry():
+    global _md5_registry
+    with _md5_registry_lock:
+        if _md5_registry is None:
+            _md5_registry = Md5Registry(config.md5_db_path, legacy_path=config.md5_path)
+    return _md5_registry
+
+
 #检查文件是被处理过了
 def check_md5(md5_str: str):
-    if not os.path.exists(config.md5_path):
-        #文件不存在，没处理过
-        open(config.md5_path, "w", encoding="utf-8").close() #创建空文件
-        return False
-    else:
-        for line in open(config.md5_path, "r", encoding="utf-8").readlines():
-            line = line.strip()
-            if line == md5_str:
-                return True
-        return False
-    
+    return get_md5_registry().contains(md5_str)
+
 
 
 
 
 #将传入的md5文件保存到数据库中
 def save_md5(md5_str: str):
-    with open(config.md5_path, "a", encoding="utf-8") as f:
-        f.write(md5_str + "\n")
+    get_md5_registry().add(md5_str)
 
 
 
@@ -52,26 +61,129 @@ def get_string_md5(input_str: str, encoding = "utf-8"):
 
 
 
+#计算片段的 id: 同一文件中内容相同的片段 id 相同
+def get_chunk_id(filename: str, chunk: str):
+    return get_string_md5(f"{filename}\x00{chunk}")
+
+
+
+
+
+class EmbeddingPipeline(object):
+    def __init__(self, embedding, writer, batch_size=None, max_workers=None, max_retries=None, retry_backoff=None):
+        """
+        分批、并发的向量化流水线
+        embedding: 嵌入模型, 需要实现 embed_documents
+        writer: 写入函数 writer(ids, texts, embeddings, metadatas), 每个批次完成后在调用线程中执行
+        batch_size: 每批的片段数量
+        max_workers: 并发向量化的线程数
+        max_retries: 每批失败后的最大重试次数
+        retry_backoff: 第一次重试前等待的秒数, 之后每次翻倍
+        """
+        self.embedding = embedding
+        self.writer = writer
+        self.batch_size = batch_size or config.embedding_batch_size
+        self.max_workers = max_workers or config.embedding_max_workers
+        self.max_retries = config.embedding_max_retries if max_retries is None else max_retries
+        self.retry_backoff = config.embedding_retry_backoff if retry_backoff is None else retry_backoff
+
+    def _batches(self, items):
+        """
+        将 (id, 文本, 元数据) 的可迭代对象按 batch_size 切成批次, 不需要一次性读完
+        """
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _embed_batch(self, batch):
+        """
+        在工作线程中向量化一个批次, 失败时按指数退避重试
+        """
+        texts = [text for _, text, _ in batch]
+        retries = 0
+        while True:
+            try:
+                return batch, self.embedding.embed_documents(texts), retries
+            except Exception:
+                if retries >= self.max_retries:
+                    raise
+                time.sleep(self.retry_backoff * (2 ** retries))
+                retries += 1
+
+    def run(self, items, on_progress=None):
+        """
+        执行流水线, 返回统计信息
+        items: (id, 文本, 元数据) 的可迭代对象
+        on_progress: 进度回调 on_progress(已写入片段数, 已用秒数)
+        """
+        stats = {"chunks": 0, "batches": 0, "retries": 0}
+        start = time.perf_counter()
+        max_pending = self.max_workers * 2 #限制在途批次数量, 避免一次性把所有片段读进内存
+
+        def collect(done):
+            for future in done:
+                batch, embeddings, retries = future.result()
+                self.writer(
+                    [chunk_id for chunk_id, _, _ in batch],
+                    [text for _, text, _ in batch],
+                    embeddings,
+                    [metadata for _, _, metadata in batch],
+                )
+                stats["chunks"] += len(batch)
+                stats["batches"] += 1
+                stats["retries"] += retries
+                if on_progress:
+                    on_progress(stats["chunks"], time.perf_counter() - start)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            try:
+                for batch in self._batches(items):
+                    pending.add(executor.submit(self._embed_batch, batch))
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            except Exception:
+                for future in pending:
+                    future.cancel()
+                raise
+
+        stats["seconds"] = time.perf_counter() - start
+        stats["chunks_per_sec"] = stats["chunks"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+        return stats
+
+
+
 
 
 class KnowledgeBaseService(object):
-    def __init__(self):
-        os.makedirs(config.persist_directory, exist_ok=True) #创建数据库本地存储文件夹
+    def __init__(self, embedding=None):
+        """
+        embedding: 嵌入模型, 默认使用带缓存的 DashScope 模型, 测试时可以传入本地的假模型
+        """
+        self.embedding = embedding or get_cached_embeddings(config.embedding_name) #带缓存的嵌入模型, 进程内共享
         
-        self.chroma = Chroma(
-            collection_name = config.collection_name, #数据库的表名
-            embedding_function= DashScopeEmbeddings(model = "text-embedding-v4"),
-            persist_directory= config.persist_directory #数据库本地存储文件夹
-        ) #向量存储的chroma实例对象
+        self.vector_store = create_vector_store(self.embedding) #向量库实例对象, Chroma 或内存映射向量库(config.vector_backend)
 
 
-        self.spliter = RecursiveCharacterTextSplitter(
+        self.spliter = FastRecursiveTextSplitter(
             chunk_size = config.chunk_size,
             chunk_overlap= config.chunk_overlap,
             separators= config.separators,
             length_function = len
-        ) #文本切分器实例对象
+        ) #文本切分器实例对象, 输出与 RecursiveCharacterTextSplitter 一致
 
+        self.lexical_index = get_lexical_index() #BM25 词法索引, 与向量库保存相同的片段
+
+        self.pipeline = EmbeddingPipeline(self.embedding, self._write_vectors) #分批并发的向量化流水线
 
 
     def upload_by_str(self, data, filename):
@@ -91,12 +203,183 @@ class KnowledgeBaseService(object):
         else:
             knowledge = [data]
 
+        return self._ingest(knowledge, filename, lambda: md5_hex)
+
+
+    def upload_by_stream(self, blocks, filename, on_progress=None, file_md5=None):
+        """
+        流式上传: 边解析边切分边向量化, 内存占用与文档大小无关, 片段与 upload_by_str 完全相同
+        blocks: 文本块的可迭代对象(例如逐页的 pdf 文本), 按顺序拼接后等于完整文档
+        filename: 文件名
+        on_progress: 进度回调 on_progress(已写入片段数, 已用秒数)
+        file_md5: 原始文件字节的 md5, 可选; 文本的 md5 要解析完才知道, 传入时在解析之前先按它去重
+        """
+        if file_md5 and check_md5(file_md5):
+            return f"{filename}上传过了，跳过."
+
+        md5_obj = hashlib.md5() #整篇文档的 md5 边读边算, 与 upload_by_str 的结果一致
+
+        def hashed_blocks():
+            for block in blocks:
+                md5_obj.update(block.encode("utf-8"))
+                yield block
+
+        result = self._ingest(self._split_stream(hashed_blocks()), filename, md5_obj.hexdigest, on_progress)
+        if file_md5:
+            save_md5(file_md5)
+        return result
+
+
+    def _split_stream(self, blocks):
+        """
+        增量切分, 输出与 upload_by_str 对整篇文档的切分完全一致, 片段 id 不随上传方式变化
+        文档总长度不超过 max_spilter_char_number 时与 upload_by_str 相同, 整篇作为一个片段
+        """
+        blocks = iter(blocks)
+        head = ""
+        for block in blocks:
+            head += block
+            if len(head) > config.max_spilter_char_number:
+                break
+        if len(head) <= config.max_spilter_char_number:
+            if head:
+                yield head
+            return
+        yield from self.spliter.split_stream(itertools.chain([head], blocks), config.stream_split_window)
+
+
+    def upload_batch(self, documents, on_progress=None):
+        """
+        批量上传多个文档, 所有文档的新增片段合并进同一条流水线, 小文件也能凑满向量化批次
+        documents: (字符串, 文件名) 的列表
+        on_progress: 进度回调 on_progress(已写入片段数, 已用秒数)
+        返回: 与 documents 一一对应的结果字符串列表
+        """
+        results = [None] * len(documents)
+        plans = [] #(下标, 文件名, md5, 已有 id, 本次出现的 id, 计数)
+        streams = []
+        for i, (data, filename) in enumerate(documents):
+            md5_hex = get_string_md5(data)
+            if check_md5(md5_hex):
+                results[i] = f"{filename}上传过了，跳过."
+                continue
+            if len(data) > config.max_spilter_char_number:
+                knowledge = self.spliter.split_text(data)
+            else:
+                knowledge = [data]
+            existing_ids = self._get_source_ids(filename)
+            seen_ids = set()
+            counter = {"new": 0, "reused": 0}
+            plans.append((i, filename, md5_hex, existing_ids, seen_ids, counter))
+            streams.append(self._new_chunks(knowledge, filename, existing_ids, seen_ids, counter))
+
+        stats = self.pipeline.run(itertools.chain.from_iterable(streams), on_progress=on_progress)
+
+        changed = stats["chunks"] > 0
+        for i, filename, md5_hex, existing_ids, seen_ids, counter in plans:
+            stale_ids = self._delete_stale(existing_ids, seen_ids)
+            changed = changed or bool(stale_ids)
+            save_md5(md5_hex)
+            results[i] = self._format_result(counter, stale_ids, stats)
+        if changed:
+            bump_kb_version() #知识库内容变化, 让检索缓存失效
+        return results
+
+
+    def _new_chunks(self, knowledge, filename, existing_ids, seen_ids, counter):
+        """
+        逐个计算片段 id, 只产出库中还没有的片段 (id, 文本, 元数据)
+        每个片段按 (文件名, 内容) 计算 md5, 作为向量库中的 id, 同一文件内容相同的片段只保留一份
+        existing_ids: 该文件已经入库的片段 id
+        seen_ids: 收集本次文档中出现的片段 id
+        counter: 统计新增/复用的片段数量
+        """
         metadata = {
             "source": filename, 
             "create_time" : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "operator": "admin"
             }
-        
-        self.chroma.add_texts(knowledge, metadatas=[metadata for _ in knowledge]) #向量化并保存到数据库中
-        save_md5(md5_hex) #保存md5值到文件中
-        return "上传成功，内容已经加载到知识库中"
+        for chunk in knowledge:
+            chunk_id = get_chunk_id(filename, chunk)
+            if chunk_id in seen_ids:
+                continue
+            seen_ids.add(chunk_id)
+            if chunk_id in existing_ids:
+                counter["reused"] += 1
+                continue
+            counter["new"] += 1
+            yield chunk_id, chunk, metadata
+
+
+    def _delete_stale(self, existing_ids, seen_ids):
+        """
+        删除文件中已经不存在的片段, 返回被删除的 id
+        """
+        stale_ids = [chunk_id for chunk_id in existing_ids if chunk_id not in seen_ids]
+        if stale_ids:
+            self.vector_store.delete(ids=stale_ids)
+            self.lexical_index.delete(stale_ids)
+        return stale_ids
+
+
+    def _format_result(self, counter, stale_ids, stats):
+        return (
+            "上传成功，内容已经加载到知识库中"
+            f"(新增{counter['new']}个片段，删除{len(stale_ids)}个片段，"
+            f"复用{counter['reused']}个片段，{stats['chunks_per_sec']:.1f}片段/秒)"
+        )
+
+
+    def _ingest(self, knowledge, filename, get_md5, on_progress=None):
+        """
+        按片段 id 与库中已有的片段比较, 只向量化新增片段, 删除已经不存在的片段
+        knowledge: 片段的可迭代对象
+        get_md5: 返回整篇文档 md5 的函数, 在片段全部处理完后调用
+        """
+        existing_ids = self._get_source_ids(filename) #该文件已经入库的片段 id
+        seen_ids = set() #本次文档中出现的片段 id
+        counter = {"new": 0, "reused": 0}
+
+        #只对新增的片段分批并发向量化, 每批完成后写入数据库
+        stats = self.pipeline.run(
+            self._new_chunks(knowledge, filename, existing_ids, seen_ids, counter), on_progress=on_progress
+        )
+
+        stale_ids = self._delete_stale(existing_ids, seen_ids)
+        if stats["chunks"] or stale_ids:
+            bump_kb_version() #知识库内容变化, 让检索缓存失效
+        save_md5(get_md5()) #保存md5值到文件中
+        return self._format_result(counter, stale_ids, stats)
+
+
+    def _write_vectors(self, ids, texts, embeddings, metadatas):
+        """
+        将已经向量化的一批片段批量写入向量库和词法索引
+        """
+        upsert_embeddings(self.vector_store, ids, texts, embeddings, metadatas)
+        self.lexical_index.add(ids, texts, metadatas) #同步更新 BM25 词法索引
+
+
+    def _get_source_ids(self, filename):
+        """
+        查询某个文件已经保存在向量库中的全部片段 id
+        """
+        result = self.vector_store.get(where={"source": filename}, include=[])
+        return set(result["ids"])
+
+
+    def rebuild_lexical_index(self, page_size=1000):
+        """
+        把向量库中已有、但还不在词法索引中的片段补进去, 用于启用混合检索前已经入库的数据
+        """
+        added = 0
+        offset = 0
+        while True:
+            result = self.vector_store.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            if not result["ids"]:
+                break
+            added += self.lexical_index.add(result["ids"], result["documents"], result["metadatas"])
+            offset += len(result["ids"])
+        if added:
+            bump_kb_version()
+        return f"词法索引补充了{added}个片段，共{self.lexical_index.count()}个片段"
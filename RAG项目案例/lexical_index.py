@@ -0,0 +1,232 @@
+"""
+本地 BM25 词法索引: 与向量库保存相同的片段, 用于精确匹配人名、产品型号等
+
+分词: 中文按字的二元组(bigram)切分, 连续的字母数字作为一个词, 字母数字混合时再拆出纯字母/纯数字部分
+索引: SQLite 倒排表, 入库时增量维护, 上传进程和问答进程共享
+"""
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+from langchain_core.documents import Document
+
+import config_data as config
+
+_TOKEN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+")
+_ALNUM_PARTS = re.compile(r"[a-z]+|[0-9]+")
+
+
+def tokenize(text: str):
+    """
+    中英文混合分词, 返回词列表(可重复)
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _TOKEN.finditer(text):
+        word = match.group()
+        if word[0].isascii():
+            tokens.append(word)
+            parts = _ALNUM_PARTS.findall(word)
+            if len(parts) > 1:
+                tokens.extend(parts) #ROW100 -> row100, row, 100
+        elif len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+class LexicalIndex(object):
+    def __init__(self, db_path=None, k1=1.5, b=0.75):
+        """
+        db_path: 索引数据库路径
+        k1, b: BM25 参数
+        """
+        self.db_path = db_path or config.lexical_index_path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                length INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                doc_length INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS stats (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats (key, value) VALUES ('doc_count', 0), ('total_length', 0);
+            """
+        )
+
+    def _write(self, func):
+        """
+        在一个写事务中执行 func(conn)
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def add(self, ids, texts, metadatas=None):
+        """
+        添加片段, 已经存在的 id 跳过
+        """
+        metadatas = metadatas or [{} for _ in ids]
+
+        def write(conn):
+            placeholders = ",".join("?" * len(ids))
+            existing = {row[0] for row in conn.execute(f"SELECT id FROM docs WHERE id IN ({placeholders})", list(ids))}
+            docs = []
+            postings = []
+            df = Counter()
+            total_length = 0
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                if doc_id in existing:
+                    continue
+                existing.add(doc_id)
+                tf = Counter(tokenize(text))
+                length = sum(tf.values())
+                docs.append((doc_id, length, text, json.dumps(metadata, ensure_ascii=False)))
+                postings.extend((term, doc_id, count, length) for term, count in tf.items())
+                df.update(tf.keys())
+                total_length += length
+            if not docs:
+                return 0
+            conn.executemany("INSERT INTO docs (id, length, content, metadata) VALUES (?, ?, ?, ?)", docs)
+            conn.executemany("INSERT INTO postings (term, doc_id, tf, doc_length) VALUES (?, ?, ?, ?)", postings)
+            conn.executemany(
+                "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+                df.items(),
+            )
+            self._update_stats(conn, len(docs), total_length)
+            return len(docs)
+
+        return self._write(write) if ids else 0
+
+    def delete(self, ids):
+        """
+        删除片段
+        """
+        def write(conn):
+            removed = 0
+            total_length = 0
+            for doc_id in ids:
+                row = conn.execute("SELECT length FROM docs WHERE id = ?", (doc_id,)).fetchone()
+                if row is None:
+                    continue
+                terms = [term for (term,) in conn.execute("SELECT term FROM postings WHERE doc_id = ?", (doc_id,))]
+                conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", ((term,) for term in terms))
+                conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+                conn.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+                removed += 1
+                total_length += row[0]
+            conn.execute("DELETE FROM terms WHERE df <= 0")
+            self._update_stats(conn, -removed, -total_length)
+            return removed
+
+        return self._write(write) if ids else 0
+
+    def _update_stats(self, conn, doc_count, total_length):
+        conn.execute("UPDATE stats SET value = value + ? WHERE key = 'doc_count'", (doc_count,))
+        conn.execute("UPDATE stats SET value = value + ? WHERE key = 'total_length'", (total_length,))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT value FROM stats WHERE key = 'doc_count'").fetchone()[0]
+
+    def search(self, query, k=10, max_df_ratio=0.5):
+        """
+        BM25 检索, 返回按分数从高到低排列的 (片段 id, 分数)
+        max_df_ratio: 出现在超过该比例片段中的词几乎没有区分度, 跳过以免扫描过长的倒排表
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            stats = dict(self._conn.execute("SELECT key, value FROM stats"))
+            n_docs = stats["doc_count"]
+            if n_docs == 0:
+                return []
+            avg_length = stats["total_length"] / n_docs
+            placeholders = ",".join("?" * len(terms))
+            dfs = dict(self._conn.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", list(terms)))
+
+            scores = Counter()
+            for term, df in dfs.items():
+                if df > n_docs * max_df_ratio and len(dfs) > 1:
+                    continue
+                idf = math.log((n_docs - df + 0.5) / (df + 0.5) + 1.0)
+                rows = self._conn.execute("SELECT doc_id, tf, doc_length FROM postings WHERE term = ?", (term,))
+                for doc_id, tf, length in rows:
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+        return scores.most_common(k)
+
+    def get_documents(self, ids):
+        """
+        按 id 取回片段, 返回与 ids 顺序一致的 Document 列表(不存在的 id 跳过)
+        """
+        if not ids:
+            return []
+        with self._lock:
+            placeholders = ",".join("?" * len(ids))
+            rows = self._conn.execute(
+                f"SELECT id, content, metadata FROM docs WHERE id IN ({placeholders})", list(ids)
+            ).fetchall()
+        found = {doc_id: Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+                 for doc_id, content, metadata in rows}
+        return [found[doc_id] for doc_id in ids if doc_id in found]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+
+_shared = None #进程内共享的词法索引
+_shared_lock = threading.Lock()
+
+def get_lexical_index():
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LexicalIndex(config.lexical_index_path)
+    return _shared
+
+
+if __name__ == "__main__":
+    #从向量库中已有的片段重建词法索引, 用于启用混合检索前已经入库的数据
+    from knowledge_base import KnowledgeBaseService
+
+    print(KnowledgeBaseService().rebuild_lexical_index())
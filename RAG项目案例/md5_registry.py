@@ -0,0 +1,120 @@
+"""
+上传去重登记表: 内存哈希集合 + SQLite 持久化
+"""
+import os
+import sqlite3
+import threading
+
+
+class Md5Registry(object):
+    def __init__(self, db_path, legacy_path=None):
+        """
+        db_path: SQLite 数据库文件路径
+        legacy_path: 旧版 md5.txt 的路径, 登记表为空时一次性导入
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+
+        #isolation_level=None: 自动提交, 事务由我们自己显式控制
+        #timeout: 其他进程持有写锁时最多等待的秒数
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL") #WAL 模式下读写互不阻塞, 适合多进程
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS md5 ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "hash TEXT NOT NULL UNIQUE)"
+        )
+
+        if legacy_path:
+            self._import_legacy(legacy_path)
+
+        self._hashes = set() #内存中的哈希集合, 查询为 O(1)
+        self._last_seq = 0 #已加载到内存的最大序号
+        self._data_version = None #SQLite 的 data_version, 其他连接提交后会变化
+        self._refresh()
+
+    def _import_legacy(self, legacy_path):
+        """
+        将旧版 md5.txt 中的记录导入数据库, 只在登记表为空时执行
+        """
+        if not os.path.exists(legacy_path):
+            return
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM md5 LIMIT 1").fetchone():
+                return
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                rows = [(line.strip(),) for line in f if line.strip()]
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT OR IGNORE INTO md5 (hash) VALUES (?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _refresh(self):
+        """
+        如果数据库被其他进程修改过, 只把新增的记录追加到内存集合中
+        """
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        rows = self._conn.execute(
+            "SELECT seq, hash FROM md5 WHERE seq > ? ORDER BY seq", (self._last_seq,)
+        ).fetchall()
+        for seq, md5_str in rows:
+            self._hashes.add(md5_str)
+            self._last_seq = seq
+        self._data_version = data_version
+
+    def contains(self, md5_str):
+        """
+        判断 md5 是否已经登记过
+        """
+        with self._lock:
+            if md5_str in self._hashes:
+                return True
+            #内存中没有, 可能是其他进程刚写入的, 先同步增量再判断
+            self._refresh()
+            return md5_str in self._hashes
+
+    def add(self, md5_str):
+        """
+        登记一个 md5, 返回 True 表示本次新写入, False 表示已经存在
+        """
+        with self._lock:
+            cursor = self._conn.execute("INSERT OR IGNORE INTO md5 (hash) VALUES (?)", (md5_str,))
+            self._hashes.add(md5_str)
+            return cursor.rowcount == 1
+
+    def add_many(self, md5_list):
+        """
+        批量登记, 在一个事务中完成
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO md5 (hash) VALUES (?)", ((m,) for m in md5_list)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._hashes.update(md5_list)
+
+    def __contains__(self, md5_str):
+        return self.contains(md5_str)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._hashes)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,384 @@
+"""
+元数据倒排索引, 供 MmapVectorStore 做过滤检索: 先按元数据缩小候选行, 再只在这些行上计算相似度
+
+索引的字段:
+    离散字段(config.metadata_index_fields, 如 source、operator): 取值 -> 行号数组
+    时间字段(config.metadata_time_fields, 如 create_time): 按时间排序的 (时间, 行号), 范围查询用二分查找
+其他字段的条件在索引缩小后的候选行上逐行比较
+
+过滤条件使用与 Chroma 相同的写法:
+    {"source": "何勇"}
+    {"source": {"$in": ["a.txt", "b.txt"]}}
+    {"create_time": {"$gte": "2024-01-01", "$lt": "2024-02-01 00:00:00"}}
+    {"$and": [...]} / {"$or": [...]}
+
+行号数组和时间列都是按两倍扩容的缓冲区, 每批新行只追加到末尾, 写入代价与已有行数无关;
+时间乱序写入时只标记未排序, 下次范围查询时再整体排序一次
+
+文件(与向量库在同一目录):
+    meta.json           已索引的行数
+    meta_values.jsonl   离散字段的取值表, 每行 [字段, 取值], 新取值只在末尾追加; 编号是该字段取值出现的顺序
+    meta_<字段>.i4       离散字段每行的取值编号, -1 表示没有该字段
+    meta_<字段>.i8       时间字段每行的秒数
+"""
+import json
+import os
+
+import numpy as np
+
+import config_data as config
+
+MISSING_TIME = np.iinfo(np.int64).min #没有时间字段(或无法解析)的行
+_RANGE_OPERATORS = ("$gt", "$gte", "$lt", "$lte")
+
+
+def parse_time(value):
+    """
+    "2024-01-01 12:00:00" / "2024-01-01" / 秒数 -> 秒数
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(np.datetime64(str(value).strip().replace(" ", "T"), "s").astype(np.int64))
+    except ValueError:
+        return MISSING_TIME
+
+
+def match_condition(value, condition):
+    """
+    单个字段的条件: 值本身(等于)或 {"$eq"/"$ne"/"$in"/"$nin"/"$gt"/"$gte"/"$lt"/"$lte": ...}
+    """
+    if not isinstance(condition, dict):
+        return value == condition
+    for operator, operand in condition.items():
+        if value is None and operator not in ("$ne", "$nin"):
+            return False
+        if operator == "$eq" and not value == operand:
+            return False
+        if operator == "$ne" and not value != operand:
+            return False
+        if operator == "$in" and value not in operand:
+            return False
+        if operator == "$nin" and value in operand:
+            return False
+        if operator == "$gt" and not value > operand:
+            return False
+        if operator == "$gte" and not value >= operand:
+            return False
+        if operator == "$lt" and not value < operand:
+            return False
+        if operator == "$lte" and not value <= operand:
+            return False
+    return True
+
+
+def match_where(metadata, where):
+    """
+    完整的过滤条件(含 $and / $or)是否匹配一条元数据
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(match_where(metadata, item) for item in condition):
+                return False
+        elif key == "$or":
+            if not any(match_where(metadata, item) for item in condition):
+                return False
+        elif not match_condition(metadata.get(key), condition):
+            return False
+    return True
+
+
+class GrowableArray(object):
+    """
+    按两倍扩容的一维数组, 追加的均摊代价与已有长度无关
+    """
+
+    def __init__(self, dtype, capacity=16):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            data = np.empty(max(end, len(self.data) * 2), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:end] = values
+        self.size = end
+
+    def view(self):
+        return self.data[:self.size]
+
+    def replace(self, values):
+        self.data = np.array(values, dtype=self.data.dtype)
+        self.size = len(values)
+
+    def __len__(self):
+        return self.size
+
+
+class MetadataIndex(object):
+    def __init__(self, directory, fields=None, time_fields=None):
+        """
+        directory: 向量库的数据目录
+        fields: 建立倒排表的离散字段, 默认 config.metadata_index_fields
+        time_fields: 支持范围查询的时间字段, 默认 config.metadata_time_fields
+        """
+        self.directory = directory
+        self.fields = list(fields or config.metadata_index_fields)
+        self.time_fields = list(time_fields or config.metadata_time_fields)
+        self.count = 0 #已加入内存索引的行数
+        self.values = {field: [] for field in self.fields} #编号 -> 取值
+        self.codes = {field: {} for field in self.fields} #取值 -> 编号
+        self.postings = {field: [] for field in self.fields} #编号 -> 行号(GrowableArray, 升序)
+        self.times = {field: GrowableArray(np.int64) for field in self.time_fields} #时间, time_sorted 为 True 时升序
+        self.time_rows = {field: GrowableArray(np.int64) for field in self.time_fields} #与 times 对应的行号
+        self.time_sorted = {field: True for field in self.time_fields}
+        self._values_offset = 0 #meta_values.jsonl 已读取到的位置
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_header(self):
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"count": 0}
+
+    def _write_header(self, count):
+        #只有行数, 大小固定
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"count": count}, f)
+        os.replace(tmp_path, self._path("meta.json"))
+
+    def _append_values(self, items):
+        """
+        追加新出现的取值 [(字段, 取值), ...], 之后的读取从文件末尾开始
+        """
+        with open(self._path("meta_values.jsonl"), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items))
+            self._values_offset = f.tell()
+
+    def _load_values(self, header):
+        """
+        读取其他进程追加的取值; 只处理完整的行, 正在写入的半行留到下次
+        旧版把取值表整体保存在 meta.json 中, 写进程下次写入时转存到 meta_values.jsonl
+        """
+        if "values" in header and not os.path.exists(self._path("meta_values.jsonl")):
+            items = [(field, value) for field, values in header["values"].items() for value in values]
+        else:
+            try:
+                f = open(self._path("meta_values.jsonl"), "rb")
+            except FileNotFoundError:
+                return
+            with f:
+                f.seek(self._values_offset)
+                data = f.read()
+            end = data.rfind(b"\n") + 1
+            self._values_offset += end
+            items = map(json.loads, data[:end].splitlines())
+        for field, value in items:
+            if field in self.codes and value not in self.codes[field]:
+                self.codes[field][value] = len(self.values[field])
+                self.values[field].append(value)
+
+    def _write_column(self, name, dtype, start, column):
+        """
+        把一列数据写到文件的 [start, start + len(column)) 位置, 文件不够长时按两倍扩展
+        """
+        path = self._path(name)
+        itemsize = np.dtype(dtype).itemsize
+        needed = (start + len(column)) * itemsize
+        with open(path, "ab") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < needed:
+                f.truncate(max(needed, size * 2))
+        with open(path, "r+b") as f:
+            f.seek(start * itemsize)
+            f.write(np.ascontiguousarray(column, dtype=dtype).tobytes())
+
+    def _read_column(self, name, dtype, start, end):
+        return np.array(np.memmap(self._path(name), dtype=dtype, mode="r", shape=(end,))[start:end])
+
+    def persisted_count(self):
+        """
+        已经写入文件的行数
+        """
+        return self._read_header()["count"]
+
+    def sync(self, count):
+        """
+        从文件加载前 count 行中还没有加入内存的部分(由其他进程写入的行)
+        返回已加载到的行数, 小于 count 时说明文件中的索引落后于向量库, 需要补建
+        """
+        header = self._read_header()
+        end = min(count, header["count"])
+        if end <= self.count:
+            return self.count
+        self._load_values(header)
+        for field in self.fields:
+            self._extend_postings(field, self.count, self._read_column(f"meta_{field}.i4", np.int32, self.count, end))
+        for field in self.time_fields:
+            self._extend_times(field, self.count, self._read_column(f"meta_{field}.i8", np.int64, self.count, end))
+        self.count = end
+        return end
+
+    def _extend_postings(self, field, start, codes):
+        postings = self.postings[field]
+        while len(postings) < len(self.values[field]):
+            postings.append(GrowableArray(np.int64))
+        rows = np.arange(start, start + len(codes))
+        order = np.argsort(codes, kind="stable")
+        present, starts = np.unique(codes[order], return_index=True)
+        for code, chunk in zip(present, np.split(rows[order], starts[1:])):
+            if code >= 0:
+                postings[code].extend(chunk) #新行的行号都大于已有的行, 追加后仍然升序
+
+    def _extend_times(self, field, start, times):
+        rows = np.arange(start, start + len(times))
+        order = np.argsort(times, kind="stable")
+        times, rows = times[order], rows[order]
+        current = self.times[field]
+        if len(times) and len(current) and times[0] < current.data[current.size - 1]:
+            self.time_sorted[field] = False #早于已有的时间, 查询时再排序
+        current.extend(times)
+        self.time_rows[field].extend(rows)
+
+    def _sorted_times(self, field):
+        """
+        升序的 (时间, 行号); 有乱序写入时整体排序一次
+        """
+        times, rows = self.times[field], self.time_rows[field]
+        if not self.time_sorted[field]:
+            order = np.argsort(times.view(), kind="stable")
+            times.replace(times.view()[order])
+            rows.replace(rows.view()[order])
+            self.time_sorted[field] = True
+        return times.view(), rows.view()
+
+    def add(self, start, metadatas, persist=True):
+        """
+        加入从 start 开始的新行
+        persist: 为 False 时只更新内存(只读打开的向量库补建索引时使用)
+        """
+        new_values = [] #本批新出现的取值
+        for field in self.fields:
+            codes = np.empty(len(metadatas), dtype=np.int32)
+            for i, metadata in enumerate(metadatas):
+                value = metadata.get(field)
+                if value is None:
+                    codes[i] = -1
+                    continue
+                code = self.codes[field].get(value)
+                if code is None:
+                    code = self.codes[field][value] = len(self.values[field])
+                    self.values[field].append(value)
+                    new_values.append((field, value))
+                codes[i] = code
+            self._extend_postings(field, start, codes)
+            if persist:
+                self._write_column(f"meta_{field}.i4", np.int32, start, codes)
+        for field in self.time_fields:
+            times = np.array([parse_time(metadata[field]) if field in metadata else MISSING_TIME for metadata in metadatas], dtype=np.int64)
+            self._extend_times(field, start, times)
+            if persist:
+                self._write_column(f"meta_{field}.i8", np.int64, start, times)
+        self.count = start + len(metadatas)
+        if persist:
+            #先写取值和各列, 最后更新行数, 其他进程读到新的行数时取值表一定是完整的
+            if not os.path.exists(self._path("meta_values.jsonl")):
+                new_values = [(field, value) for field in self.fields for value in self.values[field]] #第一次写入或旧版数据, 写出完整的取值表
+            self._append_values(new_values)
+            self._write_header(self.count)
+
+    def _field_rows(self, field, condition):
+        """
+        用索引计算单个字段条件匹配的行号(升序); 索引无法处理时返回 None
+        """
+        if field in self.fields:
+            if not isinstance(condition, dict):
+                values = [condition]
+            elif set(condition) == {"$eq"}:
+                values = [condition["$eq"]]
+            elif set(condition) == {"$in"}:
+                values = list(condition["$in"])
+            else:
+                return None
+            codes = [self.codes[field][value] for value in values if value in self.codes[field]]
+            if not codes:
+                return np.empty(0, dtype=np.int64)
+            return np.unique(np.concatenate([self.postings[field][code].view() for code in codes]))
+
+        if field in self.time_fields and isinstance(condition, dict) and condition and set(condition) <= set(_RANGE_OPERATORS):
+            times, time_rows = self._sorted_times(field)
+            low = np.searchsorted(times, MISSING_TIME, side="right") #跳过没有时间的行
+            high = len(times)
+            for operator, operand in condition.items():
+                value = parse_time(operand)
+                if value == MISSING_TIME:
+                    return None
+                if operator == "$gt":
+                    low = max(low, np.searchsorted(times, value, side="right"))
+                elif operator == "$gte":
+                    low = max(low, np.searchsorted(times, value, side="left"))
+                elif operator == "$lt":
+                    high = min(high, np.searchsorted(times, value, side="left"))
+                else:
+                    high = min(high, np.searchsorted(times, value, side="right"))
+            return np.sort(time_rows[low:high]) if low < high else np.empty(0, dtype=np.int64)
+        return None
+
+    def _plan(self, where):
+        """
+        把过滤条件拆成索引能计算的部分和需要逐行比较的部分
+        返回 (行号, 剩余条件): 行号是索引算出的候选行(升序, None 表示索引无法缩小范围),
+        剩余条件只需要在这些候选行上逐行比较, None 表示不需要比较
+        """
+        indexed = []
+        remaining = []
+        for key, condition in where.items():
+            if key == "$and":
+                for rows, rest in map(self._plan, condition):
+                    if rows is not None:
+                        indexed.append(rows)
+                    if rest is not None:
+                        remaining.append(rest)
+            elif key == "$or":
+                plans = [self._plan(item) for item in condition]
+                if any(rows is None for rows, _ in plans):
+                    remaining.append({key: condition}) #有一项无法用索引缩小范围, 整个 $or 逐行比较
+                    continue
+                indexed.append(np.unique(np.concatenate([rows for rows, _ in plans])) if plans else np.empty(0, dtype=np.int64))
+                if any(rest is not None for _, rest in plans):
+                    remaining.append({key: condition}) #候选行是各项候选的并集, 还需要逐行确认
+            else:
+                rows = self._field_rows(key, condition)
+                if rows is None:
+                    remaining.append({key: condition})
+                else:
+                    indexed.append(rows)
+
+        rows = None
+        for part in sorted(indexed, key=len): #从最小的集合开始求交集
+            rows = part if rows is None else np.intersect1d(rows, part, assume_unique=True)
+        if not remaining:
+            return rows, None
+        return rows, remaining[0] if len(remaining) == 1 else {"$and": remaining}
+
+    def select(self, where, scan, universe):
+        """
+        计算过滤条件匹配的行号(升序)
+        先对所有能用索引计算的条件求交集, 索引无法处理的条件只在交集上逐行比较
+        scan(rows, where): 在给定行上逐行比较元数据
+        universe(): 全部有效行, 条件都无法用索引处理时从这里逐行比较
+        """
+        rows, remaining = self._plan(where)
+        if remaining is not None:
+            return scan(universe() if rows is None else rows, remaining)
+        return rows if rows is not None else universe()
+
+    def nbytes(self):
+        total = sum(rows.data.nbytes for field in self.fields for rows in self.postings[field])
+        return total + sum(self.times[field].data.nbytes + self.time_rows[field].data.nbytes for field in self.time_fields)
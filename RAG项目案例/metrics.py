@@ -0,0 +1,258 @@
+"""
+问答链路的分阶段耗时统计
+
+每个阶段保留最近 config.metrics_window 个样本, 计算 p50 / p95 / p99,
+后台线程每隔 config.metrics_dump_interval 秒写出一次 JSON 和 Prometheus 文本格式的文件, 也可以在 app_qa 的调试面板中查看
+记录样本只在内存中追加, 写文件失败(磁盘已满、目录只读)只打印错误, 不影响问答请求
+
+阶段:
+    history_load          读取会话历史
+    question_embedding    问题向量化(含缓存)
+    vector_search         向量检索(含 Chroma 内部的向量化)
+    retrieval             检索总耗时(含检索缓存、词法检索、融合)
+    context_format        参考资料整理(format_document)
+    prompt_format         提示词模板填充
+    model_ttft            模型首个 token 的延迟
+    model_tokens_per_sec  模型输出速度(token/秒)
+    total                 一次问答的总耗时
+"""
+import atexit
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import config_data as config
+
+_QUANTILES = (0.5, 0.95, 0.99)
+_CHAIN_STAGES = {
+    "load_history": "history_load", #RunnableWithMessageHistory 读取会话历史的步骤
+    "format_document": "context_format",
+    "ChatPromptTemplate": "prompt_format",
+}
+
+
+def percentile(sorted_values, q):
+    #最近秩法, 样本很少时也有定义
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Metrics(object):
+    def __init__(self, window=None, json_path=None, prometheus_path=None, dump_interval=None):
+        """
+        window: 每个阶段保留的样本数量
+        json_path / prometheus_path: 定期写出的文件路径, 为空时不写
+        dump_interval: 写出文件的最小间隔(秒)
+        """
+        self.window = window or config.metrics_window
+        self.json_path = config.metrics_json_path if json_path is None else json_path
+        self.prometheus_path = config.metrics_prometheus_path if prometheus_path is None else prometheus_path
+        self.dump_interval = config.metrics_dump_interval if dump_interval is None else dump_interval
+        self._lock = threading.Lock()
+        self._samples = {} #阶段 -> 最近的样本
+        self._counts = {} #阶段 -> 累计样本数
+        self._dumper = None
+        self._stopped = threading.Event()
+
+    def record(self, stage, value):
+        """
+        记录一个样本(耗时以秒为单位, 速度类阶段为对应的数值)
+        """
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+                self._counts[stage] = 0
+            samples.append(value)
+            self._counts[stage] += 1
+            if self._dumper is None and (self.json_path or self.prometheus_path):
+                self._start_dumper()
+
+    def _start_dumper(self):
+        #已持有 self._lock; 第一个样本到来时启动
+        self._dumper = threading.Thread(target=self._dump_loop, name="metrics-dumper", daemon=True)
+        self._dumper.start()
+        atexit.register(self.close)
+
+    def _dump_loop(self):
+        while not self._stopped.wait(max(self.dump_interval, 0.1)):
+            self._safe_dump()
+
+    def _safe_dump(self):
+        try:
+            self.dump()
+        except OSError as error:
+            print(f"耗时统计写出失败, 下次重试: {error}")
+
+    def close(self):
+        """
+        停止后台线程并写出最后一次统计
+        """
+        self._stopped.set()
+        self._safe_dump()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        """
+        {阶段: {"count", "mean", "p50", "p95", "p99"}}
+        """
+        with self._lock:
+            items = [(stage, sorted(samples), self._counts[stage]) for stage, samples in self._samples.items()]
+        result = {}
+        for stage, values, count in items:
+            result[stage] = {"count": count, "mean": sum(values) / len(values)}
+            for q in _QUANTILES:
+                result[stage][f"p{int(q * 100)}"] = percentile(values, q)
+        return result
+
+    def to_prometheus(self, snapshot=None):
+        """
+        Prometheus 文本格式(summary)
+        """
+        snapshot = snapshot or self.snapshot()
+        lines = ["# TYPE rag_stage summary"]
+        for stage, stats in snapshot.items():
+            for q in _QUANTILES:
+                lines.append(f'rag_stage{{stage="{stage}",quantile="{q}"}} {stats[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'rag_stage_count{{stage="{stage}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        """
+        写出 JSON 和 Prometheus 文件(先写临时文件再替换, 读取方不会读到一半的内容)
+        """
+        snapshot = self.snapshot()
+        for path, content in (
+            (self.json_path, lambda: json.dumps(snapshot, ensure_ascii=False, indent=2)),
+            (self.prometheus_path, lambda: self.to_prometheus(snapshot)),
+        ):
+            if not path:
+                continue
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content())
+            os.replace(tmp_path, path)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    通过 LangChain 回调记录检索、提示词和模型阶段的耗时
+    """
+
+    run_inline = True #异步链路中也在事件循环里直接执行, 不放到线程池
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._starts = {} #run_id -> (阶段, 开始时间)
+        self._model_runs = {} #run_id -> [开始时间, 首个 token 时间, token 数]
+
+    def _start(self, run_id: UUID, stage):
+        self._starts[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id: UUID):
+        item = self._starts.pop(run_id, None)
+        if item is not None:
+            self.metrics.record(item[0], time.perf_counter() - item[1])
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        if kwargs.get("name") == "CachedRetriever":
+            self._start(run_id, "retrieval")
+        elif kwargs.get("name") == "VectorStoreRetriever":
+            self._start(run_id, "vector_search")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        stage = _CHAIN_STAGES.get(kwargs.get("name"))
+        if stage:
+            self._start(run_id, stage)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._model_runs[run_id] = [time.perf_counter(), None, 0]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._model_runs.get(run_id)
+        if run is None:
+            return
+        if run[1] is None:
+            run[1] = time.perf_counter()
+            self.metrics.record("model_ttft", run[1] - run[0])
+        run[2] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._model_runs.pop(run_id, None)
+        if run is None or run[1] is None:
+            return
+        #流式输出时每个分片计为一个 token; 模型返回了用量时以用量为准
+        tokens = run[2]
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage and usage.get("output_tokens"):
+                    tokens = usage["output_tokens"]
+        elapsed = time.perf_counter() - run[1]
+        if elapsed > 0 and tokens > 1:
+            self.metrics.record("model_tokens_per_sec", (tokens - 1) / elapsed)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._model_runs.pop(run_id, None)
+
+
+def trace_prompt(prompt):
+    """
+    按 config.prompt_trace_sample_rate 的比例抽样打印完整提示词, 默认关闭
+    """
+    if config.prompt_trace_sample_rate > 0 and random.random() < config.prompt_trace_sample_rate:
+        print("=" * 30)
+        print(prompt.to_string())
+        print("=" * 30)
+    return prompt
+
+
+
+_metrics = None #进程内共享的统计对象
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+    return _metrics
+
+
+if __name__ == "__main__":
+    #打印问答进程最近一次写出的统计
+    with open(config.metrics_json_path, "r", encoding="utf-8") as f:
+        for stage, stats in json.load(f).items():
+            scale, unit = (1, "token/秒") if stage == "model_tokens_per_sec" else (1000, "ms")
+            print(
+                f"{stage:<22} n={stats['count']:<6} p50 {stats['p50'] * scale:9.1f}  "
+                f"p95 {stats['p95'] * scale:9.1f}  p99 {stats['p99'] * scale:9.1f}  ({unit})"
+            )
@@ -0,0 +1,629 @@
+"""
+基于 NumPy 内存映射的向量库, 可以替代 Chroma 作为知识库的存储后端(config.vector_backend = "mmap")
+
+目录结构:
+    header.json     维度、行数、容量, 最后写入, 读进程据此判断是否有新数据
+    vectors.f32     归一化后的 float32 向量矩阵 (容量 x 维度), 内存映射
+    vectors.f16     量化为 float16 的向量 (vector_quantization = "float16")
+    vectors.i8      按维度缩放量化为 int8 的向量 (vector_quantization = "int8")
+    scales.f32      int8 量化的每维缩放系数
+    alive.u1        每行是否有效(删除只打标记)
+    ids.bin         定长的片段 id (容量 x id_width 字节)
+    offsets.i8      每行文档在 docs.jsonl 中的起止偏移
+    docs.jsonl      每行一个 {"c": 内容, "m": 元数据}
+    ivf_*           IVF 近似最近邻索引, 见 ivf_index.py
+    meta*           元数据倒排索引, 见 metadata_index.py
+
+检索: 查询向量与向量矩阵分块做矩阵乘法, 用 argpartition 取 top-k, 只读取 top-k 行的内容和元数据
+启用量化时只扫描量化后的矩阵(float16 为一半、int8 为四分之一的内存), 取 top_k * rescore_factor 个候选,
+再从 float32 矩阵中读取这些行重新打分, 排序结果基本不受量化误差影响
+启用 IVF 索引(config.ann_index = "ivf")且行数达到 config.ivf_min_rows 后, 在后台线程中训练索引, 训练完成后只扫描与查询最近的 nprobe 个聚类
+带过滤条件的检索先用元数据索引得到匹配的行, 只在这些行上计算相似度
+只支持单个写进程, 读进程可以有多个; 只检索的进程(问答服务)以只读方式打开, 量化矩阵的重建只由写进程执行
+"""
+import copy
+import json
+import os
+import threading
+import traceback
+import uuid
+from typing import Any, Iterable, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.vectorstores import VectorStore
+
+import config_data as config
+from ivf_index import IvfIndex, assign_lists
+from metadata_index import MetadataIndex, match_where
+
+ID_WIDTH = 64 #每个 id 最多占用的字节数
+BLOCK_ROWS = 65536 #检索时每次参与矩阵乘法的行数, 控制临时内存
+COMPACT_BLOCK_ROWS = 4096 #量化矩阵每块要先转换为 float32, 块小一些转换结果能留在 CPU 缓存中
+COMPACT_FILES = {"float16": ("vectors.f16", np.float16), "int8": ("vectors.i8", np.int8)}
+
+
+def normalize(vectors):
+    """
+    按行归一化为单位向量, 之后内积就是余弦相似度
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class MmapVectorStore(VectorStore):
+    def __init__(self, embedding_function: Embeddings, persist_directory=None, mode="r+", quantization=None, rescore_factor=None, ann_index=None):
+        """
+        embedding_function: 嵌入模型
+        persist_directory: 数据目录
+        mode: "r+" 可读写, "r" 只读
+        quantization: "none", "float16" 或 "int8", 默认 config.vector_quantization;
+            与已有数据不同时, 可写模式下从 float32 矩阵重新生成量化矩阵, 只读模式下沿用已有数据的设置
+        rescore_factor: 量化检索时候选数量相对 k 的倍数, 默认 config.rescore_factor
+        ann_index: "none" 精确检索 或 "ivf" 近似检索, 默认 config.ann_index
+        """
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory or config.mmap_store_directory
+        self.mode = mode
+        self.quantization = quantization or config.vector_quantization
+        if self.quantization != "none" and self.quantization not in COMPACT_FILES:
+            raise ValueError(f"不支持的量化方式: {self.quantization}")
+        self.rescore_factor = rescore_factor or config.rescore_factor
+        ann_index = ann_index or config.ann_index
+        self.ann = IvfIndex(self.persist_directory) if ann_index == "ivf" else None
+        self.meta_index = MetadataIndex(self.persist_directory)
+        self._lock = threading.RLock()
+        self._train_lock = threading.Lock()
+        self._ann_thread = None #后台训练 IVF 索引的线程
+        os.makedirs(self.persist_directory, exist_ok=True)
+
+        self.dim = 0
+        self.count = 0 #已使用的行数(包括已删除的行)
+        self.capacity = 0
+        self._header_mtime = None
+        self._id_to_row = None #id -> 行号, 第一次写入或按 id 查询时才构建
+        self._open()
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding_function
+
+    #------------------------------ 文件读写 ------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.persist_directory, name)
+
+    def _read_header(self):
+        try:
+            with open(self._path("header.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"dim": 0, "count": 0, "capacity": 0, "quantization": self.quantization}
+
+    def _write_header(self):
+        tmp_path = self._path("header.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "count": self.count, "capacity": self.capacity, "quantization": self.quantization}, f)
+        os.replace(tmp_path, self._path("header.json")) #原子替换, 读进程不会读到一半的头
+
+    def _map(self, name, dtype, shape):
+        mode = self.mode if self.mode == "r" else "r+"
+        return np.memmap(self._path(name), dtype=dtype, mode=mode, shape=shape)
+
+    def _open(self):
+        """
+        按 header.json 打开(或重新打开)所有内存映射文件
+        """
+        header = self._read_header()
+        self.dim, self.count, self.capacity = header["dim"], header["count"], header["capacity"]
+        stored_quantization = header.get("quantization", "none")
+        try:
+            self._header_mtime = os.stat(self._path("header.json")).st_mtime_ns
+        except FileNotFoundError:
+            self._header_mtime = None
+        if self.capacity == 0:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self.alive = np.zeros(0, dtype=np.uint8)
+            self.ids = np.zeros(0, dtype=f"S{ID_WIDTH}")
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.compact = None
+            self.scales = None
+        else:
+            self.vectors = self._map("vectors.f32", np.float32, (self.capacity, self.dim))
+            self.alive = self._map("alive.u1", np.uint8, (self.capacity,))
+            self.ids = self._map("ids.bin", f"S{ID_WIDTH}", (self.capacity,))
+            self.offsets = self._map("offsets.i8", np.int64, (self.capacity + 1,))
+            if stored_quantization == self.quantization:
+                self._map_compact()
+            elif self.mode == "r":
+                self.quantization = stored_quantization
+                self._map_compact()
+            else:
+                self._rebuild_compact()
+        self._docs = None #docs.jsonl 的只读映射, 读取时再打开
+        self._id_to_row = None
+        if self.ann is not None:
+            self.ann.sync(self.count)
+        loaded = self.meta_index.sync(self.count)
+        if loaded < self.count:
+            #元数据索引落后于向量库(例如没有索引时写入的旧数据), 从 docs.jsonl 补建
+            metadatas = [metadata for _, _, metadata in self._load_rows(range(loaded, self.count))]
+            self.meta_index.add(loaded, metadatas, persist=self.mode != "r")
+
+    def _map_compact(self):
+        """
+        打开量化矩阵和缩放系数
+        """
+        self.compact = None
+        self.scales = None
+        if self.quantization == "none":
+            return
+        name, dtype = COMPACT_FILES[self.quantization]
+        self.compact = self._map(name, dtype, (self.capacity, self.dim))
+        if self.quantization == "int8":
+            self.scales = np.fromfile(self._path("scales.f32"), dtype=np.float32)
+
+    def _quantize(self, vectors):
+        if self.quantization == "float16":
+            return vectors.astype(np.float16)
+        return np.clip(np.rint(vectors / self.scales), -127, 127).astype(np.int8)
+
+    def _requantize(self):
+        for start in range(0, self.count, BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, self.count)
+            self.compact[start:end] = self._quantize(self.vectors[start:end])
+
+    def _update_scales(self, vectors):
+        """
+        int8 的缩放系数 = 每维绝对值的最大值 / 127
+        新数据超出已有范围时放大对应维度的系数, 并用 float32 矩阵重新量化已有数据
+        """
+        needed = np.maximum(np.abs(vectors).max(axis=0) / 127, 1e-8).astype(np.float32)
+        if self.scales is not None and np.all(needed <= self.scales):
+            return
+        self.scales = needed if self.scales is None else np.maximum(self.scales, needed)
+        self.scales.tofile(self._path("scales.f32"))
+        self._requantize()
+
+    def _rebuild_compact(self):
+        """
+        量化方式改变时, 从 float32 矩阵重新生成量化矩阵
+        """
+        self.compact = None
+        self.scales = None
+        if self.quantization != "none":
+            name, dtype = COMPACT_FILES[self.quantization]
+            with open(self._path(name), "wb") as f:
+                f.truncate(self.capacity * self.dim * np.dtype(dtype).itemsize)
+            self.compact = self._map(name, dtype, (self.capacity, self.dim))
+            if self.quantization == "int8":
+                self.scales = np.full(self.dim, 1e-8, dtype=np.float32)
+                if self.count:
+                    self.scales = np.maximum(self.scales, np.abs(self.vectors[:self.count]).max(axis=0) / 127)
+                self.scales.tofile(self._path("scales.f32"))
+            self._requantize()
+            self.compact.flush()
+        self._write_header()
+
+    def refresh(self):
+        """
+        其他进程写入新数据后(header.json 变化), 重新打开映射
+        """
+        with self._lock:
+            try:
+                mtime = os.stat(self._path("header.json")).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._header_mtime:
+                self._open()
+
+    def _grow(self, needed):
+        """
+        容量不足时按两倍扩容, 扩展各个文件的长度后重新映射
+        """
+        if needed <= self.capacity:
+            return
+        capacity = max(needed, self.capacity * 2, 1024)
+        files = [
+            ("vectors.f32", self.dim * 4, 0),
+            ("alive.u1", 1, 0),
+            ("ids.bin", ID_WIDTH, 0),
+            ("offsets.i8", 8, 8),
+        ]
+        if self.quantization != "none":
+            name, dtype = COMPACT_FILES[self.quantization]
+            files.append((name, self.dim * np.dtype(dtype).itemsize, 0))
+        for name, row_bytes, extra in files:
+            with open(self._path(name), "ab") as f:
+                f.truncate(capacity * row_bytes + extra)
+        self.capacity = capacity
+        self.vectors = self._map("vectors.f32", np.float32, (capacity, self.dim))
+        self.alive = self._map("alive.u1", np.uint8, (capacity,))
+        self.ids = self._map("ids.bin", f"S{ID_WIDTH}", (capacity,))
+        self.offsets = self._map("offsets.i8", np.int64, (capacity + 1,))
+        if self.quantization != "none":
+            name, dtype = COMPACT_FILES[self.quantization]
+            self.compact = self._map(name, dtype, (capacity, self.dim))
+
+    def _docs_map(self):
+        if self._docs is None:
+            path = self._path("docs.jsonl")
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                return b""
+            self._docs = np.memmap(path, dtype=np.uint8, mode="r")
+        if len(self._docs) < self.offsets[self.count]:
+            self._docs = np.memmap(self._path("docs.jsonl"), dtype=np.uint8, mode="r") #文件变长后重新映射
+        return self._docs
+
+    def _row_map(self):
+        if self._id_to_row is None:
+            ids = self.ids[:self.count]
+            alive = self.alive[:self.count]
+            self._id_to_row = {ids[row].decode("ascii"): row for row in np.flatnonzero(alive)}
+        return self._id_to_row
+
+    #------------------------------ 写入 ------------------------------
+
+    def add_embeddings(self, ids, texts, embeddings, metadatas=None):
+        """
+        写入已经向量化的片段, id 已存在时覆盖(旧行标记为删除)
+        """
+        if self.mode == "r":
+            raise PermissionError("MmapVectorStore 以只读方式打开")
+        metadatas = metadatas or [{} for _ in ids]
+        vectors = normalize(embeddings)
+        encoded = [doc_id.encode("ascii") for doc_id in ids]
+        if any(len(doc_id) > ID_WIDTH for doc_id in encoded):
+            raise ValueError(f"id 长度不能超过 {ID_WIDTH} 个字节")
+
+        with self._lock:
+            self.refresh()
+            if self.dim == 0:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与已有数据的维度 {self.dim} 不一致")
+
+            row_map = self._row_map()
+            stale_rows = [row_map[doc_id] for doc_id in ids if doc_id in row_map]
+            if stale_rows:
+                self.alive[stale_rows] = 0
+
+            start, end = self.count, self.count + len(ids)
+            self._grow(end)
+
+            lines = [
+                (json.dumps({"c": text, "m": metadata}, ensure_ascii=False) + "\n").encode("utf-8")
+                for text, metadata in zip(texts, metadatas)
+            ]
+            with open(self._path("docs.jsonl"), "ab") as f:
+                f.write(b"".join(lines))
+            self.offsets[start + 1:end + 1] = self.offsets[start] + np.cumsum([len(line) for line in lines])
+            self.vectors[start:end] = vectors
+            self.ids[start:end] = encoded
+            self.alive[start:end] = 1
+            arrays = [self.vectors, self.alive, self.ids, self.offsets]
+            if self.compact is not None:
+                if self.quantization == "int8":
+                    self._update_scales(vectors)
+                self.compact[start:end] = self._quantize(vectors)
+                arrays.append(self.compact)
+            self._on_rows_added(start, end, metadatas)
+            for array in arrays:
+                array.flush()
+
+            self.count = end
+            self._write_header()
+            self._header_mtime = os.stat(self._path("header.json")).st_mtime_ns
+            for row, doc_id in enumerate(ids, start=start):
+                row_map[doc_id] = row
+            if self.ann is not None and not self.ann.trained and self.count >= config.ivf_min_rows:
+                self._build_ann_index_in_background() #行数达到阈值, 第一次训练 IVF 索引, 训练完成前使用精确检索
+        return list(ids)
+
+    def _on_rows_added(self, start, end, metadatas):
+        """
+        新行写入后、头文件更新前调用, 同步更新索引
+        """
+        if self.ann is not None:
+            self.ann.add(start, self.vectors[start:end])
+        self.meta_index.add(start, metadatas)
+
+    def build_ann_index(self, nlist=None):
+        """
+        在全部行上(重新)训练 IVF 索引, 数据分布变化较大后可以手动调用(python ivf_index.py)
+        nlist: 聚类数量, 默认 config.ivf_nlist
+
+        k-means 在锁外、在调用时已有的行上进行, 期间写入和检索照常进行(检索沿用旧索引或精确检索);
+        训练完成后在锁内分配训练期间新增的行, 再整体替换索引
+        """
+        if self.ann is None:
+            raise ValueError("没有启用近似最近邻索引(config.ann_index)")
+        if self.mode == "r":
+            raise PermissionError("MmapVectorStore 以只读方式打开")
+        with self._train_lock: #同一时间只训练一次
+            with self._lock:
+                self.refresh()
+                vectors, count = self.vectors, self.count #扩容时 self.vectors 会被替换, 前 count 行不会再改变
+            if count == 0:
+                return
+            centroids, labels = self.ann.fit(vectors, count, nlist)
+            with self._lock:
+                self.refresh()
+                if self.count > count:
+                    labels = np.concatenate([labels, assign_lists(self.vectors[count:self.count], centroids)])
+                self.ann.install(centroids, labels)
+                self._write_header() #通知读进程重新加载索引
+                self._header_mtime = os.stat(self._path("header.json")).st_mtime_ns
+
+    def _build_ann_index_in_background(self):
+        #已持有 self._lock; 同一个向量库只启动一个训练线程
+        if self._ann_thread is not None and self._ann_thread.is_alive():
+            return
+
+        def run():
+            try:
+                self.build_ann_index()
+            except Exception:
+                traceback.print_exc() #训练失败时继续使用精确检索, 下次写入时重试
+
+        self._ann_thread = threading.Thread(target=run, name="ivf-train", daemon=True)
+        self._ann_thread.start()
+
+    def wait_ann_index(self, timeout=None):
+        """
+        等待后台的 IVF 训练结束(批量入库脚本退出前调用), 返回索引是否已经训练
+        """
+        thread = self._ann_thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.ann is not None and self.ann.trained
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[list[dict]] = None, *, ids: Optional[list[str]] = None, **kwargs: Any) -> list[str]:
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        embeddings = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(ids, texts, embeddings, metadatas)
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            self.refresh()
+            row_map = self._row_map()
+            rows = [row_map.pop(doc_id) for doc_id in ids if doc_id in row_map]
+            if rows:
+                self.alive[rows] = 0
+                self.alive.flush()
+                self._write_header() #更新头文件的修改时间, 通知读进程
+                self._header_mtime = os.stat(self._path("header.json")).st_mtime_ns
+        return True
+
+    #------------------------------ 读取 ------------------------------
+
+    def _load_rows(self, rows):
+        """
+        读取若干行的 (id, 内容, 元数据)
+        """
+        docs = self._docs_map()
+        results = []
+        for row in rows:
+            raw = bytes(docs[self.offsets[row]:self.offsets[row + 1]])
+            item = json.loads(raw.decode("utf-8"))
+            results.append((self.ids[row].decode("ascii"), item["c"], item["m"]))
+        return results
+
+    def _documents(self, rows):
+        return [Document(id=doc_id, page_content=text, metadata=metadata) for doc_id, text, metadata in self._load_rows(rows)]
+
+    def _match_rows(self, rows, where):
+        """
+        逐行读取元数据, 保留匹配过滤条件的行
+        """
+        if not where:
+            return rows
+        matched = []
+        for row, (_, _, metadata) in zip(rows, self._load_rows(rows)):
+            if match_where(metadata, where):
+                matched.append(row)
+        return np.asarray(matched, dtype=np.int64)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        """
+        与 Chroma.get 相同的返回格式: {"ids": [...], "documents": [...], "metadatas": [...]}
+        """
+        with self._lock:
+            self.refresh()
+            if ids is not None:
+                row_map = self._row_map()
+                rows = np.asarray([row_map[doc_id] for doc_id in ids if doc_id in row_map], dtype=np.int64)
+                rows = self._match_rows(rows, where)
+            elif where:
+                rows = self._candidate_rows(where)
+            else:
+                rows = np.flatnonzero(self.alive[:self.count])
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+            result = {"ids": [self.ids[row].decode("ascii") for row in rows]}
+            if include and ("documents" in include or "metadatas" in include):
+                loaded = self._load_rows(rows)
+                if "documents" in include:
+                    result["documents"] = [text for _, text, _ in loaded]
+                if "metadatas" in include:
+                    result["metadatas"] = [metadata for _, _, metadata in loaded]
+            return result
+
+    def get_by_ids(self, ids, /) -> list[Document]:
+        with self._lock:
+            self.refresh()
+            row_map = self._row_map()
+            return self._documents([row_map[doc_id] for doc_id in ids if doc_id in row_map])
+
+    #------------------------------ 检索 ------------------------------
+
+    def _candidate_rows(self, filter):
+        """
+        参与检索的行: None 表示全部有效行, 否则为行号数组
+        """
+        if not filter:
+            return None
+        rows = self.meta_index.select(filter, self._match_rows, lambda: np.flatnonzero(self.alive[:self.count]))
+        rows = rows[rows < self.count]
+        return rows[self.alive[rows] == 1]
+
+    def _scan_queries(self, queries):
+        """
+        扫描量化矩阵前对查询做的变换: int8 时把缩放系数乘到查询上, 与 int8 矩阵的内积即为近似分数
+        """
+        if self.quantization == "int8":
+            return queries * self.scales
+        return queries
+
+    def _block_scores(self, queries, index):
+        """
+        queries 与矩阵中 index(切片或行号数组)对应行的分数, 量化时为近似分数
+        """
+        if self.compact is None:
+            return queries @ self.vectors[index].T
+        return queries @ self.compact[index].astype(np.float32).T
+
+    def _top_k(self, queries, k, rows=None):
+        """
+        批量检索: queries 为 (查询数 x 维度) 的矩阵(已经过 _scan_queries), 返回每个查询的 (行号数组, 分数数组)
+        rows: 只在这些行中检索
+        """
+        n_queries = queries.shape[0]
+        best_rows = np.empty((n_queries, 0), dtype=np.int64)
+        best_scores = np.empty((n_queries, 0), dtype=np.float32)
+        total = self.count if rows is None else len(rows)
+        block_size = BLOCK_ROWS if self.compact is None else COMPACT_BLOCK_ROWS
+
+        for start in range(0, total, block_size):
+            end = min(start + block_size, total)
+            if rows is None:
+                block_rows = np.arange(start, end)
+                scores = self._block_scores(queries, slice(start, end))
+                dead = self.alive[start:end] == 0
+            else:
+                block_rows = rows[start:end]
+                scores = self._block_scores(queries, block_rows)
+                dead = self.alive[block_rows] == 0
+            scores[:, dead] = -np.inf
+            #与之前块的最好结果合并, 只保留 k 个
+            all_rows = np.concatenate([best_rows, np.broadcast_to(block_rows, (n_queries, len(block_rows)))], axis=1)
+            all_scores = np.concatenate([best_scores, scores], axis=1)
+            if all_scores.shape[1] > k:
+                keep = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+                all_rows = np.take_along_axis(all_rows, keep, axis=1)
+                all_scores = np.take_along_axis(all_scores, keep, axis=1)
+            best_rows, best_scores = all_rows, all_scores
+
+        results = []
+        for i in range(n_queries):
+            order = np.argsort(-best_scores[i])
+            valid = np.isfinite(best_scores[i][order])
+            results.append((best_rows[i][order][valid], best_scores[i][order][valid]))
+        return results
+
+    def _rescore(self, queries, candidates, k):
+        """
+        用 float32 矩阵为量化检索的候选重新打分, 返回每个查询的 (行号数组, 分数数组)
+        """
+        results = []
+        for query, (rows, _) in zip(queries, candidates):
+            rows = np.sort(rows) #按行号顺序读取, 对内存映射文件更友好
+            scores = self.vectors[rows] @ query
+            best = np.argsort(-scores)[:k]
+            results.append((rows[best], scores[best]))
+        return results
+
+    def _search(self, queries, k, rows=None):
+        """
+        在量化矩阵(或 float32 矩阵)上检索, 量化时多取候选并重新打分
+        """
+        if self.compact is None:
+            return self._top_k(queries, k, rows)
+        candidates = self._top_k(self._scan_queries(queries), k * self.rescore_factor, rows)
+        return self._rescore(queries, candidates, k)
+
+    def _ann_candidates(self, queries, nprobe=None, allowed=None):
+        """
+        IVF 近似检索的候选: 每个查询最近的 nprobe 个聚类中的行
+        allowed: 过滤条件匹配的行号(升序), 与聚类中的行取交集
+        """
+        results = []
+        for query in queries:
+            rows = self.ann.candidates(query, nprobe)
+            rows = rows[rows < self.count] #索引可能已经包含快照之后写入的行
+            if allowed is not None:
+                rows = np.intersect1d(rows, allowed, assume_unique=True)
+            results.append(rows)
+        return results
+
+    def similarity_search_by_vectors(self, embeddings, k=4, filter=None, nprobe=None, exact=False):
+        """
+        多个查询向量一起检索, 精确检索时共用一次矩阵乘法
+        返回每个查询的 [(Document, 余弦相似度), ...]
+        nprobe: IVF 检索的聚类数量, 默认 config.ivf_nprobe
+        exact: 为 True 时不使用 IVF 索引
+
+        锁内只刷新映射、计算候选行, 并记下本次使用的映射和行数(浅拷贝);
+        扫描矩阵和读取文档在锁外进行, 多个查询可以同时检索
+        """
+        queries = normalize(embeddings)
+        with self._lock:
+            self.refresh()
+            if self.count == 0:
+                return [[] for _ in embeddings]
+            self._docs_map()
+            view = copy.copy(self) #其他线程 refresh 时替换的是 self 上的映射, 不影响本次检索
+            rows = self._candidate_rows(filter)
+            use_ann = not exact and self.ann is not None and self.ann.trained
+            if use_ann and (rows is None or len(rows) > config.ivf_min_rows):
+                #匹配的行很多时仍然使用 IVF, 过滤条件足够精确时直接在匹配的行上精确检索
+                probes = self._ann_candidates(queries, nprobe, rows)
+            else:
+                probes = None
+
+        if probes is not None:
+            found = [view._search(query[None, :], k, probe)[0] for query, probe in zip(queries, probes)]
+        else:
+            found = view._search(queries, k, rows)
+        results = []
+        for top_rows, top_scores in found:
+            results.append(list(zip(view._documents(top_rows), top_scores.tolist())))
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter=None, **kwargs: Any) -> list[tuple[Document, float]]:
+        embedding = self.embedding_function.embed_query(query)
+        return self.similarity_search_by_vectors([embedding], k=k, filter=filter, nprobe=kwargs.get("nprobe"))[0]
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, filter=None, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vectors([embedding], k=k, filter=filter, nprobe=kwargs.get("nprobe"))[0]]
+
+    def similarity_search(self, query: str, k: int = 4, filter=None, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter, **kwargs)]
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, filter=None, **kwargs: Any) -> list[tuple[Document, float]]:
+        #查询向量化走异步接口, 矩阵运算(NumPy 会释放 GIL)放到线程池
+        embedding = await self.embedding_function.aembed_query(query)
+        results = await run_in_executor(None, self.similarity_search_by_vectors, [embedding], k, filter, kwargs.get("nprobe"))
+        return results[0]
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter=None, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k=k, filter=filter, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        #余弦相似度 [-1, 1] 映射到 [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts: list[str], embedding: Embeddings, metadatas: Optional[list[dict]] = None, *, ids: Optional[list[str]] = None, **kwargs: Any) -> "MmapVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -1,24 +1,57 @@
+import asyncio
+import time
+
 from vector_stores import VectorStoreService
-from langchain_community.embeddings import DashScopeEmbeddings 
+from embedding_cache import get_cached_embeddings
 import config_data as config 
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_community.chat_models import ChatTongyi
 from dotenv import load_dotenv
 from langchain_core.runnables import RunnablePassthrough 
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from file_history_store import FileChatMessageHistory, get_history
+from file_history_store import get_history
 from langchain_core.prompts import MessagesPlaceholder
-from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables import RunnableBranch, RunnableLambda
+from langchain_core.messages import AIMessage, HumanMessage
+from retrieval_cache import CachedRetriever
+from metrics import MetricsCallbackHandler, get_metrics, trace_prompt
+from context_packer import ContextPacker
+from bounded_history import BoundedChatHistory, SessionSummaryStore, make_summarizer
+from answer_cache import SemanticAnswerCache
 load_dotenv()   
 
 
+context_packer = ContextPacker() #合并重叠片段、去重, 按 token 预算整理参考资料
+
+
+def format_document(docs: list[Document]) -> str:
+    return context_packer.pack(docs)
+
+
+def _discard(task):
+    """
+    取消不再需要的异步任务; 已经结束的任务取出异常, 避免 "Task exception was never retrieved" 警告
+    """
+    if task.done():
+        if not task.cancelled():
+            task.exception()
+    else:
+        task.cancel()
+
+
 class RagService(object):
-    def __init__(self):
-        self.vector_service = VectorStoreService(embedding = DashScopeEmbeddings(model = config.embedding_name)) #向量数据库服务实例对象
+    def __init__(self, embedding=None, chat_model=None):
+        """
+        embedding: 嵌入模型, 默认使用带缓存的 DashScope 模型
+        chat_model: 聊天模型, 默认使用通义千问; 离线测试时可以传入本地的假模型
+        """
+        self.vector_service = VectorStoreService(embedding = embedding or get_cached_embeddings(config.embedding_name)) #向量数据库服务实例对象, 嵌入模型带缓存
 
-        self.chat_model = ChatTongyi(model = config.chat_model_name) #聊天模型实例对象
+        if chat_model is None:
+            from langchain_community.chat_models import ChatTongyi #第一次创建服务时才加载 langchain_community
+            chat_model = ChatTongyi(model = config.chat_model_name)
+        self.chat_model = chat_model #聊天模型实例对象
 
         self.prompt_template = ChatPromptTemplate.from_messages(
             [
@@ -29,6 +62,28 @@ class RagService(object):
             ]
         )   
 
+        #有界会话历史: 最近几轮保留原文, 更早的对话由模型增量合并进摘要
+        self.summary_prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", "你负责维护一段对话摘要。把新的对话内容合并进已有摘要，保留用户的身份、需求、偏好和尚未解决的问题，不超过300字，只输出摘要本身。"),
+                ("user", "已有摘要：{summary}\n新的对话：\n{conversation}"),
+            ]
+        )
+        self.summarize = make_summarizer(self.summary_prompt | self.chat_model | StrOutputParser())
+        self.summary_store = SessionSummaryStore()
+
+        #获取向量数据库的检索器, 前面加一层检索结果缓存, 知识库更新后自动失效
+        self.retriever = CachedRetriever(retriever=self.vector_service.get_retriever(), top_k=config.similarity_top_k)
+
+        self.context_chain = self.retriever | RunnableLambda(format_document) #问题 -> 参考资料文本
+        self.answer_chain = self.prompt_template | RunnableLambda(trace_prompt) | self.chat_model | StrOutputParser() #提示词 -> 回答
+
+        #语义回答缓存: 与已回答过的问题足够相似时直接返回回答, 知识库更新后自动失效
+        self.answer_cache = SemanticAnswerCache(self.vector_service.embedding) if config.answer_cache_enabled else None
+
+        self.metrics = get_metrics() #分阶段耗时统计, 进程内共享
+        self.callbacks = [MetricsCallbackHandler(self.metrics)]
+
         self.chain = self._get_chain()
 
     
@@ -36,25 +91,6 @@ class RagService(object):
         """
         获取最终的执行链
         """
-        retriever = self.vector_service.get_retriever() #获取向量数据库的检索器
-
-        def format_document(docs: list[Document]) -> list:
-            if not docs:
-                return "没有相关资料。"
-            
-            formatted_docs = ""
-            for doc in docs:
-                formatted_docs += f"文档片段: {doc.page_content}\n文档元数据;{doc.metadata}\n\n"
-
-            return formatted_docs
-        
-        def print_prompt(prompt):
-            print("="*30)
-            print(prompt.to_string())
-            print("="*30)
-            return prompt
-            
-
         def format_for_retriever(value):
             return value["question"]
             
@@ -68,22 +104,133 @@ class RagService(object):
         chain = (
             {
                 "question": RunnablePassthrough(),
-                "context": RunnableLambda(format_for_retriever) | retriever | format_document
-            } | RunnableLambda(format_for_template) | self.prompt_template| print_prompt| self.chat_model | StrOutputParser()
+                "context": RunnableLambda(format_for_retriever) | self.context_chain
+            } | RunnableLambda(format_for_template) | self.answer_chain
         )
 
+        if self.answer_cache is not None:
+            #先查语义回答缓存, 命中时跳过检索和生成; 未命中时回答结束后写入缓存
+            def lookup(value):
+                if value["history"] and not config.answer_cache_with_history:
+                    return None
+                return self.answer_cache.lookup(value["question"])
+
+            def store(run):
+                cached = run.inputs.get("cached")
+                if cached is not None and cached[0] is None:
+                    answer = run.outputs.get("output") if isinstance(run.outputs, dict) else run.outputs
+                    self.answer_cache.store(run.inputs["question"], answer, cached[1], cached[2],
+                                            (run.end_time - run.start_time).total_seconds())
+
+            chain = RunnablePassthrough.assign(cached=RunnableLambda(lookup)) | RunnableBranch(
+                (lambda value: value["cached"] is not None and value["cached"][0] is not None,
+                 RunnableLambda(lambda value: value["cached"][0])),
+                chain.with_listeners(on_end=store),
+            )
+
     
     
         #chain with history 
         conversation_chain = RunnableWithMessageHistory(
             chain, 
-            get_history,
+            self.get_session_history,
             input_messages_key="question", 
             history_messages_key= "history"
             )
         
 
-        return conversation_chain
+        def record_total(run):
+            self.metrics.record("total", (run.end_time - run.start_time).total_seconds())
+
+        return conversation_chain.with_config(callbacks=self.callbacks).with_listeners(on_end=record_total)
+
+
+    def get_session_history(self, session_id):
+        """
+        会话历史: 只向提示词提供摘要 + 最近几轮原文
+        """
+        return BoundedChatHistory(get_history(session_id), session_id, self.summarize, self.summary_store)
+
+
+    async def _aload_history(self, history):
+        start = time.perf_counter()
+        messages = await history.aget_messages()
+        self.metrics.record("history_load", time.perf_counter() - start)
+        return messages
+
+
+    async def _aprepare(self, question, session_id):
+        """
+        并发读取会话历史和检索参考资料, 返回 (会话历史对象, 提示词模板的输入)
+        """
+        history = self.get_session_history(session_id)
+        messages, context = await asyncio.gather(
+            self._aload_history(history),
+            self.context_chain.ainvoke(question, config={"callbacks": self.callbacks}),
+        )
+        return history, {"question": question, "context": context, "history": messages}
+
+
+    async def _alookup_answer(self, question, session_id):
+        """
+        查询语义回答缓存, 返回 (会话历史对象, 会话历史消息, 缓存查询结果)
+        会话已有历史且 config.answer_cache_with_history 为 False 时不查询, 缓存查询结果为 None
+        """
+        history = self.get_session_history(session_id)
+        messages = await self._aload_history(history)
+        if messages and not config.answer_cache_with_history:
+            return history, messages, None
+        return history, messages, await self.answer_cache.alookup(question)
+
+
+    async def astream(self, input: dict, session_config: dict = None):
+        """
+        异步流式回答, 用法与 self.chain.stream 相同: astream({"question": ...}, config.session_config)
+        一个事件循环可以同时服务多个会话, 不需要为每个用户占用一个线程
+        """
+        start = time.perf_counter()
+        session_config = session_config or config.session_config
+        question = input["question"]
+        session_id = session_config["configurable"]["session_id"]
+
+        cached = None
+        if self.answer_cache is None:
+            history, inputs = await self._aprepare(question, session_id)
+        else:
+            #检索与会话历史读取、缓存查询并发进行; 命中缓存时取消检索, 不使用其结果
+            retrieval = asyncio.ensure_future(self.context_chain.ainvoke(question, config={"callbacks": self.callbacks}))
+            try:
+                history, messages, cached = await self._alookup_answer(question, session_id)
+            except BaseException:
+                _discard(retrieval)
+                raise
+            if cached is None or cached[0] is None:
+                inputs = {"question": question, "context": await retrieval, "history": messages}
+            else:
+                _discard(retrieval)
+
+        if cached is not None and cached[0] is not None:
+            chunks = [cached[0]] #命中语义回答缓存, 整段回答一次输出
+            yield cached[0]
+        else:
+            chunks = []
+            async for chunk in self.answer_chain.astream(inputs, config={"callbacks": self.callbacks}):
+                chunks.append(chunk)
+                yield chunk
+        elapsed = time.perf_counter() - start
+        self.metrics.record("total", elapsed)
+        if cached is not None and cached[0] is None:
+            self.answer_cache.store(question, "".join(chunks), cached[1], cached[2], elapsed)
+
+        #与 RunnableWithMessageHistory 相同, 回答结束后把本轮问答写入会话历史
+        await history.aadd_messages([HumanMessage(content=question), AIMessage(content="".join(chunks))])
+
+
+    async def ainvoke(self, input: dict, session_config: dict = None):
+        """
+        异步回答, 返回完整的回答字符串
+        """
+        return "".join([chunk async for chunk in self.astream(input, session_config)])
 
 
 if __name__ == "__main__":
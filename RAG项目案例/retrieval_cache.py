@@ -0,0 +1,113 @@
+"""
+检索结果缓存: 放在向量检索器前面, 相同(规范化后)的问题直接返回上次的检索结果
+
+缓存键为 (规范化的问题, top_k), 知识库版本号变化时整个缓存清空
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import PrivateAttr
+
+import config_data as config
+from kb_version import get_kb_version
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?？。.!！~～"
+
+
+def normalize_question(question: str):
+    """
+    规范化问题: 全角转半角、去掉多余空白、英文转小写、去掉结尾的标点
+    """
+    question = unicodedata.normalize("NFKC", question)
+    question = _SPACES.sub(" ", question).strip().lower()
+    return question.rstrip(_TRAILING_PUNCTUATION).strip()
+
+
+class CachedRetriever(BaseRetriever):
+    """
+    带 LRU + TTL 缓存的检索器
+    retriever: 被包装的检索器
+    top_k: 检索返回的数量, 作为缓存键的一部分
+    max_size: 最多缓存的问题数量
+    ttl: 缓存有效期(秒)
+    get_version: 返回知识库版本号的函数
+    """
+
+    retriever: BaseRetriever
+    top_k: int = config.similarity_top_k
+    max_size: int = config.retrieval_cache_size
+    ttl: float = config.retrieval_cache_ttl
+    get_version: Callable[[], Any] = get_kb_version
+
+    _cache: OrderedDict = PrivateAttr(default_factory=OrderedDict) #键 -> (写入时间, 文档列表)
+    _version: Any = PrivateAttr(default=None) #缓存对应的知识库版本号
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def _lookup(self, key):
+        """
+        查询缓存, 知识库版本变化时先清空
+        """
+        version = self.get_version()
+        with self._lock:
+            if version != self._version:
+                self._cache.clear()
+                self._version = version
+            entry = self._cache.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                return version, list(entry[1])
+            if entry is not None:
+                del self._cache[key] #已过期
+            self._misses += 1
+            return version, None
+
+    def _store(self, key, version, docs):
+        with self._lock:
+            if version != self._version:
+                return #检索期间知识库发生了变化, 结果不写入缓存
+            self._cache[key] = (time.monotonic(), list(docs))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        key = (normalize_question(query), self.top_k)
+        version, docs = self._lookup(key)
+        if docs is not None:
+            return docs
+        docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        self._store(key, version, docs)
+        return docs
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> list[Document]:
+        key = (normalize_question(query), self.top_k)
+        version, docs = self._lookup(key)
+        if docs is not None:
+            return docs
+        docs = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        self._store(key, version, docs)
+        return docs
+
+    def stats(self):
+        """
+        命中统计
+        """
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0,
+                "size": len(self._cache),
+            }
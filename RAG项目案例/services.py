@@ -0,0 +1,64 @@
+"""
+进程内共享的重量级服务: RagService(向量库、嵌入模型、聊天模型)和 KnowledgeBaseService
+
+Streamlit 为每个浏览器会话重新执行页面脚本, 服务对象放在这里而不是 st.session_state 中,
+所有访问者共用同一份, 内存和首次响应时间不随并发访问人数增长; 每个会话只保存自己的会话 id
+"""
+import threading
+
+import config_data as config
+
+_services = {} #服务名 -> 实例
+_service_locks = {} #服务名 -> 创建该服务时持有的锁, 创建一个服务时不阻塞其他服务
+_services_lock = threading.Lock()
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+
+def _get_service(name, factory):
+    service = _services.get(name)
+    if service is not None:
+        return service
+    with _services_lock:
+        lock = _service_locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _services:
+            _services[name] = factory()
+        return _services[name]
+
+
+def get_rag_service():
+    from rag import RagService
+    return _get_service("rag", RagService)
+
+
+def get_knowledge_base_service():
+    from knowledge_base import KnowledgeBaseService
+    return _get_service("knowledge_base", KnowledgeBaseService)
+
+
+def warm_up(*getters):
+    """
+    创建服务并预热: 加载向量库和词法索引、启动后台事件循环
+    config.warm_up_question 不为空时再检索一次, 让嵌入模型和检索路径的连接提前建立
+    """
+    for getter in getters or (get_rag_service,):
+        service = getter()
+        if config.warm_up_question and hasattr(service, "retriever"):
+            try:
+                service.retriever.invoke(config.warm_up_question)
+            except Exception as error:
+                print(f"预热检索失败: {error}")
+    from async_runner import get_event_loop
+    get_event_loop()
+
+
+def start_warm_up(*getters):
+    """
+    在后台线程中预热, 只执行一次; 页面可以先渲染, 第一次提问时如果还没有预热完会等待
+    """
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, args=getters, name="warm-up", daemon=True)
+            _warm_up_thread.start()
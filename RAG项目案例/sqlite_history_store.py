@@ -0,0 +1,287 @@
+"""
+SQLite 会话历史: 所有会话保存在一个数据库中, 替代每个会话一个文件
+
+messages 表按 (session_id, seq) 建索引, 读取最近 N 条、追加一轮问答都只访问该会话的索引范围;
+sessions 表记录每个会话最后活跃的时间, 用于按 TTL 清理过期会话
+WAL 模式下读写互不阻塞, 多个线程/进程同时写入由 SQLite 的写锁排队
+
+用法:
+    python sqlite_history_store.py migrate [--source ./chat_history]   从 JSON / JSONL 文件导入
+    python sqlite_history_store.py purge [--ttl-days 30]               清理过期会话
+"""
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+import config_data as config
+
+
+class ConnectionPool(object):
+    def __init__(self, db_path, size=None):
+        """
+        db_path: 数据库文件路径
+        size: 最多打开的连接数, 连接在线程之间复用
+        """
+        self.db_path = db_path
+        self.size = size or config.chat_history_pool_size
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+        with self.connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY, "
+                "session_id TEXT NOT NULL, "
+                "seq INTEGER NOT NULL, "
+                "message TEXT NOT NULL)"
+            )
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_session_seq ON messages (session_id, seq)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, "
+                "updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+
+    def _connect(self):
+        #isolation_level=None: 自动提交, 事务由我们自己显式控制
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL") #WAL 模式下读写互不阻塞
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        借出一个连接, 用完归还; 连接数达到上限时等待其他线程归还
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._opened < self.size
+                if create:
+                    self._opened += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction: #异常中断的事务先回滚, 不把脏连接放回池中
+                conn.execute("ROLLBACK")
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        写事务: BEGIN IMMEDIATE 一开始就拿到写锁, 避免读后写升级锁时与其他写入方死锁
+        """
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._opened -= 1
+
+
+def insert_messages(conn, session_id, messages_data, now=None):
+    """
+    在已经开始的写事务中, 把一批消息(dict)追加到会话末尾
+    """
+    last = conn.execute("SELECT MAX(seq) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+    start = 0 if last is None else last + 1
+    conn.executemany(
+        "INSERT INTO messages (session_id, seq, message) VALUES (?, ?, ?)",
+        ((session_id, start + i, json.dumps(data, ensure_ascii=False)) for i, data in enumerate(messages_data)),
+    )
+    conn.execute(
+        "INSERT INTO sessions (session_id, updated_at) VALUES (?, ?) "
+        "ON CONFLICT (session_id) DO UPDATE SET updated_at = excluded.updated_at",
+        (session_id, time.time() if now is None else now),
+    )
+
+
+def bulk_insert(sessions, pool=None):
+    """
+    批量写入多个会话: {session_id: [消息 dict]}, 在一个事务中完成
+    """
+    pool = pool or get_pool()
+    with pool.transaction() as conn:
+        for session_id, messages_data in sessions.items():
+            if messages_data:
+                insert_messages(conn, session_id, messages_data)
+
+
+def purge_expired(ttl_seconds=None, pool=None):
+    """
+    删除超过 ttl_seconds 没有新消息的会话, 返回删除的会话数
+    """
+    pool = pool or get_pool()
+    ttl_seconds = config.chat_history_ttl_days * 86400 if ttl_seconds is None else ttl_seconds
+    deadline = time.time() - ttl_seconds
+    with pool.transaction() as conn:
+        expired = [row[0] for row in conn.execute("SELECT session_id FROM sessions WHERE updated_at < ?", (deadline,))]
+        for session_id in expired:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (deadline,))
+    return len(expired)
+
+
+class SqliteChatMessageHistory(BaseChatMessageHistory):
+    def __init__(self, session_id: str, pool: ConnectionPool = None):
+        """
+        session_id: 会话 id
+        pool: 连接池, 默认使用进程内共享的连接池(config.chat_history_db_path)
+        """
+        self.session_id = session_id
+        self.pool = pool or get_pool()
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        with self.pool.transaction() as conn:
+            insert_messages(conn, self.session_id, [message_to_dict(message) for message in messages])
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY seq", (self.session_id,)
+            ).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
+    def tail(self, n: int) -> list[BaseMessage]:
+        """
+        最后 n 条消息, 沿 (session_id, seq) 索引倒序读取
+        """
+        if n <= 0:
+            return []
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?", (self.session_id, n)
+            ).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in reversed(rows)])
+
+    def message_count(self) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (self.session_id,)).fetchone()[0]
+
+    def version(self):
+        """
+        (最后写入时间, 最大序号), 用于判断进程内缓存是否过期; 会话不存在时为 None
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT updated_at, (SELECT MAX(seq) FROM messages WHERE session_id = ?) FROM sessions WHERE session_id = ?",
+                (self.session_id, self.session_id),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def clear(self) -> None:
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (self.session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (self.session_id,))
+
+
+
+_pools = {} #数据库路径 -> 进程内共享的连接池
+_pools_lock = threading.Lock()
+
+def get_pool(db_path=None):
+    db_path = os.path.abspath(db_path or config.chat_history_db_path)
+    with _pools_lock:
+        if db_path not in _pools:
+            _pools[db_path] = ConnectionPool(db_path)
+        return _pools[db_path]
+
+
+def _read_session_file(path):
+    """
+    读取旧版 {session_id}.json(整个列表)或 {session_id}.jsonl(每行一条, 只取最后一个清空标记之后的消息)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        messages_data = []
+        for line in f:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue #崩溃留下的半行
+            if data.get("type") == "__clear__":
+                messages_data = []
+            else:
+                messages_data.append(data)
+        return messages_data
+
+
+def migrate(source=None, pool=None, batch_size=500):
+    """
+    把目录下的会话文件导入数据库, 同一会话同时有 .json 和 .jsonl 时以 .jsonl 为准
+    已经导入过的会话跳过, 可以重复执行; 返回 (导入的会话数, 消息数)
+    """
+    source = source or config.chat_history_path
+    pool = pool or get_pool()
+    files = {}
+    for name in sorted(os.listdir(source)):
+        session_id, ext = os.path.splitext(name)
+        if ext == ".jsonl" or (ext == ".json" and not session_id.endswith(".summary") and session_id not in files):
+            files[session_id] = os.path.join(source, name)
+
+    with pool.connection() as conn:
+        existing = {row[0] for row in conn.execute("SELECT session_id FROM sessions")}
+    sessions_count = messages_count = 0
+    batch = {}
+    for session_id, path in files.items():
+        if session_id in existing:
+            continue
+        batch[session_id] = _read_session_file(path)
+        sessions_count += 1
+        messages_count += len(batch[session_id])
+        if len(batch) >= batch_size:
+            bulk_insert(batch, pool)
+            batch = {}
+    if batch:
+        bulk_insert(batch, pool)
+    return sessions_count, messages_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite 会话历史维护")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="从 JSON / JSONL 会话文件导入")
+    migrate_parser.add_argument("--source", default=config.chat_history_path, help="会话文件目录")
+    purge_parser = subparsers.add_parser("purge", help="清理过期会话")
+    purge_parser.add_argument("--ttl-days", type=float, default=config.chat_history_ttl_days, help="超过多少天没有新消息的会话")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        sessions_count, messages_count = migrate(args.source)
+        print(f"导入 {sessions_count} 个会话, {messages_count} 条消息 -> {config.chat_history_db_path}")
+    else:
+        print(f"删除 {purge_expired(args.ttl_days * 86400)} 个过期会话")
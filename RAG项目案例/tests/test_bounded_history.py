@@ -0,0 +1,45 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import config_data as config
+from bounded_history import BoundedChatHistory, SessionSummaryStore
+from file_history_store import FileChatMessageHistory
+
+
+def make_turns(n):
+    messages = []
+    for i in range(n):
+        messages += [HumanMessage(f"问题 {i}"), AIMessage(f"回答 {i}")]
+    return messages
+
+
+def summarize(summary, messages):
+    return (summary or "") + "".join(message.content for message in messages)
+
+
+def make_history(tmp_path, messages):
+    underlying = FileChatMessageHistory(str(tmp_path), "session", fsync=False, compact_bytes=0)
+    underlying.add_messages(messages)
+    return BoundedChatHistory(underlying, "session", summarize, SessionSummaryStore(str(tmp_path)))
+
+
+def test_window_starts_after_folded_messages(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "history_token_budget", 10000)
+    messages = make_turns(5)
+    history = make_history(tmp_path, messages)
+
+    monkeypatch.setattr(config, "history_max_turns", 2)
+    history.fold() #前 3 轮折叠进摘要
+    assert history.summary_store.load("session") == ("".join(m.content for m in messages[:6]), 6)
+
+    monkeypatch.setattr(config, "history_max_turns", 6) #窗口变大后也不能包含已折叠的消息
+    result = history.messages
+    assert isinstance(result[0], SystemMessage)
+    assert result[1:] == messages[6:]
+
+
+def test_without_summary_keeps_recent_turns(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "history_token_budget", 10000)
+    monkeypatch.setattr(config, "history_max_turns", 2)
+    messages = make_turns(5)
+    history = make_history(tmp_path, messages)
+    assert history.messages == messages[-4:]
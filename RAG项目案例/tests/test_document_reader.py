@@ -0,0 +1,23 @@
+import io
+
+import pytest
+
+from document_reader import get_reader, iter_document, iter_docx_blocks, iter_pdf_pages, iter_txt_blocks
+
+
+@pytest.mark.parametrize("filename, reader", [
+    ("manual.pdf", iter_pdf_pages),
+    ("MANUAL.PDF", iter_pdf_pages),
+    ("Manual.Pdf", iter_pdf_pages),
+    ("报告.DOCX", iter_docx_blocks),
+    ("notes.TXT", iter_txt_blocks),
+    ("notes.md", iter_txt_blocks),
+    ("README", iter_txt_blocks),
+])
+def test_get_reader_ignores_suffix_case(filename, reader):
+    assert get_reader(filename) is reader
+
+
+def test_iter_document_upper_case_txt():
+    text = "第一行\n第二行"
+    assert "".join(iter_document(io.BytesIO(text.encode("gbk")), "NOTES.TXT")) == text
@@ -0,0 +1,46 @@
+import random
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+import config_data as config
+from fast_splitter import FastRecursiveTextSplitter
+
+
+def random_text(rng, length):
+    #按知识库的分隔符随机组成文本, 各级分隔符都会出现
+    pieces = ["\n\n", "\n", "。", "，", " ", "!"] + ["客服"] * 4 + ["abcdefghij"] * 4
+    return "".join(rng.choice(pieces) for _ in range(length))
+
+
+def blocks_of(rng, text):
+    #随机长度的文本块, 模拟逐页/逐块读取的文档
+    position = 0
+    while position < len(text):
+        step = rng.randint(1, 3000)
+        yield text[position:position + step]
+        position += step
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("window", [50, 1000, 20000])
+def test_split_stream_matches_split_text(seed, window):
+    rng = random.Random(seed)
+    splitter = FastRecursiveTextSplitter(chunk_size=config.chunk_size, chunk_overlap=config.chunk_overlap, separators=config.separators)
+    for _ in range(10):
+        text = random_text(rng, rng.randint(0, 20000))
+        assert list(splitter.split_stream(blocks_of(rng, text), window)) == splitter.split_text(text)
+
+
+def test_split_stream_region_change():
+    #前面很长一段只有低优先级的分隔符, 之后才出现 "\n\n"
+    splitter = FastRecursiveTextSplitter(chunk_size=100, chunk_overlap=10, separators=config.separators)
+    text = "，".join(["客服回答"] * 300) + "\n\n" + "\n".join(["第二段"] * 200)
+    assert list(splitter.split_stream(iter([text[i:i + 70] for i in range(0, len(text), 70)]), 200)) == splitter.split_text(text)
+
+
+def test_split_text_matches_langchain():
+    rng = random.Random(42)
+    kwargs = dict(chunk_size=200, chunk_overlap=20, separators=config.separators)
+    text = random_text(rng, 5000)
+    assert FastRecursiveTextSplitter(**kwargs).split_text(text) == RecursiveCharacterTextSplitter(**kwargs).split_text(text)
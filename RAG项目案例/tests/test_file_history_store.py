@@ -0,0 +1,69 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from file_history_store import FileChatMessageHistory
+
+
+def test_compact_keeps_all_messages(tmp_path):
+    history = FileChatMessageHistory(str(tmp_path), "session", fsync=False, compact_bytes=0)
+    history.add_messages([HumanMessage("清空前的问题"), AIMessage("清空前的回答")])
+    history.clear()
+    messages = [HumanMessage(f"问题 {i}") if i % 2 == 0 else AIMessage(f"回答 {i}") for i in range(10)]
+    history.add_messages(messages[:5])
+    with open(history.file_path, "ab") as f:
+        f.write(b'{"type": "human", "data": {"content": "\xe5\x8d\x8a') #崩溃留下的半行
+    history.add_messages(messages[5:])
+    assert history.messages == messages
+
+    assert history.compact()
+
+    assert history.messages == messages
+    assert history.message_count() == len(messages)
+    assert not history.compact() #已经没有无效内容, 不再重写
+
+
+def test_tail_after_compact(tmp_path):
+    history = FileChatMessageHistory(str(tmp_path), "session", fsync=False, compact_bytes=0)
+    messages = [HumanMessage(f"问题 {i}") for i in range(6)]
+    history.add_messages(messages)
+    history.compact(force=True)
+    assert history.tail(4) == messages[-4:]
+
+
+def wait_for_compaction():
+    #后台压缩在单个线程中执行, 提交一个空任务并等待它完成
+    from file_history_store import get_compact_executor
+    get_compact_executor().submit(lambda: None).result()
+
+
+def test_clear_compacts_in_background(tmp_path):
+    history = FileChatMessageHistory(str(tmp_path), "session", fsync=False, compact_bytes=1, compact_ratio=0.3)
+    history.add_messages([HumanMessage("问题" * 100), AIMessage("回答" * 100)])
+    wait_for_compaction()
+    history.clear()
+    wait_for_compaction()
+    with open(history.file_path, "rb") as f:
+        assert f.read() == b"" #清空之前的消息和清空标记都已经去掉
+    history.add_messages([HumanMessage("新的问题")])
+    assert history.messages == [HumanMessage("新的问题")]
+
+
+def test_growth_below_ratio_keeps_file(tmp_path):
+    history = FileChatMessageHistory(str(tmp_path), "session", fsync=False, compact_bytes=1, compact_ratio=0.5)
+    history.add_messages([HumanMessage("很长的问题" * 50)])
+    with open(history.file_path, "ab") as f:
+        f.write(b'{"type": "hu') #无效内容只占很小的比例
+    history.add_messages([AIMessage("很长的回答" * 50)])
+    wait_for_compaction()
+    before = history.version()
+    assert not history.compact(min_ratio=0.5)
+    assert history.version() == before
+    assert history.message_count() == 2
+
+
+def test_version_changes_after_compact(tmp_path):
+    #缓存按版本校验, 压缩替换文件后读取方需要重新加载
+    history = FileChatMessageHistory(str(tmp_path), "session", fsync=False, compact_bytes=0)
+    history.add_messages([HumanMessage("问题")])
+    before = history.version()
+    history.compact(force=True)
+    assert history.version() != before
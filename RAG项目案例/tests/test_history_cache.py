@@ -0,0 +1,57 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from file_history_store import FileChatMessageHistory
+from history_cache import CachedChatMessageHistory, HistoryCache
+
+
+class CountingHistory(FileChatMessageHistory):
+    #记录整个会话被读取的次数
+    full_reads = 0
+
+    @property
+    def messages(self):
+        self.full_reads += 1
+        return super().messages
+
+
+def make_messages(n):
+    return [HumanMessage(f"问题 {i}") if i % 2 == 0 else AIMessage(f"回答 {i}") for i in range(n)]
+
+
+def test_tail_on_miss_reads_only_the_tail(tmp_path):
+    underlying = CountingHistory(str(tmp_path), "session", fsync=False, compact_bytes=0)
+    messages = make_messages(20)
+    underlying.add_messages(messages)
+    history = CachedChatMessageHistory(underlying, "session", HistoryCache(max_bytes=1 << 20, write_behind=False))
+
+    assert history.tail(4) == messages[-4:]
+    assert history.message_count() == 20
+    assert underlying.full_reads == 0
+
+    assert history.messages == messages #加载之后从缓存切片
+    assert history.tail(3) == messages[-3:]
+    assert underlying.full_reads == 1
+
+
+def test_tail_includes_pending_messages(tmp_path):
+    underlying = FileChatMessageHistory(str(tmp_path), "session", fsync=False, compact_bytes=0)
+    underlying.add_messages(make_messages(6))
+    cache = HistoryCache(max_bytes=1 << 20, write_behind=True, flush_interval=3600)
+    history = CachedChatMessageHistory(underlying, "session", cache)
+    history.add_messages([HumanMessage("还没有写入")])
+    underlying.add_messages([AIMessage("其他进程写入")]) #缓存过期
+
+    assert history.tail(2) == [AIMessage("其他进程写入"), HumanMessage("还没有写入")]
+    assert history.message_count() == 8
+    cache.flush()
+
+
+def test_write_behind_survives_eviction(tmp_path):
+    #上限只有 1 字节: 加载会话后缓存项立即被淘汰, 追加的消息仍然要在 flush 时写入
+    underlying = FileChatMessageHistory(str(tmp_path), "session", fsync=False, compact_bytes=0)
+    underlying.add_messages(make_messages(2))
+    cache = HistoryCache(max_bytes=1, write_behind=True, flush_interval=3600)
+    history = CachedChatMessageHistory(underlying, "session", cache)
+    history.add_messages(make_messages(4)[2:])
+    cache.flush()
+    assert underlying.messages == make_messages(4)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import config_data as config
+from mmap_vector_store import MmapVectorStore, normalize
+
+
+def add_random(store, rng, start, n, dim=32):
+    store.add_embeddings([str(i) for i in range(start, start + n)], [""] * n, rng.standard_normal((n, dim), dtype=np.float32))
+
+
+def test_training_runs_in_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ivf_min_rows", 500)
+    rng = np.random.default_rng(0)
+    store = MmapVectorStore(None, persist_directory=str(tmp_path), ann_index="ivf")
+    for start in range(0, 2000, 100):
+        add_random(store, rng, start, 100) #训练期间继续写入
+    query = normalize(rng.standard_normal((1, 32), dtype=np.float32))
+    assert len(store.similarity_search_by_vectors(query, k=4)[0]) == 4 #训练完成前使用精确检索
+
+    assert store.wait_ann_index()
+    assert store.ann.synced == store.count == 2000
+    assert sorted(np.concatenate(store.ann.lists).tolist()) == list(range(2000)) #训练期间写入的行也已分配
+
+    reader = MmapVectorStore(None, persist_directory=str(tmp_path), mode="r")
+    assert reader.ann.trained
+    exact = store.similarity_search_by_vectors(query, k=4, exact=True)[0]
+    approximate = reader.similarity_search_by_vectors(query, k=4, nprobe=len(reader.ann.lists))[0]
+    assert [doc.id for doc, _ in approximate] == [doc.id for doc, _ in exact] #扫描全部聚类时与精确检索一致
+
+
+def test_read_only_store_does_not_train(tmp_path):
+    MmapVectorStore(None, persist_directory=str(tmp_path), ann_index="ivf")
+    reader = MmapVectorStore(None, persist_directory=str(tmp_path), mode="r", ann_index="ivf")
+    with pytest.raises(PermissionError):
+        reader.build_ann_index() #只读打开的向量库不训练索引
@@ -0,0 +1,55 @@
+import sqlite3
+
+from md5_registry import Md5Registry
+
+
+def test_legacy_md5_txt_imported_once(tmp_path):
+    legacy = tmp_path / "md5.txt"
+    legacy.write_text("aaa\nbbb\n\nbbb\n", encoding="utf-8")
+    registry = Md5Registry(str(tmp_path / "md5.db"), legacy_path=str(legacy))
+    assert "aaa" in registry and "bbb" in registry
+    assert len(registry) == 2
+
+    #登记表不为空时不再导入, md5.txt 之后的修改不会生效
+    legacy.write_text("ccc\n", encoding="utf-8")
+    again = Md5Registry(str(tmp_path / "md5.db"), legacy_path=str(legacy))
+    assert "ccc" not in again
+    assert len(again) == 2
+
+
+def test_missing_legacy_file(tmp_path):
+    registry = Md5Registry(str(tmp_path / "md5.db"), legacy_path=str(tmp_path / "missing.txt"))
+    assert len(registry) == 0
+
+
+def test_add_dedups(tmp_path):
+    registry = Md5Registry(str(tmp_path / "md5.db"))
+    assert registry.add("aaa")
+    assert not registry.add("aaa")
+    registry.add_many(["aaa", "bbb", "bbb"])
+    assert len(registry) == 2
+    rows = sqlite3.connect(str(tmp_path / "md5.db")).execute("SELECT hash FROM md5 ORDER BY seq").fetchall()
+    assert rows == [("aaa",), ("bbb",)]
+
+
+def test_other_instance_sees_new_hashes(tmp_path):
+    #两个实例模拟两个进程, 各自持有连接和内存集合, 通过 data_version 发现对方的写入
+    first = Md5Registry(str(tmp_path / "md5.db"))
+    second = Md5Registry(str(tmp_path / "md5.db"))
+    assert "aaa" not in second
+    version = second._data_version
+
+    first.add("aaa")
+    first.add_many(["bbb", "ccc"])
+    assert "aaa" in second
+    assert second._data_version != version
+    assert len(second) == 3
+    assert second.add("ccc") is False
+
+
+def test_unchanged_database_skips_query(tmp_path):
+    registry = Md5Registry(str(tmp_path / "md5.db"))
+    registry.add("aaa")
+    last_seq = registry._last_seq
+    assert "zzz" not in registry #数据库没有变化, 只比较 data_version
+    assert registry._last_seq == last_seq
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from fake_embeddings import HashEmbeddings
+from metadata_index import MetadataIndex, match_where
+from mmap_vector_store import MmapVectorStore, normalize
+
+N = 2000
+
+
+def make_metadatas():
+    return [{"source": f"file{i % 20}.txt", "page": i} for i in range(N)]
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    embedding = HashEmbeddings(size=32)
+    store = MmapVectorStore(embedding, persist_directory=str(tmp_path_factory.mktemp("store")), ann_index="none")
+    store.add_texts([f"片段 {i}" for i in range(N)], make_metadatas())
+    return store
+
+
+def expected_search(store, query, k, where):
+    #逐条比较元数据, 再对匹配的片段计算余弦相似度, 作为过滤检索的标准答案
+    metadatas = make_metadatas()
+    vectors = normalize(store.embedding_function.embed_documents([f"片段 {i}" for i in range(N)]))
+    rows = [row for row in range(N) if match_where(metadatas[row], where)]
+    scores = vectors[rows] @ normalize([query])[0]
+    return [f"片段 {rows[i]}" for i in np.argsort(-scores, kind="stable")[:k]]
+
+
+@pytest.mark.parametrize("where", [
+    {"$and": [{"source": "file3.txt"}, {"page": {"$gte": 1000}}]},
+    {"$and": [{"source": {"$in": ["file1.txt", "file2.txt"]}}, {"page": {"$lt": 500}}]},
+    {"$or": [{"source": "file3.txt"}, {"page": {"$lt": 10}}]},
+    {"page": {"$gte": 1990}},
+])
+def test_filtered_search_matches_full_scan(store, where):
+    query = store.embedding_function.embed_query("片段 41")
+    results = store.similarity_search_by_vectors([query], k=5, filter=where)[0]
+    assert all(match_where(doc.metadata, where) for doc, _ in results)
+    assert [doc.page_content for doc, _ in results] == expected_search(store, query, 5, where)
+
+
+def test_and_scans_only_candidate_rows(tmp_path):
+    index = MetadataIndex(str(tmp_path), ["source"], [])
+    metadatas = make_metadatas()
+    index.add(0, metadatas)
+    scanned = []
+
+    def scan(rows, where):
+        #逐行比较元数据的行
+        scanned.append(len(rows))
+        return np.array([row for row in rows if match_where(metadatas[row], where)], dtype=np.int64)
+
+    where = {"$and": [{"source": "file3.txt"}, {"page": {"$gte": 1000}}]}
+    rows = index.select(where, scan, lambda: np.arange(N))
+    assert scanned == [N // 20] #只比较 source 索引匹配的行, 而不是全部行
+    assert rows.tolist() == [row for row in range(N) if match_where(metadatas[row], where)]
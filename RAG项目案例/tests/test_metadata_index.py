@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+
+from metadata_index import MetadataIndex, match_where
+
+FIELDS = ["source", "operator"]
+TIME_FIELDS = ["create_time"]
+
+
+def make_metadatas(start, end):
+    return [
+        {"source": f"file{i % 7}.txt", "operator": "admin", "create_time": f"2024-{1 + (i * 5) % 12:02d}-01 00:00:00"}
+        for i in range(start, end)
+    ]
+
+
+def expected_rows(metadatas, where):
+    return [row for row, metadata in enumerate(metadatas) if match_where(metadata, where)]
+
+
+def select(index, where, count):
+    def scan(rows, rest):
+        raise AssertionError("条件都能用索引计算, 不应该逐行比较")
+    return index.select(where, scan, lambda: np.arange(count)).tolist()
+
+
+WHERES = [
+    {"source": "file3.txt"},
+    {"operator": "admin"},
+    {"source": {"$in": ["file1.txt", "file5.txt"]}},
+    {"create_time": {"$gte": "2024-03-01 00:00:00", "$lt": "2024-06-01 00:00:00"}},
+    {"$and": [{"source": "file2.txt"}, {"create_time": {"$lte": "2024-04-01 00:00:00"}}]},
+]
+
+
+def test_batches_match_full_scan(tmp_path):
+    #时间乱序写入, 索引在查询时排序
+    index = MetadataIndex(str(tmp_path), FIELDS, TIME_FIELDS)
+    metadatas = make_metadatas(0, 500)
+    for start in range(0, 500, 10):
+        index.add(start, metadatas[start:start + 10])
+        assert select(index, WHERES[3], start + 10) == expected_rows(metadatas[:start + 10], WHERES[3])
+    for where in WHERES:
+        assert select(index, where, 500) == expected_rows(metadatas, where)
+
+
+def test_other_instance_sees_new_values(tmp_path):
+    writer = MetadataIndex(str(tmp_path), FIELDS, TIME_FIELDS)
+    reader = MetadataIndex(str(tmp_path), FIELDS, TIME_FIELDS)
+    metadatas = make_metadatas(0, 50)
+    writer.add(0, metadatas)
+    assert reader.sync(50) == 50
+
+    more = [{"source": "new.txt", "operator": "guest", "create_time": "2023-01-01 00:00:00"} for _ in range(5)]
+    writer.add(50, more)
+    assert reader.sync(55) == 55
+    metadatas += more
+    for where in WHERES + [{"source": "new.txt"}, {"operator": "guest"}]:
+        assert select(reader, where, 55) == expected_rows(metadatas, where)
+
+
+def test_legacy_header_values(tmp_path):
+    #旧版 meta.json 保存完整的取值表, 没有 meta_values.jsonl
+    writer = MetadataIndex(str(tmp_path), FIELDS, TIME_FIELDS)
+    metadatas = make_metadatas(0, 30)
+    writer.add(0, metadatas)
+    (tmp_path / "meta_values.jsonl").unlink()
+    (tmp_path / "meta.json").write_text(json.dumps({"count": 30, "values": writer.values}), encoding="utf-8")
+
+    index = MetadataIndex(str(tmp_path), FIELDS, TIME_FIELDS)
+    assert index.sync(30) == 30
+    index.add(30, [{"source": "new.txt", "operator": "admin"}])
+    metadatas.append({"source": "new.txt", "operator": "admin"})
+
+    reader = MetadataIndex(str(tmp_path), FIELDS, TIME_FIELDS)
+    assert reader.sync(31) == 31
+    for where in WHERES + [{"source": "new.txt"}]:
+        assert select(reader, where, 31) == expected_rows(metadatas, where)
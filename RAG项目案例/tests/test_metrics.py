@@ -0,0 +1,33 @@
+import json
+import time
+
+from metrics import Metrics
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_dump_in_background(tmp_path):
+    json_path = tmp_path / "metrics.json"
+    metrics = Metrics(json_path=str(json_path), prometheus_path="", dump_interval=0.1)
+    metrics.record("total", 0.5)
+    assert wait_for(json_path.exists)
+    assert json.loads(json_path.read_text(encoding="utf-8"))["total"]["count"] == 1
+    metrics.close()
+
+
+def test_record_survives_unwritable_path(tmp_path, capsys):
+    blocker = tmp_path / "not_a_dir"
+    blocker.write_text("")
+    metrics = Metrics(json_path=str(blocker / "metrics.json"), prometheus_path="", dump_interval=0.1)
+    for _ in range(5):
+        metrics.record("total", 0.1) #写文件失败不会传到记录样本的请求中
+    output = []
+    assert wait_for(lambda: output.append(capsys.readouterr().out) or "耗时统计写出失败" in "".join(output))
+    assert metrics.snapshot()["total"]["count"] == 5
+    metrics.json_path = "" #close 时不再重试
+    metrics.close()
@@ -1,34 +1,75 @@
-from langchain_chroma import Chroma
+import os
+
 import config_data as config
-from langchain_community.embeddings import DashScopeEmbeddings
+from embedding_cache import get_cached_embeddings
+from lexical_index import get_lexical_index
 from dotenv import load_dotenv 
 
 load_dotenv()
 
+
+def create_vector_store(embedding, backend=None, read_only=False):
+    """
+    按 config.vector_backend 创建向量库
+    embedding: 嵌入模型
+    backend: "chroma" 或 "mmap", 默认 config.vector_backend
+    read_only: 只用于检索; 内存映射向量库以只读方式打开, 不会重建写进程正在写入的文件
+    """
+    backend = backend or config.vector_backend
+    if backend == "mmap":
+        from mmap_vector_store import MmapVectorStore
+
+        return MmapVectorStore(embedding, persist_directory=config.mmap_store_directory, mode="r" if read_only else "r+")
+    if backend == "chroma":
+        from langchain_chroma import Chroma
+
+        os.makedirs(config.persist_directory, exist_ok=True) #创建数据库本地存储文件夹
+        return Chroma(
+            collection_name = config.collection_name, #数据库的表名
+            embedding_function= embedding,
+            persist_directory= config.persist_directory #向量数据库保存路径
+        )
+    raise ValueError(f"不支持的向量库后端: {backend}")
+
+
+def upsert_embeddings(vector_store, ids, texts, embeddings, metadatas):
+    """
+    写入已经向量化的片段, id 已存在时覆盖
+    """
+    if hasattr(vector_store, "add_embeddings"):
+        vector_store.add_embeddings(ids, texts, embeddings, metadatas)
+    else:
+        vector_store._collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+
+
 class VectorStoreService(object):
     def __init__(self, embedding):
         """
         embedding: 嵌入模型的传入
         """
         self.embedding = embedding
-        self.vector_store = Chroma(
-            collection_name = config.collection_name, #数据库的表名
-            embedding_function= self.embedding,
-            persist_directory= config.persist_directory #向量数据库保存路径
-        )
+        self.vector_store = create_vector_store(self.embedding, read_only=True) #Chroma 或内存映射向量库, 见 config.vector_backend; 只用于检索
 
-    def get_retriever(self):
+    def get_retriever(self, top_k=None):
         """
         获取向量数据库的检索器
-        top_k: 检索时返回的最相似的文本数量
+        top_k: 检索时返回的最相似的文本数量, 默认 config.similarity_top_k
+        config.hybrid_search 为 True 时返回 BM25 + 向量的混合检索器
         """
-        retriever = self.vector_store.as_retriever(search_kwargs={"k": config.similarity_top_k})
+        top_k = top_k or config.similarity_top_k
+        if not config.hybrid_search:
+            return self.vector_store.as_retriever(search_kwargs={"k": top_k})
+
+        #向量检索多取一些候选, 与词法检索的结果融合后再取 top_k
+        dense = self.vector_store.as_retriever(search_kwargs={"k": max(top_k, config.hybrid_candidates)})
+        from hybrid_retriever import HybridRetriever #只有问答服务需要检索器, 入库时不加载
+        retriever = HybridRetriever(vector_retriever=dense, lexical_index=get_lexical_index(), top_k=top_k)
         return retriever
 
 
 
 if __name__ == "__main__":
-    embedding = DashScopeEmbeddings(model = "text-embedding-v4")
+    embedding = get_cached_embeddings(config.embedding_name)
     vector_store_service = VectorStoreService(embedding)
     retriever = vector_store_service.get_retriever()
     res = retriever.invoke("沈明宇的专业是什么？")
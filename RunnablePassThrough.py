@@ -2,12 +2,26 @@ from langchain_community.chat_models import ChatTongyi
 from langchain_community.embeddings import DashScopeEmbeddings
 from langchain_core.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
+import os
+
+from langchain_classic.embeddings import CacheBackedEmbeddings
+from langchain_classic.storage import LocalFileStore
 from langchain_chroma import Chroma
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 
 load_dotenv()
 
+#嵌入向量缓存放在脚本旁边的目录中, 与运行时的当前目录无关; 相同文本(包括重复的问题)不会重复调用远程模型
+embeddings = DashScopeEmbeddings()
+cached_embeddings = CacheBackedEmbeddings.from_bytes_store(
+    embeddings,
+    LocalFileStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache")),
+    namespace=embeddings.model,
+    query_embedding_cache=True,
+    key_encoder="sha256",
+)
+
 str_parser = StrOutputParser()
 model = ChatTongyi(model = 'qwen3-max')
 
@@ -18,7 +32,7 @@ prompt = ChatPromptTemplate.from_messages([
 
 vector_store = Chroma(
     collection_name = "my_collection",
-    embedding_function= DashScopeEmbeddings(),
+    embedding_function= cached_embeddings,
     persist_directory= "./chroma_db"
 
 )
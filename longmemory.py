@@ -1,10 +1,10 @@
 from typing import Sequence
 from langchain_core.chat_history import BaseChatMessageHistory
-import os, json 
+import os, json
 from langchain_core.messages import message_to_dict, messages_from_dict, BaseMessage
 from dotenv import load_dotenv
 from langchain_community.chat_models.tongyi import ChatTongyi
-from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
@@ -12,52 +12,61 @@ from langchain_core.runnables.history import RunnableWithMessageHistory
 #messages_from_dict: dict -> BaseMessage
 
 class FileChatMessageHistory(BaseChatMessageHistory):
+    """
+    追加写的 JSONL 会话历史: 每行一条消息, 每轮只在文件末尾追加新消息, 不重写已有内容
+    旧版整体保存的 {session_id}.json 在第一次使用时转换成 JSONL
+    """
+
     def __init__(self, storage_path: str, session_id: str):
         self.storage_path = storage_path
         self.session_id = session_id
 
         #whole file path
-        self.file_path = os.path.join(self.storage_path, f"{self.session_id}.json")
+        self.file_path = os.path.join(self.storage_path, f"{self.session_id}.jsonl")
 
         os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
 
-    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
-        all_messages = list(self.messages)  # Existing messages
-        all_messages.extend(messages)  # Add new messages + existing msg
+        legacy_path = os.path.join(self.storage_path, f"{self.session_id}.json")
+        if not os.path.exists(self.file_path) and os.path.exists(legacy_path):
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                self._write(json.load(f), "w")
+
+    def _write(self, messages_data, mode):
+        #一次 write 写入整批消息
+        text = "".join(json.dumps(data, ensure_ascii=False) + "\n" for data in messages_data)
+        if mode == "a" and os.path.exists(self.file_path) and os.path.getsize(self.file_path):
+            with open(self.file_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    text = "\n" + text #上次写入崩溃留下了半行, 另起一行, 半行在读取时跳过
+        with open(self.file_path, mode, encoding="utf-8") as f:
+            f.write(text)
 
-        #store to local file
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
         #类对象写入文件会得到一堆二进制
         #为了方便，将baseMessage转成dict，再写入文件
         #官方提供了message_to_dict方法，可以直接将BaseMessage转成dict
-        # new_messages = []
-        # for message in all_messages:
-        #     new_messages.append(message_to_dict(message))
-
-        new_messages = [message_to_dict(message) for message in all_messages]
-        #将数据写入文件
-        with open(self.file_path, "w", encoding="utf-8") as f:
-            json.dump(new_messages, f)
-        
+        self._write([message_to_dict(message) for message in messages], "a")
 
     @property #将msg当作成员属性来访问
     def messages(self) -> list[BaseMessage]:
         try:
             with open(self.file_path, "r", encoding="utf-8") as f:
-                messages_data = json.load(f)
-            #将dict转成BaseMessage对象
-            # new_messages = []
-            # for message_data in messages_data:
-            #     new_messages.append(messages_from_dict(message_data))
-            new_messages = messages_from_dict(messages_data)
-            return new_messages
+                lines = f.readlines()
         except FileNotFoundError:
             return []
-        
+        messages_data = []
+        for line in lines:
+            try:
+                messages_data.append(json.loads(line))
+            except ValueError:
+                continue #崩溃时留下的半行
+        #将dict转成BaseMessage对象
+        return messages_from_dict(messages_data)
+
     def clear(self) -> None:
-        with open(self.file_path, "w", encoding="utf-8") as f:
-            json.dump([], f)
+        self._write([], "w")
 
-    
 
 load_dotenv()
 
@@ -87,7 +96,8 @@ base_chain = prompt | print_prompt | model | str_parser
 
 #get memory based on session id
 def get_history(session_id: str) -> FileChatMessageHistory:
-    return FileChatMessageHistory(storage_path="./chat_history", session_id=session_id)
+    #会话历史保存在脚本旁边的 chat_history 目录, 与运行时的当前目录无关
+    return FileChatMessageHistory(storage_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_history"), session_id=session_id)
 
 
 
@@ -4,11 +4,26 @@ from langchain_community.document_loaders import CSVLoader
 from langchain_chroma import Chroma
 
 from dotenv import load_dotenv
+import os
+
+from langchain_classic.embeddings import CacheBackedEmbeddings
+from langchain_classic.storage import LocalFileStore
 
 load_dotenv()
+
+#嵌入向量缓存放在脚本旁边的目录中, 与运行时的当前目录无关; 相同文本(包括重复的问题)不会重复调用远程模型
+embeddings = DashScopeEmbeddings()
+cached_embeddings = CacheBackedEmbeddings.from_bytes_store(
+    embeddings,
+    LocalFileStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache")),
+    namespace=embeddings.model,
+    query_embedding_cache=True,
+    key_encoder="sha256",
+)
+
 vector_store = Chroma(
     collection_name = "my_collection",
-    embedding_function= DashScopeEmbeddings(),
+    embedding_function= cached_embeddings,
     persist_directory= "./chroma_db"
 
 )